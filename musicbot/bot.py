@@ -33,6 +33,7 @@ from .constants import (
     DATA_GUILD_FILE_CUR_SONG,
     DATA_GUILD_FILE_QUEUE,
     DEFAULT_BOT_NAME,
+    DEFAULT_LOOP_LAG_REPORT_SIZE,
     DEFAULT_OWNER_GROUP_NAME,
     DEFAULT_PERMS_GROUP_NAME,
     DEFAULT_PING_HTTP_URI,
@@ -56,10 +57,15 @@ from .constructs import GuildSpecificData, Response
 from .entry import LocalFilePlaylistEntry, StreamPlaylistEntry, URLPlaylistEntry
 from .filecache import AudioFileCache
 from .json import Json
+from .loopmonitor import LoopLagMonitor
+from .mediastore import MediaStore
 from .opus_loader import load_opus_lib
 from .permissions import PermissionGroup, Permissions, PermissionsDefaults
-from .player import MusicPlayer
+from .player import FrameTimingStats, MusicPlayer
 from .playlist import Playlist
+from .procpool import helper_procs
+from .retry import RetryClass, classify_error
+from .scheduler import DownloadScheduler
 from .spotify import Spotify
 from .utils import (
     _func_,
@@ -74,6 +80,7 @@ from .utils import (
     owner_only,
     slugify,
 )
+from .workers import audio_workers
 
 # optional imports
 try:
@@ -183,7 +190,10 @@ class MusicBot(discord.Client):
 
         self.aiolocks: DefaultDict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
         self.filecache = AudioFileCache(self)
+        self.media_store = MediaStore(self)
         self.downloader = downloader.Downloader(self)
+        self.download_scheduler = DownloadScheduler(self)
+        self.loop_monitor = LoopLagMonitor(self.config.loop_lag_threshold)
 
         # Factory function for server specific data objects.
         def server_factory() -> GuildSpecificData:
@@ -245,6 +255,9 @@ class MusicBot(discord.Client):
 
     async def setup_hook(self) -> None:
         """async init phase that is called by d.py before login."""
+        if self.config.loop_lag_threshold:
+            self.loop_monitor.start(self.loop)
+
         if self.config.enable_queue_history_global:
             await self.playlist_mgr.global_history.load()
 
@@ -1258,9 +1271,14 @@ class MusicBot(discord.Client):
             log.debug("Logout under way, ignoring this event.")
             return
 
-        # handle history playlist updates.
+        # Gapless playback and crossfade may start the next entry while this
+        # runs, so read the state of the finished entry before any await.
         guild = player.voice_client.guild
         last_played_url = self.server_data[guild.id].current_playing_url
+        self.server_data[guild.id].current_playing_url = ""
+        last_np_msg = self.server_data[guild.id].last_np_msg
+
+        # handle history playlist updates.
         if self.config.enable_queue_history_global and last_played_url:
             await self.playlist_mgr.global_history.add_track(last_played_url)
 
@@ -1268,7 +1286,6 @@ class MusicBot(discord.Client):
             history = await self.server_data[guild.id].get_played_history()
             if history is not None:
                 await history.add_track(last_played_url)
-        self.server_data[guild.id].current_playing_url = ""
 
         if not player.voice_client.is_connected():
             log.debug(
@@ -1278,14 +1295,12 @@ class MusicBot(discord.Client):
 
         if self.config.leave_after_queue_empty:
             guild = player.voice_client.guild
-            if len(player.playlist.entries) == 0:
+            if len(player.playlist.entries) == 0 and not player.current_entry:
                 log.info("Player finished and queue is empty, leaving voice channel...")
                 await self.disconnect_voice_client(guild)
 
         # delete last_np_msg somewhere if we have cached it
         if self.config.delete_nowplaying:
-            guild = player.voice_client.guild
-            last_np_msg = self.server_data[guild.id].last_np_msg
             if last_np_msg:
                 await self.safe_delete_message(last_np_msg)
 
@@ -1406,9 +1421,11 @@ class MusicBot(discord.Client):
                         e,
                     )
 
-                    await self.server_data[guild.id].autoplaylist.remove_track(
-                        song_url, ex=e, delete_from_ap=self.config.remove_ap
-                    )
+                    # songs which failed for network reasons may work later.
+                    if classify_error(e) == RetryClass.PERMANENT:
+                        await self.server_data[guild.id].autoplaylist.remove_track(
+                            song_url, ex=e, delete_from_ap=self.config.remove_ap
+                        )
                     continue
 
                 except (
@@ -1422,9 +1439,11 @@ class MusicBot(discord.Client):
                         exc_info=True,
                     )
 
-                    await self.server_data[guild.id].autoplaylist.remove_track(
-                        song_url, ex=e, delete_from_ap=self.config.remove_ap
-                    )
+                    # songs which failed for network reasons may work later.
+                    if classify_error(e) == RetryClass.PERMANENT:
+                        await self.server_data[guild.id].autoplaylist.remove_track(
+                            song_url, ex=e, delete_from_ap=self.config.remove_ap
+                        )
                     continue
 
                 except exceptions.MusicbotException:
@@ -2095,6 +2114,10 @@ class MusicBot(discord.Client):
             if sys.version_info >= (3, 9):
                 tps_args["cancel_futures"] = True
             self.downloader.thread_pool.shutdown(**tps_args)
+            self.downloader.download_pool.shutdown(**tps_args)
+            self.loop_monitor.stop()
+            # worker processes close their ffmpeg streams as they exit.
+            audio_workers.shutdown()
 
             # Inspect all waiting tasks and either cancel them or let them finish.
             pending_tasks = []
@@ -2126,6 +2149,9 @@ class MusicBot(discord.Client):
                 await asyncio.gather(*pending_tasks, return_exceptions=True)
                 await asyncio.sleep(0.5)
 
+            # keep remembered extractions for the next start.
+            await self.downloader.extraction_cache.save()
+
             # ensure connector is closed.
             if self.http.connector:
                 log.debug("Closing HTTP Connector.")
@@ -3708,6 +3734,13 @@ class MusicBot(discord.Client):
                 expire_in=30,
             )
 
+        # Swap in a new source without restarting playback, if possible.
+        if await _player.restart_source(start_time=f_seek_time):
+            return Response(
+                f"Seeking to time `{seek_time}` (`{f_seek_time:.2f}` seconds) in the current song.",
+                delete_after=30,
+            )
+
         entry = _player.current_entry
         entry.set_start_time(f_seek_time)
         _player.playlist.insert_entry_at_index(0, entry)
@@ -3918,9 +3951,7 @@ class MusicBot(discord.Client):
             expire_in=30,
         )
 
-        song = player.playlist.delete_entry_at_index(indexes[0])
-
-        player.playlist.insert_entry_at_index(indexes[1], song)
+        player.playlist.move_entry(indexes[0], indexes[1])
         return None
 
     async def _cmd_play_compound_link(
@@ -5090,6 +5121,7 @@ class MusicBot(discord.Client):
                         ]
                         for entry in entry_indexes:
                             player.playlist.entries.remove(entry)
+                        player.playlist.refresh_prefetch()
                         entry_text = f"{len(entry_indexes)} item"
                         if len(entry_indexes) > 1:
                             entry_text += "s"
@@ -5484,6 +5516,13 @@ class MusicBot(discord.Client):
                 expire_in=30,
             ) from e
 
+        # Swap in a new source at the new speed without restarting playback, if possible.
+        if await player.restart_source(playback_speed=speed):
+            return Response(
+                f"Setting playback speed to `{speed:.3f}` for current track.",
+                delete_after=30,
+            )
+
         # Set current playback progress and speed then restart playback.
         entry = player.current_entry
         entry.set_start_time(player.progress)
@@ -7372,6 +7411,168 @@ class MusicBot(discord.Client):
             delete_after=30,
         )
 
+    @owner_only
+    async def cmd_playerstats(
+        self,
+        guild: discord.Guild,
+        channel: MessageableChannel,
+        option: str = "",
+    ) -> CommandResponse:
+        """
+        Usage:
+            {command_prefix}playerstats [all]
+
+        Prints audio frame timing and ffmpeg output stats for the player in
+        this guild, or for every player if `all` is given.
+        Frame times show how long each 20ms frame took to produce, so slow
+        frames point to a player starved by CPU, disk, or ffmpeg.
+        Download scheduler and helper process queue depth and wait times,
+        and extraction cache hit rates are shown last.
+        """
+        if option.lower() == "all":
+            players = list(self.players.values())
+        elif guild.id in self.players:
+            players = [self.players[guild.id]]
+        else:
+            players = []
+
+        if not players:
+            return Response("No players to show stats for.", delete_after=30)
+
+        buckets = [f"<={ms}ms" for ms in FrameTimingStats.BUCKETS_MS] + ["slower"]
+        lines = []
+        for player in players:
+            timing = player.frame_timing
+            hist = ", ".join(
+                f"{name}: {count}" for name, count in zip(buckets, timing.histogram())
+            )
+            diagnostics = ", ".join(
+                f"{cat}: {count}" for cat, count in player.ffmpeg_diagnostics.items()
+            )
+            gap = player.transition_gap
+            seek = player.last_seek_latency
+            lines.append(
+                f"{player.voice_client.guild.name} ({player.state})\n"
+                f"  frames: {timing.frames}  empty: {timing.empty_reads}  "
+                f"short: {timing.short_reads}  slow: {timing.slow_frames}\n"
+                f"  p50: {timing.percentile(50) * 1000:.2f}ms  "
+                f"p99: {timing.percentile(99) * 1000:.2f}ms  "
+                f"max: {timing.max_time * 1000:.2f}ms\n"
+                f"  recent: {hist}\n"
+                f"  ffmpeg: {diagnostics or 'nothing'}\n"
+                f"  gap: {'n/a' if gap is None else f'{gap * 1000:.1f}ms'}  "
+                f"seek: {'n/a' if seek is None else f'{seek * 1000:.1f}ms'}"
+            )
+
+        dl = self.download_scheduler.stats()
+        queued = ", ".join(f"{name}: {count}" for name, count in dl["queued"].items())
+        lines.append(
+            f"Downloads  active: {dl['active']}/{dl['max_active']}  "
+            f"prefetched: {format_size_from_bytes(dl['prefetch_bytes'])}\n"
+            f"  queued: {queued}\n"
+            f"  wait avg: {dl['avg_wait']:.2f}s  max: {dl['max_wait']:.2f}s  "
+            f"oldest: {dl['oldest_wait']:.2f}s"
+        )
+
+        hp = helper_procs.stats()
+        queued = ", ".join(f"{name}: {count}" for name, count in hp["queued"].items())
+        lines.append(
+            f"Helper processes  active: {hp['active']}/{hp['max_active']}  "
+            f"completed: {hp['completed']}  timeouts: {hp['timeouts']}\n"
+            f"  queued: {queued}\n"
+            f"  wait avg: {hp['avg_wait']:.2f}s  max: {hp['max_wait']:.2f}s"
+        )
+
+        ec = self.downloader.extraction_cache.stats()
+        lines.append(
+            f"Extraction cache  entries: {ec['entries']}/{ec['max_entries']}  "
+            f"hit rate: {ec['hit_rate'] * 100:.1f}%\n"
+            f"  hits: {ec['hits']}  misses: {ec['misses']}  shared: {ec['shared']}  "
+            f"expired: {ec['expired']}  evicted: {ec['evictions']}"
+        )
+
+        # split the stats over several messages if needed, leaving room for code blocks.
+        limit = DISCORD_MSG_CHAR_LIMIT - 20
+        pages: List[str] = []
+        for block in lines:
+            block = block[:limit]
+            if pages and len(pages[-1]) + len(block) + 1 <= limit:
+                pages[-1] = f"{pages[-1]}\n{block}"
+            else:
+                pages.append(block)
+
+        for page in pages[:-1]:
+            await self.safe_send_message(channel, f"```txt\n{page}\n```", expire_in=60)
+
+        return Response(pages[-1], codeblock="txt", delete_after=60)
+
+    @owner_only
+    async def cmd_looplag(
+        self,
+        author: discord.Member,
+        channel: MessageableChannel,
+        option: str = "",
+    ) -> CommandResponse:
+        """
+        Usage:
+            {command_prefix}looplag [full | reset]
+
+        Prints event loop lag stats and the code which blocked the loop for
+        the longest, as recorded when LoopLagThreshold is enabled.
+        Use `full` to be sent a report with complete stack traces, or
+        `reset` to clear the recorded stalls.
+        """
+        if not self.loop_monitor.running:
+            raise exceptions.CommandError(
+                "The loop lag monitor is not enabled, set LoopLagThreshold in the options file to use it.",
+                expire_in=30,
+            )
+
+        option = option.lower()
+        if option == "reset":
+            self.loop_monitor.reset()
+            return Response("Cleared recorded event loop stalls.", delete_after=20)
+
+        if option != "full":
+            report = self.loop_monitor.format_report(
+                DEFAULT_LOOP_LAG_REPORT_SIZE, depth=3
+            )
+            # leave room for the code block around the report.
+            limit = DISCORD_MSG_CHAR_LIMIT - 20
+            if len(report) > limit:
+                report = report[:limit].rsplit("\n", 1)[0]
+            return Response(report, codeblock="txt", delete_after=60)
+
+        sent_to_channel = None
+        msg_str = "Here is the event loop lag report."
+        report = self.loop_monitor.format_report(len(self.loop_monitor.records))
+
+        # TODO: refactor this in favor of safe_send_message doing it all.
+        with BytesIO() as fcontent:
+            fcontent.write(report.encode("utf8"))
+            fcontent.seek(0)
+            datafile = discord.File(fcontent, filename="looplag_report.txt")
+
+            try:
+                # try to DM. this could fail for users with strict privacy settings.
+                # or users who just can't get direct messages.
+                await author.send(msg_str, file=datafile)
+
+            except discord.errors.HTTPException as e:
+                if e.code == 50007:  # cannot send to this user.
+                    log.debug("DM failed, sending in channel instead.")
+                    sent_to_channel = await channel.send(
+                        msg_str,
+                        file=datafile,
+                    )
+                else:
+                    raise
+        if not sent_to_channel:
+            return Response(
+                "Sent a message with the event loop lag report.", delete_after=20
+            )
+        return None
+
     async def cmd_latency(self, guild: discord.Guild) -> CommandResponse:
         """
         Usage:
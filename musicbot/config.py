@@ -437,7 +437,185 @@ class Config:
             getter="getboolean",
             comment=(
                 "Enable MusicBot to download the next song in the queue while a song is playing.\n"
-                "Currently this option does not apply to auto-playlist or songs added to an empty queue."
+                "Currently this option does not apply to auto-playlist songs."
+            ),
+        )
+        self.pre_download_entries: int = self.register.init_option(
+            section="MusicBot",
+            option="PreDownloadEntries",
+            dest="pre_download_entries",
+            default=ConfigDefaults.pre_download_entries,
+            getter="getint",
+            comment=(
+                "The number of songs in the queue MusicBot will download ahead of time, "
+                "when PreDownloadNextSong is enabled."
+            ),
+        )
+        self.pre_download_seconds: float = self.register.init_option(
+            section="MusicBot",
+            option="PreDownloadSeconds",
+            dest="pre_download_seconds",
+            default=ConfigDefaults.pre_download_seconds,
+            getter="getduration",
+            comment=(
+                "Stop downloading ahead once the queued songs add up to this much audio. "
+                "Set to 0 to only use PreDownloadEntries."
+            ),
+        )
+        self.pre_download_max_bytes: int = self.register.init_option(
+            section="MusicBot",
+            option="PreDownloadMaxBytes",
+            dest="pre_download_max_bytes",
+            default=ConfigDefaults.pre_download_max_bytes,
+            getter="getdatasize",
+            comment=(
+                "Limit the disk space used by songs downloaded ahead of time, for all servers. "
+                "Set to 0 to disable."
+            ),
+        )
+        self.pre_download_bandwidth: int = self.register.init_option(
+            section="MusicBot",
+            option="PreDownloadBandwidth",
+            dest="pre_download_bandwidth",
+            default=ConfigDefaults.pre_download_bandwidth,
+            getter="getdatasize",
+            comment=(
+                "Limit the average bytes per second used to download songs ahead of time, "
+                "for all servers. Set to 0 to disable."
+            ),
+        )
+        self.gapless_playback: bool = self.register.init_option(
+            section="MusicBot",
+            option="GaplessPlayback",
+            dest="gapless_playback",
+            default=ConfigDefaults.gapless_playback,
+            getter="getboolean",
+            comment=(
+                "Enable MusicBot to open the next song in the queue a few seconds before the current song ends.\n"
+                "This reduces the silence between songs, at the cost of running an extra ffmpeg process near the end of each track."
+            ),
+        )
+        self.use_opus_audio: bool = self.register.init_option(
+            section="MusicBot",
+            option="UseOpusAudio",
+            dest="use_opus_audio",
+            default=ConfigDefaults.use_opus_audio,
+            getter="getboolean",
+            comment=(
+                "Enable MusicBot to have ffmpeg encode Opus audio directly, instead of decoding to PCM for Python to encode.\n"
+                "This uses less CPU per stream, and media that is already Opus can be sent without re-encoding.\n"
+                "Volume is applied by ffmpeg in this mode, so changing volume will briefly restart the current song at its position."
+            ),
+        )
+        self.crossfade_seconds: float = self.register.init_option(
+            section="MusicBot",
+            option="CrossfadeSeconds",
+            dest="crossfade_seconds",
+            default=ConfigDefaults.crossfade_seconds,
+            getter="getfloat",
+            comment=(
+                "Number of seconds to overlap the end of a song with the start of the next song in the queue.\n"
+                "Crossfade requires the optional numpy module and cannot be used with UseOpusAudio. Set to 0 to disable."
+            ),
+        )
+        self.share_stream_decoders: bool = self.register.init_option(
+            section="MusicBot",
+            option="ShareStreamDecoders",
+            dest="share_stream_decoders",
+            default=ConfigDefaults.share_stream_decoders,
+            getter="getboolean",
+            comment=(
+                "Enable MusicBot to decode a live stream once and share the audio with every server playing the same stream.\n"
+                "This reduces CPU and bandwidth use when many servers listen to the same radio station. Not used with UseOpusAudio."
+            ),
+        )
+        self.audio_worker_processes: int = self.register.init_option(
+            section="MusicBot",
+            option="AudioWorkerProcesses",
+            dest="audio_worker_processes",
+            default=ConfigDefaults.audio_worker_processes,
+            getter="getint",
+            comment=(
+                "Number of worker processes used to decode, set volume, and encode audio for all players.\n"
+                "Workers let MusicBot use more than one CPU core when playing in many servers at once.\n"
+                "Set to 0 to process audio in the main process. Not used with UseOpusAudio, and disables crossfade."
+            ),
+        )
+        self.transcode_cache_to_opus: bool = self.register.init_option(
+            section="MusicBot",
+            option="TranscodeCacheToOpus",
+            dest="transcode_cache_to_opus",
+            default=ConfigDefaults.transcode_cache_to_opus,
+            getter="getboolean",
+            comment=(
+                "Transcode downloaded audio in the background to Ogg Opus files, so every cached file uses the same format.\n"
+                "Opus files use less disk space, and can be played without re-encoding when UseOpusAudio is enabled.\n"
+                "Only applies when SaveVideos option is enabled."
+            ),
+        )
+        self.progressive_playback: bool = self.register.init_option(
+            section="MusicBot",
+            option="ProgressivePlayback",
+            dest="progressive_playback",
+            default=ConfigDefaults.progressive_playback,
+            getter="getboolean",
+            comment=(
+                "Start playing long songs while they are still downloading, once a few seconds of audio are saved.\n"
+                "The completed download is still kept in the audio cache. Not available on Windows."
+            ),
+        )
+        self.trim_silence: bool = self.register.init_option(
+            section="MusicBot",
+            option="TrimSilence",
+            dest="trim_silence",
+            default=ConfigDefaults.trim_silence,
+            getter="getboolean",
+            comment=(
+                "Skip silence at the start and end of tracks, to reduce the gap between songs.\n"
+                "Tracks are analyzed in the background the first time they are played, and results are saved\n"
+                "so trimming is applied as soon as analysis is done, and on any later plays."
+            ),
+        )
+        self.extraction_cache_size: int = self.register.init_option(
+            section="MusicBot",
+            option="ExtractionCacheSize",
+            dest="extraction_cache_size",
+            default=ConfigDefaults.extraction_cache_size,
+            getter="getint",
+            comment=(
+                "The number of recent song info lookups MusicBot remembers, so queueing the same song again\n"
+                "does not need to look it up with yt-dlp. Set to 0 to disable."
+            ),
+        )
+        self.extraction_cache_ttl: float = self.register.init_option(
+            section="MusicBot",
+            option="ExtractionCacheTTL",
+            dest="extraction_cache_ttl",
+            default=ConfigDefaults.extraction_cache_ttl,
+            getter="getduration",
+            comment=(
+                "How long remembered song info may be used for. Info with stream links that expire\n"
+                "sooner is forgotten before the links stop working."
+            ),
+        )
+        self.extraction_cache_on_disk: bool = self.register.init_option(
+            section="MusicBot",
+            option="ExtractionCacheOnDisk",
+            dest="extraction_cache_on_disk",
+            default=ConfigDefaults.extraction_cache_on_disk,
+            getter="getboolean",
+            comment="Save remembered song info to the data folder, so it is kept across restarts.",
+        )
+        self.loop_lag_threshold: float = self.register.init_option(
+            section="MusicBot",
+            option="LoopLagThreshold",
+            dest="loop_lag_threshold",
+            default=ConfigDefaults.loop_lag_threshold,
+            getter="getfloat",
+            comment=(
+                "Record what blocked MusicBot's event loop whenever it stalls for longer than this many seconds.\n"
+                "Recorded stalls can be shown with the looplag command. Useful for finding the cause of choppy audio.\n"
+                "Set to 0 to disable."
             ),
         )
         self.status_message: str = self.register.init_option(
@@ -490,7 +668,10 @@ class Config:
             dest="use_experimental_equalization",
             default=ConfigDefaults.use_experimental_equalization,
             getter="getboolean",
-            comment="Tries to use ffmpeg to get volume normalizing options for use in playback.",
+            comment=(
+                "Tries to use ffmpeg to get volume normalizing options for use in playback.\n"
+                "Songs are measured in the background, so equalization applies once measuring is done and on later plays."
+            ),
         )
         self.embeds: bool = self.register.init_option(
             section="MusicBot",
@@ -1028,6 +1209,51 @@ class Config:
             )
             self.default_speed = max(min(self.default_speed, 100.0), 0.5)
 
+        if self.crossfade_seconds < 0 or self.crossfade_seconds > 30.0:
+            log.warning(
+                "The crossfade time must be between 0 and 30 seconds. "
+                "The option value of %.3f will be limited instead.",
+                self.crossfade_seconds,
+            )
+            self.crossfade_seconds = max(min(self.crossfade_seconds, 30.0), 0.0)
+
+        if self.crossfade_seconds and self.use_opus_audio:
+            log.warning(
+                "Crossfade cannot be used with UseOpusAudio enabled, it will be disabled."
+            )
+            self.crossfade_seconds = 0.0
+
+        if self.pre_download_entries < 1:
+            log.warning(
+                "PreDownloadEntries must be at least 1, the option value of %d will be limited instead.",
+                self.pre_download_entries,
+            )
+            self.pre_download_entries = 1
+
+        if self.extraction_cache_size < 0:
+            log.warning(
+                "ExtractionCacheSize cannot be negative, the extraction cache will be disabled."
+            )
+            self.extraction_cache_size = 0
+
+        if self.loop_lag_threshold < 0:
+            log.warning(
+                "LoopLagThreshold cannot be negative, the loop lag monitor will be disabled."
+            )
+            self.loop_lag_threshold = 0.0
+
+        if self.audio_worker_processes < 0:
+            log.warning(
+                "The number of audio worker processes cannot be negative, workers will be disabled."
+            )
+            self.audio_worker_processes = 0
+
+        if self.crossfade_seconds and self.audio_worker_processes:
+            log.warning(
+                "Crossfade cannot be used with AudioWorkerProcesses enabled, it will be disabled."
+            )
+            self.crossfade_seconds = 0.0
+
         if self.enable_local_media and not self.media_file_dir.is_dir():
             self.media_file_dir.mkdir(exist_ok=True)
 
@@ -1313,6 +1539,22 @@ class ConfigDefaults:
 
     ytdlp_use_oauth2: bool = False
     pre_download_next_song: bool = True
+    pre_download_entries: int = 1
+    pre_download_seconds: float = 0.0
+    pre_download_max_bytes: int = 0
+    pre_download_bandwidth: int = 0
+    gapless_playback: bool = False
+    use_opus_audio: bool = False
+    crossfade_seconds: float = 0.0
+    share_stream_decoders: bool = False
+    audio_worker_processes: int = 0
+    transcode_cache_to_opus: bool = False
+    progressive_playback: bool = False
+    trim_silence: bool = False
+    extraction_cache_size: int = 200
+    extraction_cache_ttl: float = 3600.0
+    extraction_cache_on_disk: bool = False
+    loop_lag_threshold: float = 0.0
 
     song_blocklist: Set[str] = set()
     user_blocklist: Set[int] = set()
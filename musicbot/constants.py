@@ -60,6 +60,11 @@ DEFAULT_DATA_DIR: str = "data/"
 # File names within the DEFAULT_DATA_DIR or guild folders.
 DATA_FILE_SERVERS: str = "server_names.txt"
 DATA_FILE_CACHEMAP: str = "playlist_cachemap.json"
+DATA_FILE_TRANSCODEMAP: str = "transcode_cachemap.json"
+DATA_FILE_MEDIA_INDEX: str = "media_index.json"
+DATA_FILE_CACHE_MANIFEST: str = "cache_manifest.json"
+DATA_FILE_CONTENTMAP: str = "cache_contentmap.json"
+DATA_FILE_EXTRACTION_CACHE: str = "extraction_cache.json"
 DATA_FILE_COOKIES: str = "cookies.txt"  # No support for this, go read yt-dlp docs.
 DATA_FILE_YTDLP_OAUTH2: str = "oauth2.token"
 DATA_GUILD_FILE_QUEUE: str = "queue.json"
@@ -110,12 +115,88 @@ VOICE_CLIENT_MAX_RETRY_CONNECT: int = 5
 
 # Maximum number of threads MusicBot will use for downloading and extracting info.
 DEFAULT_MAX_INFO_DL_THREADS: int = 2
+# Maximum number of entry downloads MusicBot will run at the same time.
+DEFAULT_MAX_CONCURRENT_DOWNLOADS: int = 3
+# Maximum number of entry downloads from a single host at the same time.
+DEFAULT_MAX_DOWNLOADS_PER_HOST: int = 2
+# Number of recent download requests kept for scheduler wait time stats.
+DEFAULT_DOWNLOAD_WAIT_SAMPLES: int = 100
+# Bitrate in kbps assumed when estimating download size, if extraction did not report one.
+DEFAULT_ESTIMATED_BITRATE: int = 160
 # Maximum number of seconds to wait for HEAD request on media files.
 DEFAULT_MAX_INFO_REQUEST_TIMEOUT: int = 10
 
+# Maximum number of calls made for a request which keeps failing with retryable errors.
+DEFAULT_RETRY_ATTEMPTS: int = 3
+# Seconds to wait before the first retry, doubled for each retry after it.
+DEFAULT_RETRY_BASE_DELAY: float = 1.5
+# Maximum number of seconds to wait between two retries.
+DEFAULT_RETRY_MAX_DELAY: float = 30.0
+# Seconds after a request starts, after which it will not be retried again.
+DEFAULT_RETRY_DEADLINE: float = 120.0
+# Minimum seconds to wait after being rate limited, if the remote does not say.
+DEFAULT_RETRY_RATE_LIMIT_DELAY: float = 10.0
+
 # Time to wait before starting pre-download when a new song is playing.
 DEFAULT_PRE_DOWNLOAD_DELAY: float = 4.0
 
+# Time in seconds before the end of a track when gapless playback opens the next source.
+DEFAULT_GAPLESS_PRIME_LEAD: float = 5.0
+# Number of audio frames (20ms each) read ahead from the next source when priming it.
+DEFAULT_GAPLESS_PRIME_FRAMES: int = 10
+# Number of recent ffmpeg stderr lines kept for each playback source.
+DEFAULT_FFMPEG_STDERR_LINES: int = 50
+# Number of audio frames (20ms each) used to smoothly apply volume changes in the PCM mixer.
+DEFAULT_MIXER_RAMP_FRAMES: int = 5
+# Number of recent audio frames (20ms each) kept for frame timing stats, one minute by default.
+DEFAULT_FRAME_TIMING_WINDOW: int = 3000
+# Number of audio frames (20ms each) a player may fall behind a shared stream decoder before it is detached.
+DEFAULT_SHARED_DECODER_QUEUE_FRAMES: int = 50
+# Number of Opus packets (20ms each) an audio worker process may encode ahead of playback.
+DEFAULT_AUDIO_WORKER_CREDITS: int = 25
+# Bitrate in kbps used when transcoding cached audio to Opus, the same as discord.py voice uses.
+DEFAULT_TRANSCODE_BITRATE: int = 128
+# Maximum number of media files waiting for background analysis.
+DEFAULT_MEDIA_ANALYSIS_QUEUE: int = 100
+# Maximum number of media files probed for metadata together, in one batch.
+DEFAULT_MEDIA_PROBE_BATCH: int = 8
+# Seconds the size and mtime of a media file are reused for, before it is checked again.
+DEFAULT_MEDIA_IDENTITY_TTL: float = 10.0
+# Number of recent media file identities kept before expired ones are dropped.
+DEFAULT_MEDIA_IDENTITY_CACHE: int = 500
+# Seconds of audio to download before progressive playback starts.
+DEFAULT_PROGRESSIVE_BUFFER_SECONDS: float = 15.0
+# Minimum number of bytes to download before progressive playback starts.
+DEFAULT_PROGRESSIVE_MIN_BYTES: int = 256 * 1024
+# Seconds between checks of the partial file size, while waiting to start progressive playback.
+DEFAULT_PROGRESSIVE_POLL_INTERVAL: float = 0.25
+# Seconds ffmpeg waits for a progressive download to grow, before it gives up.
+DEFAULT_PROGRESSIVE_READ_TIMEOUT: float = 10.0
+# Maximum number of ffprobe and ffmpeg helper processes run at once, not counting playback.
+DEFAULT_MAX_HELPER_PROCESSES: int = 2
+# Number of recent helper process calls kept for queue wait time stats.
+DEFAULT_HELPER_WAIT_SAMPLES: int = 100
+# Seconds a metadata probe may run before it is killed.
+DEFAULT_PROBE_TIMEOUT: float = 30.0
+# Seconds a background analysis or transcode of one file may run before it is killed.
+DEFAULT_BACKGROUND_PROC_TIMEOUT: float = 600.0
+# Seconds before a signed media URL expires that a cached extraction stops being used.
+DEFAULT_EXTRACTION_CACHE_EXPIRY_MARGIN: float = 300.0
+# Seconds to wait after the extraction cache changes before saving it to disk.
+DEFAULT_EXTRACTION_CACHE_SAVE_DELAY: float = 30.0
+# Seconds between event loop heartbeats used to measure loop lag.
+DEFAULT_LOOP_LAG_INTERVAL: float = 0.1
+# Number of recent loop lag measurements kept for stats.
+DEFAULT_LOOP_LAG_SAMPLES: int = 3000
+# Maximum number of stack frames kept for each recorded loop stall.
+DEFAULT_LOOP_LAG_STACK_DEPTH: int = 12
+# Number of loop stall offenders shown by the looplag command.
+DEFAULT_LOOP_LAG_REPORT_SIZE: int = 5
+# Audio quieter than this level in dB is treated as silence when trimming.
+DEFAULT_SILENCE_NOISE_DB: int = -50
+# Minimum length in seconds of silence that will be trimmed.
+DEFAULT_SILENCE_MIN_DURATION: float = 0.5
+
 # Time in seconds to wait before oauth2 authorization fails.
 # This provides time to authorize as well as prevent process hang at shutdown.
 DEFAULT_YTDLP_OAUTH2_TTL: float = 180.0
@@ -7,6 +7,7 @@ import importlib
 import logging
 import os
 import pathlib
+import threading
 from collections import UserDict
 from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
@@ -18,11 +19,22 @@ import yt_dlp as youtube_dl  # type: ignore[import-untyped]
 from yt_dlp.networking.exceptions import (  # type: ignore[import-untyped]
     NoSupportingHandlers,
 )
-from yt_dlp.utils import DownloadError  # type: ignore[import-untyped]
+from yt_dlp.utils import (  # type: ignore[import-untyped]
+    DownloadCancelled,
+    DownloadError,
+)
 from yt_dlp.utils import UnsupportedError
 
-from .constants import DEFAULT_MAX_INFO_DL_THREADS, DEFAULT_MAX_INFO_REQUEST_TIMEOUT
-from .exceptions import ExtractionError, MusicbotException
+from .constants import (
+    DATA_FILE_EXTRACTION_CACHE,
+    DEFAULT_DATA_DIR,
+    DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+    DEFAULT_MAX_INFO_DL_THREADS,
+    DEFAULT_MAX_INFO_REQUEST_TIMEOUT,
+)
+from .exceptions import DownloadCancelledError, ExtractionError, MusicbotException
+from .extractcache import ExtractionCache, make_extraction_key
+from .retry import RetryPolicy
 from .spotify import Spotify
 from .ytdlp_oauth2_plugin import enable_ytdlp_oauth2_plugin
 
@@ -57,6 +69,10 @@ ytdl_format_options_immutable = MappingProxyType(
         "source_address": "0.0.0.0",
         "usenetrc": True,
         "no_color": True,
+        # downloads are written to a .part file and renamed when complete.
+        # Interrupted downloads resume from the .part file using byte ranges.
+        "nopart": False,
+        "continuedl": True,
     }
 )
 
@@ -86,6 +102,12 @@ class Downloader:
             max_workers=DEFAULT_MAX_INFO_DL_THREADS,
             thread_name_prefix="MB_Downloader",
         )
+        # downloads get their own threads, so extraction is not blocked by them.
+        # The DownloadScheduler limits downloads to this many at a time.
+        self.download_pool = ThreadPoolExecutor(
+            max_workers=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+            thread_name_prefix="MB_MediaDownload",
+        )
 
         # force ytdlp and HEAD requests to use the same UA string.
         # If the constant is set, use that, otherwise use dynamic selection.
@@ -154,6 +176,109 @@ class Downloader:
             {**ytdl_format_options, "ignoreerrors": True}
         )
 
+        # shared by all extractions, so failures back off together.
+        self.retry_policy = RetryPolicy("ytdlp")
+
+        # results of info extractions, downloads are never cached here.
+        self.extraction_cache = ExtractionCache(
+            bot.config.extraction_cache_size,
+            bot.config.extraction_cache_ttl,
+            (
+                pathlib.Path(DEFAULT_DATA_DIR).joinpath(DATA_FILE_EXTRACTION_CACHE)
+                if bot.config.extraction_cache_on_disk
+                else None
+            ),
+        )
+
+        # progress hooks run in the download thread, so jobs are tracked per thread.
+        self._thread_jobs = threading.local()
+        self.unsafe_ytdl.add_progress_hook(self._progress_hook)
+
+    def _progress_hook(self, status: Dict[str, Any]) -> None:
+        """
+        Called by yt-dlp as a download makes progress.  Remembers partial
+        files and the size of finished downloads, and aborts the download
+        if its job was cancelled.
+        """
+        tmpfile = status.get("tmpfilename")
+        if tmpfile and hasattr(self._thread_jobs, "partial_files"):
+            self._thread_jobs.partial_files.add(tmpfile)
+
+        # sizes are reported before post-processors like remuxing change the file.
+        if status.get("status") == "finished" and hasattr(
+            self._thread_jobs, "downloaded_bytes"
+        ):
+            self._thread_jobs.downloaded_bytes += status.get("downloaded_bytes") or 0
+
+        cancel_event = getattr(self._thread_jobs, "cancel_event", None)
+        if cancel_event is not None and cancel_event.is_set():
+            raise DownloadCancelled()
+
+    def _run_extract_info(
+        self,
+        cancel_event: Optional[threading.Event],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Call the unsafe YoutubeDL.extract_info() in the current thread.
+        If `cancel_event` is set before or during a download, the job is
+        aborted and any partial files it left are removed.
+
+        :raises: musicbot.exceptions.DownloadCancelledError
+            if the job was cancelled.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise DownloadCancelledError("Download was cancelled before it started.")
+
+        self._thread_jobs.cancel_event = cancel_event
+        self._thread_jobs.partial_files = set()
+        self._thread_jobs.downloaded_bytes = 0
+        try:
+            data = self.unsafe_ytdl.extract_info(*args, **kwargs)
+            if isinstance(data, dict) and self._thread_jobs.downloaded_bytes:
+                data["__downloaded_bytes"] = self._thread_jobs.downloaded_bytes
+            return data
+        except DownloadCancelled as e:
+            for tmpfile in self._thread_jobs.partial_files:
+                for path in (tmpfile, f"{tmpfile}.ytdl"):
+                    try:
+                        os.unlink(path)
+                        log.debug("Removed partial file:  %s", path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError:
+                        log.warning(
+                            "Could not remove partial file:  %s", path, exc_info=True
+                        )
+            raise DownloadCancelledError("Download was cancelled.") from e
+        finally:
+            self._thread_jobs.cancel_event = None
+            self._thread_jobs.partial_files = set()
+            self._thread_jobs.downloaded_bytes = 0
+
+    async def _extract_with_retry(
+        self,
+        executor: ThreadPoolExecutor,
+        cancel_event: Optional[threading.Event],
+        song_subject: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Run extraction for `song_subject` in the given `executor`, retrying
+        transient network errors and rate limits with the shared retry policy.
+        """
+        return await self.retry_policy.run(
+            lambda: self.bot.loop.run_in_executor(
+                executor,
+                functools.partial(
+                    self._run_extract_info, cancel_event, song_subject, *args, **kwargs
+                ),
+            ),
+            what=song_subject,
+        )
+
     @property
     def ytdl(self) -> youtube_dl.YoutubeDL:
         """Get the Safe (errors ignored) instance of YoutubeDL."""
@@ -327,9 +452,12 @@ class Downloader:
 
         Single-entry search results are returned as if they were top-level extractions.
         Links for spotify tracks, albums, and playlists also get special filters.
+        Extractions which do not download are served from the extraction cache
+        while a fresh result for the same subject and options is stored.
 
         :param: song_subject: a song url or search subject.
         :kwparam: as_stream: If we should try to queue the URL anyway and let ffmpeg figure it out.
+        :kwparam: cancel_event: A threading.Event which aborts the download when set.
 
         :returns: YtdlpResponseDict object containing sanitized extraction data.
 
@@ -355,6 +483,28 @@ class Downloader:
         ):
             return self._return_local_media(song_subject)
 
+        if (
+            self.extraction_cache.enabled
+            and not args
+            and not kwargs.get("download", True)
+            and "cancel_event" not in kwargs
+        ):
+            data = await self.extraction_cache.fetch(
+                make_extraction_key(song_subject, kwargs),
+                lambda: self._extract_info(song_subject, **kwargs),
+            )
+        else:
+            data = await self._extract_info(song_subject, *args, **kwargs)
+
+        return YtdlpResponseDict(data)
+
+    async def _extract_info(
+        self, song_subject: str, *args: Any, **kwargs: Any
+    ) -> Dict[str, Any]:
+        """
+        Extract info for `song_subject` and add MusicBot's request data to
+        the result.  See Downloader.extract_info() for details.
+        """
         # Hash the URL for use as a unique ID in file paths.
         # but ignore services with multiple URLs for the same media.
         song_subject_hash = ""
@@ -402,7 +552,7 @@ class Downloader:
             redact_fields=["automatic_captions", "formats", "heatmap"],
         )
         """
-        return YtdlpResponseDict(data)
+        return data
 
     async def _filtered_extract_info(
         self, song_subject: str, *args: Any, **kwargs: Any
@@ -414,6 +564,7 @@ class Downloader:
 
         :param: song_subject: a song url or search subject.
         :kwparam: as_stream: If we should try to queue the URL anyway and let ffmpeg figure it out.
+        :kwparam: cancel_event: A threading.Event which aborts the download when set.
 
         :returns: Dictionary of data returned from extract_info() or other
             integration. Serialization ready.
@@ -435,6 +586,7 @@ class Downloader:
         """
         log.noise(f"Called extract_info with:  '{song_subject}', {args}, {kwargs}")  # type: ignore[attr-defined]
         as_stream_url = kwargs.pop("as_stream", False)
+        cancel_event: Optional[threading.Event] = kwargs.pop("cancel_event", None)
 
         # check if loop is closed and exit.
         if (self.bot.loop and self.bot.loop.is_closed()) or not self.bot.loop:
@@ -473,12 +625,12 @@ class Downloader:
                     return data
 
         # Actually call YoutubeDL extract_info.
+        executor = (
+            self.download_pool if kwargs.get("download", True) else self.thread_pool
+        )
         try:
-            data = await self.bot.loop.run_in_executor(
-                self.thread_pool,
-                functools.partial(
-                    self.unsafe_ytdl.extract_info, song_subject, *args, **kwargs
-                ),
+            data = await self._extract_with_retry(
+                executor, cancel_event, song_subject, *args, **kwargs
             )
         except DownloadError as e:
             if not as_stream_url:
@@ -508,12 +660,8 @@ class Downloader:
                 "Caught NoSupportingHandlers, trying again after replacing colon with space."
             )
             song_subject = song_subject.replace(":", " ")
-            # TODO: maybe this also needs some exception handling...
-            data = await self.bot.loop.run_in_executor(
-                self.thread_pool,
-                functools.partial(
-                    self.unsafe_ytdl.extract_info, song_subject, *args, **kwargs
-                ),
+            data = await self._extract_with_retry(
+                executor, cancel_event, song_subject, *args, **kwargs
             )
 
         # make sure the ytdlp data is serializable to make it more predictable.
@@ -684,6 +832,14 @@ class YtdlpResponseDict(YUserDict):
             return fn
         return None
 
+    @property
+    def downloaded_bytes(self) -> int:
+        """
+        Get the number of bytes yt-dlp downloaded for this info, before any
+        post-processing, or 0 if nothing was downloaded.
+        """
+        return int(self.data.get("__downloaded_bytes", 0) or 0)
+
     @property
     def entry_count(self) -> int:
         """count of existing entries if available or 0"""
@@ -2,9 +2,20 @@ import asyncio
 import datetime
 import logging
 import os
-import re
-import shutil
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Union
+import pathlib
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import discord
 from yt_dlp.utils import (  # type: ignore[import-untyped]
@@ -12,9 +23,21 @@ from yt_dlp.utils import (  # type: ignore[import-untyped]
     YoutubeDLError,
 )
 
+from .constants import (
+    DEFAULT_PROGRESSIVE_BUFFER_SECONDS,
+    DEFAULT_PROGRESSIVE_MIN_BYTES,
+    DEFAULT_PROGRESSIVE_POLL_INTERVAL,
+    DEFAULT_PROGRESSIVE_READ_TIMEOUT,
+)
 from .constructs import Serializable
 from .downloader import YtdlpResponseDict
-from .exceptions import ExtractionError, InvalidDataError, MusicbotException
+from .exceptions import (
+    DownloadCancelledError,
+    ExtractionError,
+    InvalidDataError,
+    MusicbotException,
+)
+from .scheduler import DownloadPriority
 from .spotify import Spotify
 
 if TYPE_CHECKING:
@@ -38,13 +61,6 @@ GuildMessageableChannels = Union[
 
 log = logging.getLogger(__name__)
 
-# optionally using pymediainfo instead of ffprobe if presents
-try:
-    import pymediainfo  # type: ignore[import-untyped]
-except ImportError:
-    log.debug("module 'pymediainfo' not found, will fall back to ffprobe.")
-    pymediainfo = None
-
 
 class BasePlaylistEntry(Serializable):
     def __init__(self) -> None:
@@ -67,6 +83,14 @@ class BasePlaylistEntry(Serializable):
         """
         return 0
 
+    @property
+    def end_time(self) -> Optional[float]:
+        """
+        Time in seconds at which playback of this entry stops, if known.
+        This is earlier than the duration when trailing silence is trimmed.
+        """
+        raise NotImplementedError
+
     @property
     def url(self) -> str:
         """
@@ -113,11 +137,14 @@ class BasePlaylistEntry(Serializable):
         """
         raise NotImplementedError
 
-    def get_ready_future(self) -> AsyncFuture:
+    def get_ready_future(
+        self, priority: DownloadPriority = DownloadPriority.NOW_PLAYING
+    ) -> AsyncFuture:
         """
         Returns a future that will fire when the song is ready to be played.
         The future will either fire with the result (being the entry) or an exception
         as to why the song download failed.
+        The `priority` is used to order this download among others waiting to start.
         """
         future: AsyncFuture = asyncio.Future()
         if self.is_downloaded:
@@ -127,7 +154,9 @@ class BasePlaylistEntry(Serializable):
         else:
             # If we request a ready future, let's ensure that it'll actually resolve at one point.
             self._waiting_futures.append(future)
-            task = asyncio.create_task(self._download(), name="MB_EntryReadyTask")
+            task = asyncio.create_task(
+                self._schedule_download(priority), name="MB_EntryReadyTask"
+            )
             # Make sure garbage collection does not delete the task early...
             self._task_pool.add(task)
             task.add_done_callback(self._task_pool.discard)
@@ -135,6 +164,15 @@ class BasePlaylistEntry(Serializable):
         log.debug("Created future for %r", self)
         return future
 
+    def _schedule_download(  # pylint: disable=unused-argument
+        self, priority: DownloadPriority
+    ) -> Coroutine[Any, Any, None]:
+        """
+        Get the coroutine used to download this entry.  Entries which do not
+        download anything skip the download scheduler.
+        """
+        return self._download()
+
     def _for_each_future(self, cb: Callable[..., Any]) -> None:
         """
         Calls `cb` for each future that is not canceled.
@@ -165,31 +203,6 @@ class BasePlaylistEntry(Serializable):
         return f"<{type(self).__name__}(url='{self.url}', title='{self.title}' file='{self.filename}')>"
 
 
-async def run_command(command: List[str]) -> bytes:
-    """
-    Use an async subprocess exec to execute the given `command`
-    This method will wait for then return the output.
-
-    :param: command:
-        Must be a list of arguments, where element 0 is an executable path.
-
-    :returns:  stdout concatenated with stderr as bytes.
-    """
-    p = await asyncio.create_subprocess_exec(
-        # The inconsistency between the various implements of subprocess, asyncio.subprocess, and
-        # all the other process calling functions tucked into python is alone enough to be dangerous.
-        # There is a time and place for everything, and this is not the time or place for shells.
-        *command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    log.noise(  # type: ignore[attr-defined]
-        "Starting asyncio subprocess (%s) with command: %s", p, command
-    )
-    stdout, stderr = await p.communicate()
-    return stdout + stderr
-
-
 class URLPlaylistEntry(BasePlaylistEntry):
     SERIAL_VERSION: int = 3  # version for serial data checks.
 
@@ -227,17 +240,21 @@ class URLPlaylistEntry(BasePlaylistEntry):
         self.author: Optional["discord.Member"] = author
         self.channel: Optional[GuildMessageableChannels] = channel
 
-        self._aopt_eq: str = ""
+        # Set while the download continues after playback has started.
+        self._progressive_task: Optional[AsyncTask] = None
+        # Set to abort a running download when the entry is no longer needed.
+        self._cancel_event = threading.Event()
 
     @property
     def aoptions(self) -> str:
         """After input options for ffmpeg to use with this entry."""
-        aopts = f"{self._aopt_eq}"
+        aopt_eq = self._get_eq_options()
+        aopts = f"{aopt_eq}"
         # Set playback speed options if needed.
         if self._playback_rate is not None or self.playback_speed != 1.0:
             # Append to the EQ options if they are set.
-            if self._aopt_eq:
-                aopts = f"{self._aopt_eq},atempo={self.playback_speed:.3f}"
+            if aopt_eq:
+                aopts = f"{aopt_eq},atempo={self.playback_speed:.3f}"
             else:
                 aopts = f"-af atempo={self.playback_speed:.3f}"
 
@@ -249,9 +266,27 @@ class URLPlaylistEntry(BasePlaylistEntry):
     @property
     def boptions(self) -> str:
         """Before input options for ffmpeg to use with this entry."""
-        if self._start_time is not None:
-            return f"-ss {self._start_time}"
-        return ""
+        bopts = []
+        start_time = self.start_time
+        if self._start_time is not None or start_time:
+            bopts.append(f"-ss {start_time}")
+        # stop reading input at trailing silence, if it has been found.
+        _, end_time = self._get_silence_trim()
+        if end_time is not None and end_time > start_time:
+            bopts.append(f"-t {end_time - start_time:.3f}")
+        elif self.is_progressive and self.duration:
+            # the growing file has no end yet, so stop at the known duration.
+            bopts.append(f"-t {self.duration - start_time:.3f}")
+        if self.is_progressive:
+            # keep reading as the file grows, until no data arrives for a while.
+            timeout = int(DEFAULT_PROGRESSIVE_READ_TIMEOUT * 1_000_000)
+            bopts.append(f"-follow 1 -rw_timeout {timeout}")
+        return " ".join(bopts)
+
+    @property
+    def is_progressive(self) -> bool:
+        """Returns True if this entry is playable while still downloading."""
+        return self._progressive_task is not None
 
     @property
     def from_auto_playlist(self) -> bool:
@@ -300,6 +335,19 @@ class URLPlaylistEntry(BasePlaylistEntry):
         """Get the expected filename from info if available or None"""
         return self.info.get("__expected_filename", None)
 
+    @property
+    def media_key(self) -> str:
+        """
+        Get a key for the media made from its extractor and ID, which is the
+        same for any URL that leads to it, or an empty string if unknown.
+        """
+        # generic IDs come from the URL file name, and are not unique.
+        if self.info.extractor_key == "Generic":
+            return ""
+        if self.info.extractor_key and self.info.video_id:
+            return f"{self.info.extractor_key}:{self.info.video_id}"
+        return ""
+
     def __json__(self) -> Dict[str, Any]:
         """
         Handles representing this object as JSON.
@@ -309,7 +357,7 @@ class URLPlaylistEntry(BasePlaylistEntry):
             {
                 "version": URLPlaylistEntry.SERIAL_VERSION,
                 "info": self.info.data,
-                "downloaded": self.is_downloaded,
+                "downloaded": self.is_downloaded and not self.is_progressive,
                 "filename": self.filename,
                 "author_id": self.author.id if self.author else None,
                 "channel_id": self.channel.id if self.channel else None,
@@ -415,7 +463,34 @@ class URLPlaylistEntry(BasePlaylistEntry):
     def start_time(self) -> float:
         if self._start_time is not None:
             return self._start_time
-        return 0
+        # skip leading silence, if it has been found.
+        return self._get_silence_trim()[0]
+
+    @property
+    def end_time(self) -> Optional[float]:
+        _, end_time = self._get_silence_trim()
+        if end_time is not None and end_time > self.start_time:
+            return end_time
+        return self.duration
+
+    def _get_silence_trim(self) -> Tuple[float, Optional[float]]:
+        """Get the start and end of audio in this entry's file, if known."""
+        if not self.filename:
+            return 0.0, None
+        return self.playlist.bot.media_store.get_silence_trim(self.filename)
+
+    def _get_eq_options(self) -> str:
+        """Get loudness normalization options for ffmpeg, once they are known."""
+        if not self.playlist.bot.config.use_experimental_equalization:
+            return ""
+        if not self.filename:
+            return ""
+        return self.playlist.bot.media_store.get_loudnorm_options(self.filename)
+
+    def _on_media_analyzed(self, results: Dict[str, Any]) -> None:
+        """Use the duration found by media analysis, if it was missing."""
+        if self.duration is None and results.get("duration"):
+            self.duration = results["duration"]
 
     def set_start_time(self, start_time: float) -> None:
         """Sets a start time in seconds to use with the ffmpeg -ss flag."""
@@ -452,6 +527,30 @@ class URLPlaylistEntry(BasePlaylistEntry):
             new_info = await self.downloader.extract_info(self.url, download=False)
             self.info.data = {**self.info.data, **new_info.data}
 
+    def _schedule_download(
+        self, priority: DownloadPriority
+    ) -> Coroutine[Any, Any, None]:
+        """
+        Get the coroutine used to download this entry, which waits for the
+        bot's download scheduler to start it with the given `priority`.
+        """
+        scheduler = self.playlist.bot.download_scheduler
+        # raise priority right away, so queue changes do not cancel it meanwhile.
+        scheduler.raise_priority(self, priority)
+        # a new request revives an entry which was cancelled before.
+        self._cancel_event.clear()
+        return scheduler.run(self, priority)
+
+    def cancel_download(self) -> None:
+        """
+        Stop any queued or running download of this entry.  A running
+        download is aborted at its next progress update, and its partial
+        files are removed.
+        """
+        log.debug("Cancelling download for:  %r", self)
+        if not self.playlist.bot.download_scheduler.cancel(self, force=True):
+            self._cancel_event.set()
+
     async def _download(self) -> None:
         if self._is_downloading:
             return
@@ -468,40 +567,49 @@ class URLPlaylistEntry(BasePlaylistEntry):
             # check and see if the expected file already exists in cache.
             if self.expected_filename:
                 # get an existing cache path if we have one.
-                file_cache_path = self.filecache.get_if_cached(self.expected_filename)
+                file_cache_path = self.filecache.get_if_cached(
+                    self.expected_filename, media_key=self.media_key
+                )
 
                 # win a cookie if cache worked but extension was different.
                 if file_cache_path and self.expected_filename != file_cache_path:
                     log.warning("Download cached with different extension...")
 
-                # check if cache size matches remote, basic validation.
+                # check the cache file against its manifest record.
+                valid = None
                 if file_cache_path:
-                    local_size = os.path.getsize(file_cache_path)
+                    valid = await self.filecache.verify_file(file_cache_path)
+
+                # files cached before the manifest existed are checked against remote size.
+                if file_cache_path and valid is None:
+                    # transcoded files are compared using their original size.
+                    local_size = self.filecache.get_original_size(file_cache_path)
+                    if local_size is None:
+                        local_size = os.path.getsize(file_cache_path)
                     remote_size = int(self.info.http_header("CONTENT-LENGTH", 0))
+                    valid = local_size == remote_size
+                    if valid:
+                        await self.filecache.commit_file(file_cache_path)
 
-                    if local_size != remote_size:
-                        log.debug(
-                            "Local size different from remote size. Re-downloading..."
-                        )
-                        await self._really_download()
-                    else:
-                        log.debug("Download already cached at:  %s", file_cache_path)
-                        self.filename = file_cache_path
-                        self._is_downloaded = True
+                if file_cache_path and valid:
+                    log.debug("Download already cached at:  %s", file_cache_path)
+                    self.filename = file_cache_path
+                    self._is_downloaded = True
+
+                elif file_cache_path:
+                    log.debug("Cached file could not be verified. Re-downloading...")
+                    await self._start_download()
 
                 # nothing cached, time to download for real.
                 else:
-                    await self._really_download()
+                    await self._start_download()
 
             # check for duration and attempt to extract it if missing.
-            if self.duration is None:
-                # optional pymediainfo over ffprobe?
-                if pymediainfo:
-                    self.duration = self._get_duration_pymedia(self.filename)
-
-                # no matter what, ffprobe should be available.
-                if self.duration is None:
-                    self.duration = await self._get_duration_ffprobe(self.filename)
+            media_store = self.playlist.bot.media_store
+            if self.duration is None and not self.is_progressive:
+                # the media index is checked before any probe is run.
+                metadata = await media_store.probe(self.filename)
+                self.duration = metadata.get("duration")
 
                 if not self.duration:
                     log.error(
@@ -517,21 +625,17 @@ class URLPlaylistEntry(BasePlaylistEntry):
                         self.filename,
                     )
 
-            if self.playlist.bot.config.use_experimental_equalization:
-                try:
-                    self._aopt_eq = await self.get_mean_volume(self.filename)
-
-                # Unfortunate evil that we abide for now...
-                except Exception:  # pylint: disable=broad-exception-caught
-                    log.error(
-                        "There as a problem with working out EQ, likely caused by a strange installation of FFmpeg. "
-                        "This has not impacted the ability for the bot to work, but will mean your tracks will not be equalised.",
-                        exc_info=True,
-                    )
+            # these steps need the complete file, and run once a progressive download finishes.
+            if not self.is_progressive:
+                self._process_downloaded_file()
 
             # Trigger ready callbacks.
             self._for_each_future(lambda future: future.set_result(self))
 
+        except DownloadCancelledError:
+            log.info("Download cancelled:  %r", self)
+            self._for_each_future(lambda future: future.cancel())
+
         # Flake8 thinks 'e' is never used, and later undefined. Maybe the lambda is too much.
         except Exception as e:  # pylint: disable=broad-exception-caught
             ex = e
@@ -542,134 +646,98 @@ class URLPlaylistEntry(BasePlaylistEntry):
         finally:
             self._is_downloading = False
 
-    def _get_duration_pymedia(self, input_file: str) -> Optional[float]:
+    def _process_downloaded_file(self) -> None:
         """
-        Tries to use pymediainfo module to extract duration, if the module is available.
+        Start background work for a complete cache file, which does not
+        delay playback.
         """
-        if pymediainfo:
-            log.debug("Trying to get duration via pymediainfo for:  %s", input_file)
-            try:
-                mediainfo = pymediainfo.MediaInfo.parse(input_file)
-                if mediainfo.tracks:
-                    return int(mediainfo.tracks[0].duration) / 1000
-            except (FileNotFoundError, OSError, RuntimeError, ValueError, TypeError):
-                log.exception("Failed to get duration via pymediainfo.")
-        return None
+        # Optionally convert the cache file to Opus, without delaying playback.
+        self.filecache.queue_transcode(self)
 
-    async def _get_duration_ffprobe(self, input_file: str) -> Optional[float]:
-        """
-        Tries to use ffprobe to extract duration from media if possible.
-        """
-        log.debug("Trying to get duration via ffprobe for:  %s", input_file)
-        ffprobe_bin = shutil.which("ffprobe")
-        if not ffprobe_bin:
-            log.error("Could not locate ffprobe in your path!")
-            return None
+        # Analyze audio in the background, results apply to this or later plays.
+        self.playlist.bot.media_store.queue_analysis(
+            self.filename, self._on_media_analyzed
+        )
 
-        ffprobe_cmd = [
-            ffprobe_bin,
-            "-i",
-            self.filename,
-            "-show_entries",
-            "format=duration",
-            "-v",
-            "quiet",
-            "-of",
-            "csv=p=0",
-        ]
+    def _can_play_progressive(self) -> bool:
+        """Check if this entry may start playing before its download is done."""
+        if not self.playlist.bot.config.progressive_playback:
+            return False
+        # Windows cannot rename the partial file while ffmpeg has it open.
+        if os.name == "nt":
+            return False
+        return bool(self.expected_filename) and not self.info.is_live
 
+    def _get_progressive_buffer_size(self) -> int:
+        """
+        Get the number of bytes to buffer before progressive playback starts,
+        based on the bitrate of the media if it is known.
+        """
+        kbps = self.info.get("abr") or self.info.get("tbr") or 0
         try:
-            raw_output = await run_command(ffprobe_cmd)
-            output = raw_output.decode("utf8")
-            return float(output)
-        except (ValueError, UnicodeError):
-            log.error(
-                "ffprobe returned something that could not be used.", exc_info=True
-            )
-        except Exception:  # pylint: disable=broad-exception-caught
-            log.exception("ffprobe could not be executed for some reason.")
+            need = int(float(kbps) * 125 * DEFAULT_PROGRESSIVE_BUFFER_SECONDS)
+        except (TypeError, ValueError):
+            need = 0
+        return max(need, DEFAULT_PROGRESSIVE_MIN_BYTES)
 
-        return None
-
-    async def get_mean_volume(self, input_file: str) -> str:
+    async def _start_download(self) -> None:
         """
-        Attempt to calculate the mean volume of the `input_file` by using
-        output from ffmpeg to provide values which can be used by command
-        arguments sent to ffmpeg during playback.
+        Download the media for this entry.  With progressive playback, this
+        returns once enough of the partial file is buffered, and the
+        download continues in the background.
         """
-        log.debug("Calculating mean volume of:  %s", input_file)
-        ffmpeg_bin = shutil.which("ffmpeg")
-        if not ffmpeg_bin:
-            log.error("Could not locate ffmpeg on your path!")
-            return ""
-
-        # NOTE: this command should contain JSON, but I have no idea how to make
-        # ffmpeg spit out only the JSON.
-        ffmpeg_cmd = [
-            ffmpeg_bin,
-            "-i",
-            input_file,
-            "-af",
-            "loudnorm=I=-24.0:LRA=7.0:TP=-2.0:linear=true:print_format=json",
-            "-f",
-            "null",
-            "/dev/null",
-            "-hide_banner",
-            "-nostats",
-        ]
-
-        raw_output = await run_command(ffmpeg_cmd)
-        output = raw_output.decode("utf-8")
-
-        i_matches = re.findall(r'"input_i" : "(-?([0-9]*\.[0-9]+))",', output)
-        if i_matches:
-            # log.debug("i_matches=%s", i_matches[0][0])
-            i_value = float(i_matches[0][0])
-        else:
-            log.debug("Could not parse I in normalise json.")
-            i_value = float(0)
+        if not self._can_play_progressive():
+            await self._really_download()
+            return
 
-        lra_matches = re.findall(r'"input_lra" : "(-?([0-9]*\.[0-9]+))",', output)
-        if lra_matches:
-            # log.debug("lra_matches=%s", lra_matches[0][0])
-            lra_value = float(lra_matches[0][0])
-        else:
-            log.debug("Could not parse LRA in normalise json.")
-            lra_value = float(0)
+        task = asyncio.create_task(
+            self._really_download(), name="MB_ProgressiveDownload"
+        )
+        part_path = f"{self.expected_filename}.part"
+        buffer_size = self._get_progressive_buffer_size()
+        while not task.done():
+            try:
+                if os.path.getsize(part_path) >= buffer_size:
+                    break
+            except OSError:
+                pass
+            await asyncio.wait([task], timeout=DEFAULT_PROGRESSIVE_POLL_INTERVAL)
+
+        if task.done():
+            # short downloads finish before there is a need to play them early.
+            task.result()
+            return
 
-        tp_matches = re.findall(r'"input_tp" : "(-?([0-9]*\.[0-9]+))",', output)
-        if tp_matches:
-            # log.debug("tp_matches=%s", tp_matches[0][0])
-            tp_value = float(tp_matches[0][0])
-        else:
-            log.debug("Could not parse TP in normalise json.")
-            tp_value = float(0)
+        log.info("Starting playback while download continues:  %r", self)
+        self.filename = part_path
+        self._is_downloaded = True
+        self._progressive_task = task
+        task.add_done_callback(self._on_progressive_done)
+
+    async def wait_for_progressive(self) -> None:
+        """Wait for a download which is being played progressively to finish."""
+        task = self._progressive_task
+        if task is not None:
+            await asyncio.wait([task])
+
+    def _on_progressive_done(self, task: AsyncTask) -> None:
+        """Finish up cache handling for a download that was played progressively."""
+        self._progressive_task = None
+        if task.cancelled():
+            return
 
-        thresh_matches = re.findall(r'"input_thresh" : "(-?([0-9]*\.[0-9]+))",', output)
-        if thresh_matches:
-            # log.debug("thresh_matches=%s", thresh_matches[0][0])
-            thresh = float(thresh_matches[0][0])
-        else:
-            log.debug("Could not parse thresh in normalise json.")
-            thresh = float(0)
+        ex = task.exception()
+        if isinstance(ex, DownloadCancelledError):
+            log.info("Progressive download cancelled:  %r", self)
+            return
+        if ex is not None:
+            log.error("Progressive download failed:  %r  Reason:  %s", self, ex)
+            self.cache_busted = True
+            return
 
-        offset_matches = re.findall(r'"target_offset" : "(-?([0-9]*\.[0-9]+))', output)
-        if offset_matches:
-            # log.debug("offset_matches=%s", offset_matches[0][0])
-            offset = float(offset_matches[0][0])
-        else:
-            log.debug("Could not parse offset in normalise json.")
-            offset = float(0)
-
-        loudnorm_opts = (
-            "-af loudnorm=I=-24.0:LRA=7.0:TP=-2.0:linear=true:"
-            f"measured_I={i_value}:"
-            f"measured_LRA={lra_value}:"
-            f"measured_TP={tp_value}:"
-            f"measured_thresh={thresh}:"
-            f"offset={offset}"
-        )
-        return loudnorm_opts
+        # the completed file was renamed into place, and filename is updated.
+        self.filecache.handle_new_cache_entry(self)
+        self._process_downloaded_file()
 
     async def _really_download(self) -> None:
         """
@@ -677,52 +745,60 @@ class URLPlaylistEntry(BasePlaylistEntry):
         """
         log.info("Download started:  %r", self)
 
-        info = None
-        for attempt in range(1, 4):
-            log.everything(  # type: ignore[attr-defined]
-                "Download attempt %s of 3...", attempt
+        # the downloader retries transient errors, resuming from the partial file.
+        try:
+            info = await self.downloader.extract_info(
+                self.url, download=True, cancel_event=self._cancel_event
             )
-            try:
-                info = await self.downloader.extract_info(self.url, download=True)
-                break
-            except ContentTooShortError as e:
-                # this typically means connection was interrupted, any
-                # download is probably partial. we should definitely do
-                # something about it to prevent broken cached files.
-                if attempt < 3:
-                    wait_for = 1.5 * attempt
-                    log.warning(
-                        "Download incomplete, retrying in %.1f seconds.  Reason: %s",
-                        wait_for,
-                        str(e),
-                    )
-                    await asyncio.sleep(wait_for)  # TODO: backoff timer maybe?
-                    continue
-
-                # Mark the file I guess, and maintain the default of raising ExtractionError.
-                log.error("Download failed, not retrying! Reason:  %s", str(e))
-                self.cache_busted = True
-                raise ExtractionError(str(e)) from e
-            except YoutubeDLError as e:
-                # as a base exception for any exceptions raised by yt_dlp.
-                raise ExtractionError(str(e)) from e
-
-            except Exception as e:
-                log.error("Extraction encountered an unhandled exception.")
-                raise MusicbotException(str(e)) from e
+        except DownloadCancelledError:
+            raise
+        except ContentTooShortError as e:
+            # retries are used up, so the partial download cannot be trusted.
+            log.error("Download failed, not retrying! Reason:  %s", str(e))
+            self.cache_busted = True
+            raise ExtractionError(str(e)) from e
+        except YoutubeDLError as e:
+            # as a base exception for any exceptions raised by yt_dlp.
+            raise ExtractionError(str(e)) from e
+        except Exception as e:
+            log.error("Extraction encountered an unhandled exception.")
+            raise MusicbotException(str(e)) from e
 
         if info is None:
             log.error("Download failed:  %r", self)
             raise ExtractionError("Failed to extract data for the requested media.")
 
+        filename = info.expected_filename or ""
+        # yt-dlp renames the partial file into place only once it is complete,
+        # verify it and record its checksum before it is used.
+        # post-processors may remux the file, so the size yt-dlp downloaded
+        # is checked rather than the size of the final file.
+        expected_size = info.get("filesize") or 0
+        if not expected_size and info.get("protocol") in ("http", "https"):
+            expected_size = info.http_header("CONTENT-LENGTH", 0)
+        try:
+            await self.filecache.commit_file(
+                filename, int(expected_size), info.downloaded_bytes
+            )
+        except OSError as e:
+            raise ExtractionError(f"Downloaded file is missing:  {filename}") from e
+        except ExtractionError:
+            self.cache_busted = True
+            raise
+
+        # store the file by content, so the same media from other URLs shares it.
+        filename, is_new = await self.filecache.store_content(
+            filename, [self.media_key, pathlib.Path(filename).stem]
+        )
+
         log.info("Download complete:  %r", self)
 
         self._is_downloaded = True
-        self.filename = info.expected_filename or ""
+        self.filename = filename
 
         # It should be safe to get our newly downloaded file size now...
         # This should also leave self.downloaded_bytes set to 0 if the file is in cache already.
-        self.downloaded_bytes = os.path.getsize(self.filename)
+        self.downloaded_bytes = os.path.getsize(self.filename) if is_new else 0
 
 
 class StreamPlaylistEntry(BasePlaylistEntry):
@@ -799,6 +875,10 @@ class StreamPlaylistEntry(BasePlaylistEntry):
         t = self.duration or 0
         return datetime.timedelta(seconds=t)
 
+    @property
+    def end_time(self) -> Optional[float]:
+        return self.duration
+
     @property
     def thumbnail_url(self) -> str:
         """Get available thumbnail from info or an empty string"""
@@ -939,22 +1019,25 @@ class LocalFilePlaylistEntry(BasePlaylistEntry):
         self.info: YtdlpResponseDict = info
         self.filename = self.expected_filename or ""
 
-        # TODO: maybe it is worth getting duration as early as possible...
+        # use a duration from the media index if known, without probing the file.
+        if self.duration is None and self.filename:
+            metadata = playlist.bot.media_store.get_metadata(self.filename)
+            if metadata.get("duration"):
+                self.duration = metadata["duration"]
 
         self.author: Optional["discord.Member"] = author
         self.channel: Optional[GuildMessageableChannels] = channel
 
-        self._aopt_eq: str = ""
-
     @property
     def aoptions(self) -> str:
         """After input options for ffmpeg to use with this entry."""
-        aopts = f"{self._aopt_eq}"
+        aopt_eq = self._get_eq_options()
+        aopts = f"{aopt_eq}"
         # Set playback speed options if needed.
         if self._playback_rate is not None or self.playback_speed != 1.0:
             # Append to the EQ options if they are set.
-            if self._aopt_eq:
-                aopts = f"{self._aopt_eq},atempo={self.playback_speed:.3f}"
+            if aopt_eq:
+                aopts = f"{aopt_eq},atempo={self.playback_speed:.3f}"
             else:
                 aopts = f"-af atempo={self.playback_speed:.3f}"
 
@@ -966,9 +1049,15 @@ class LocalFilePlaylistEntry(BasePlaylistEntry):
     @property
     def boptions(self) -> str:
         """Before input options for ffmpeg to use with this entry."""
-        if self._start_time is not None:
-            return f"-ss {self._start_time}"
-        return ""
+        bopts = []
+        start_time = self.start_time
+        if self._start_time is not None or start_time:
+            bopts.append(f"-ss {start_time}")
+        # stop reading input at trailing silence, if it has been found.
+        _, end_time = self._get_silence_trim()
+        if end_time is not None and end_time > start_time:
+            bopts.append(f"-t {end_time - start_time:.3f}")
+        return " ".join(bopts)
 
     @property
     def from_auto_playlist(self) -> bool:
@@ -1131,7 +1220,34 @@ class LocalFilePlaylistEntry(BasePlaylistEntry):
     def start_time(self) -> float:
         if self._start_time is not None:
             return self._start_time
-        return 0
+        # skip leading silence, if it has been found.
+        return self._get_silence_trim()[0]
+
+    @property
+    def end_time(self) -> Optional[float]:
+        _, end_time = self._get_silence_trim()
+        if end_time is not None and end_time > self.start_time:
+            return end_time
+        return self.duration
+
+    def _get_silence_trim(self) -> Tuple[float, Optional[float]]:
+        """Get the start and end of audio in this entry's file, if known."""
+        if not self.filename:
+            return 0.0, None
+        return self.playlist.bot.media_store.get_silence_trim(self.filename)
+
+    def _get_eq_options(self) -> str:
+        """Get loudness normalization options for ffmpeg, once they are known."""
+        if not self.playlist.bot.config.use_experimental_equalization:
+            return ""
+        if not self.filename:
+            return ""
+        return self.playlist.bot.media_store.get_loudnorm_options(self.filename)
+
+    def _on_media_analyzed(self, results: Dict[str, Any]) -> None:
+        """Use the duration found by media analysis, if it was missing."""
+        if self.duration is None and results.get("duration"):
+            self.duration = results["duration"]
 
     def set_start_time(self, start_time: float) -> None:
         """Sets a start time in seconds to use with the ffmpeg -ss flag."""
@@ -1161,14 +1277,11 @@ class LocalFilePlaylistEntry(BasePlaylistEntry):
         self._is_downloading = True
         try:
             # check for duration and attempt to extract it if missing.
+            media_store = self.playlist.bot.media_store
             if self.duration is None:
-                # optional pymediainfo over ffprobe?
-                if pymediainfo:
-                    self.duration = self._get_duration_pymedia(self.filename)
-
-                # no matter what, ffprobe should be available.
-                if self.duration is None:
-                    self.duration = await self._get_duration_ffprobe(self.filename)
+                # the media index is checked before any probe is run.
+                metadata = await media_store.probe(self.filename)
+                self.duration = metadata.get("duration")
 
                 if not self.duration:
                     log.error(
@@ -1184,17 +1297,8 @@ class LocalFilePlaylistEntry(BasePlaylistEntry):
                         self.filename,
                     )
 
-            if self.playlist.bot.config.use_experimental_equalization:
-                try:
-                    self._aopt_eq = await self.get_mean_volume(self.filename)
-
-                # Unfortunate evil that we abide for now...
-                except Exception:  # pylint: disable=broad-exception-caught
-                    log.error(
-                        "There as a problem with working out EQ, likely caused by a strange installation of FFmpeg. "
-                        "This has not impacted the ability for the bot to work, but will mean your tracks will not be equalised.",
-                        exc_info=True,
-                    )
+            # Analyze audio in the background, results apply to this or later plays.
+            media_store.queue_analysis(self.filename, self._on_media_analyzed)
 
             # Trigger ready callbacks.
             self._is_downloaded = True
@@ -1209,132 +1313,3 @@ class LocalFilePlaylistEntry(BasePlaylistEntry):
 
         finally:
             self._is_downloading = False
-
-    def _get_duration_pymedia(self, input_file: str) -> Optional[float]:
-        """
-        Tries to use pymediainfo module to extract duration, if the module is available.
-        """
-        if pymediainfo:
-            log.debug("Trying to get duration via pymediainfo for:  %s", input_file)
-            try:
-                mediainfo = pymediainfo.MediaInfo.parse(input_file)
-                if mediainfo.tracks:
-                    return int(mediainfo.tracks[0].duration) / 1000
-            except (FileNotFoundError, OSError, RuntimeError, ValueError, TypeError):
-                log.exception("Failed to get duration via pymediainfo.")
-        return None
-
-    async def _get_duration_ffprobe(self, input_file: str) -> Optional[float]:
-        """
-        Tries to use ffprobe to extract duration from media if possible.
-        """
-        log.debug("Trying to get duration via ffprobe for:  %s", input_file)
-        ffprobe_bin = shutil.which("ffprobe")
-        if not ffprobe_bin:
-            log.error("Could not locate ffprobe in your path!")
-            return None
-
-        ffprobe_cmd = [
-            ffprobe_bin,
-            "-i",
-            self.filename,
-            "-show_entries",
-            "format=duration",
-            "-v",
-            "quiet",
-            "-of",
-            "csv=p=0",
-        ]
-
-        try:
-            raw_output = await run_command(ffprobe_cmd)
-            output = raw_output.decode("utf8")
-            return float(output)
-        except (ValueError, UnicodeError):
-            log.error(
-                "ffprobe returned something that could not be used.", exc_info=True
-            )
-        except Exception:  # pylint: disable=broad-exception-caught
-            log.exception("ffprobe could not be executed for some reason.")
-
-        return None
-
-    async def get_mean_volume(self, input_file: str) -> str:
-        """
-        Attempt to calculate the mean volume of the `input_file` by using
-        output from ffmpeg to provide values which can be used by command
-        arguments sent to ffmpeg during playback.
-        """
-        log.debug("Calculating mean volume of:  %s", input_file)
-        ffmpeg_bin = shutil.which("ffmpeg")
-        if not ffmpeg_bin:
-            log.error("Could not locate ffmpeg on your path!")
-            return ""
-
-        # NOTE: this command should contain JSON, but I have no idea how to make
-        # ffmpeg spit out only the JSON.
-        ffmpeg_cmd = [
-            ffmpeg_bin,
-            "-i",
-            input_file,
-            "-af",
-            "loudnorm=I=-24.0:LRA=7.0:TP=-2.0:linear=true:print_format=json",
-            "-f",
-            "null",
-            "/dev/null",
-            "-hide_banner",
-            "-nostats",
-        ]
-
-        raw_output = await run_command(ffmpeg_cmd)
-        output = raw_output.decode("utf-8")
-
-        i_matches = re.findall(r'"input_i" : "(-?([0-9]*\.[0-9]+))",', output)
-        if i_matches:
-            # log.debug("i_matches=%s", i_matches[0][0])
-            i_value = float(i_matches[0][0])
-        else:
-            log.debug("Could not parse I in normalise json.")
-            i_value = float(0)
-
-        lra_matches = re.findall(r'"input_lra" : "(-?([0-9]*\.[0-9]+))",', output)
-        if lra_matches:
-            # log.debug("lra_matches=%s", lra_matches[0][0])
-            lra_value = float(lra_matches[0][0])
-        else:
-            log.debug("Could not parse LRA in normalise json.")
-            lra_value = float(0)
-
-        tp_matches = re.findall(r'"input_tp" : "(-?([0-9]*\.[0-9]+))",', output)
-        if tp_matches:
-            # log.debug("tp_matches=%s", tp_matches[0][0])
-            tp_value = float(tp_matches[0][0])
-        else:
-            log.debug("Could not parse TP in normalise json.")
-            tp_value = float(0)
-
-        thresh_matches = re.findall(r'"input_thresh" : "(-?([0-9]*\.[0-9]+))",', output)
-        if thresh_matches:
-            # log.debug("thresh_matches=%s", thresh_matches[0][0])
-            thresh = float(thresh_matches[0][0])
-        else:
-            log.debug("Could not parse thresh in normalise json.")
-            thresh = float(0)
-
-        offset_matches = re.findall(r'"target_offset" : "(-?([0-9]*\.[0-9]+))', output)
-        if offset_matches:
-            # log.debug("offset_matches=%s", offset_matches[0][0])
-            offset = float(offset_matches[0][0])
-        else:
-            log.debug("Could not parse offset in normalise json.")
-            offset = float(0)
-
-        loudnorm_opts = (
-            "-af loudnorm=I=-24.0:LRA=7.0:TP=-2.0:linear=true:"
-            f"measured_I={i_value}:"
-            f"measured_LRA={lra_value}:"
-            f"measured_TP={tp_value}:"
-            f"measured_thresh={thresh}:"
-            f"offset={offset}"
-        )
-        return loudnorm_opts
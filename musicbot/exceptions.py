@@ -31,6 +31,11 @@ class ExtractionError(MusicbotException):
     pass
 
 
+# A download was stopped because its entry is no longer needed.
+class DownloadCancelledError(ExtractionError):
+    pass
+
+
 # Something is wrong about data
 class InvalidDataError(MusicbotException):
     pass
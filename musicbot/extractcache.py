@@ -0,0 +1,269 @@
+import asyncio
+import copy
+import datetime
+import json
+import logging
+import pathlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlparse, urlunparse
+
+from .constants import (
+    DEFAULT_EXTRACTION_CACHE_EXPIRY_MARGIN,
+    DEFAULT_EXTRACTION_CACHE_SAVE_DELAY,
+)
+
+log = logging.getLogger(__name__)
+
+# Lengthy extraction fields which MusicBot does not use, left out of cached data.
+UNCACHED_FIELDS = ("formats", "automatic_captions", "subtitles", "heatmap")
+
+ExtractionData = Dict[str, Any]
+
+
+def make_extraction_key(subject: str, options: Dict[str, Any]) -> str:
+    """
+    Build a cache key from the extraction `subject` and the `options`
+    given to extract_info.  URLs are normalized so the same link with a
+    different scheme or host case, or a fragment, uses the same key.
+    """
+    subject = subject.strip()
+    parsed = urlparse(subject)
+    if parsed.scheme in ("http", "https") and parsed.netloc:
+        subject = urlunparse(
+            parsed._replace(
+                scheme=parsed.scheme.lower(),
+                netloc=parsed.netloc.lower(),
+                fragment="",
+            )
+        )
+    opts = ",".join(f"{k}={options[k]!r}" for k in sorted(options))
+    return f"{subject}|{opts}"
+
+
+def _iter_urls(data: ExtractionData) -> Iterator[str]:
+    """Yield media URLs in `data` and in any playlist entries it contains."""
+    url = data.get("url")
+    if isinstance(url, str):
+        yield url
+    for entry in data.get("entries") or []:
+        if isinstance(entry, dict) and isinstance(entry.get("url"), str):
+            yield entry["url"]
+
+
+def get_url_expiry(url: str) -> Optional[float]:
+    """
+    Get the time a signed media URL stops working, as a unix timestamp,
+    from expiry parameters commonly used by media hosts and CDNs.
+    """
+    query = {k.lower(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+    for name in ("expire", "expires"):
+        if query.get(name, "").isdigit():
+            return float(query[name])
+
+    if query.get("x-amz-expires", "").isdigit() and "x-amz-date" in query:
+        try:
+            signed = datetime.datetime.strptime(
+                query["x-amz-date"], "%Y%m%dT%H%M%SZ"
+            ).replace(tzinfo=datetime.timezone.utc)
+        except ValueError:
+            return None
+        return signed.timestamp() + float(query["x-amz-expires"])
+    return None
+
+
+class ExtractionCache:
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        store_file: Optional[pathlib.Path] = None,
+    ) -> None:
+        """
+        Remember extraction results, so the same subject is not extracted
+        by yt-dlp again while the result is still fresh.  The most recently
+        used results are kept in memory, and may be saved to `store_file`
+        so they survive restarts.
+        Results expire after `ttl` seconds, or sooner if they contain
+        signed media URLs which expire before that.
+
+        :param: max_entries:  Number of results to keep, 0 disables the cache.
+        :param: ttl:  Seconds a result may be used for, at most.
+        :param: store_file:  Optional path of a json file to save results in.
+        """
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self.store_file = store_file
+        self.store_file_lock = asyncio.Lock()
+        # maps keys to a tuple of expiry timestamp and extraction data.
+        self._entries: "OrderedDict[str, Tuple[float, ExtractionData]]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Future[Optional[ExtractionData]]"] = {}
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.shared: int = 0
+        self.expired: int = 0
+        self.evictions: int = 0
+
+        if self.enabled and self.store_file:
+            self.load()
+
+    @property
+    def enabled(self) -> bool:
+        """Returns True if the cache may keep any results."""
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get_ttl(self, data: ExtractionData) -> float:
+        """
+        Get the seconds `data` may be cached for.  Live streams are never
+        cached, and signed URLs limit the time to before they expire.
+        """
+        if data.get("is_live") or data.get("__force_stream"):
+            return 0.0
+
+        ttl = self.ttl
+        now = time.time()
+        for url in _iter_urls(data):
+            expiry = get_url_expiry(url)
+            if expiry is not None:
+                ttl = min(ttl, expiry - now - DEFAULT_EXTRACTION_CACHE_EXPIRY_MARGIN)
+        return max(0.0, ttl)
+
+    def get(self, key: str) -> Optional[ExtractionData]:
+        """Get a copy of the fresh result stored for `key`, if there is one."""
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, data = item
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(data)
+
+    def put(self, key: str, data: ExtractionData) -> None:
+        """Store `data` for `key` if it may be cached, evicting the oldest results."""
+        ttl = self.get_ttl(data)
+        if not ttl:
+            return
+
+        stored = {k: v for k, v in data.items() if k not in UNCACHED_FIELDS}
+        self._entries[key] = (time.time() + ttl, copy.deepcopy(stored))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._schedule_save()
+
+    async def fetch(
+        self, key: str, extract: Callable[[], Awaitable[ExtractionData]]
+    ) -> ExtractionData:
+        """
+        Get the result for `key` from the cache, or await `extract()` and
+        store its result.  Calls for a key which is already being extracted
+        wait for that extraction instead of starting another.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.shared += 1
+            data = await asyncio.shield(pending)
+            if data is not None:
+                return copy.deepcopy(data)
+            # the first extraction failed, so try it again for this caller.
+            return await extract()
+
+        fut: "asyncio.Future[Optional[ExtractionData]]" = (
+            asyncio.get_running_loop().create_future()
+        )
+        self._inflight[key] = fut
+        try:
+            data = await extract()
+            self.put(key, data)
+        except BaseException:
+            fut.set_result(None)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        fut.set_result(data)
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the number of stored results and the hit and miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "shared": self.shared,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+    def _schedule_save(self) -> None:
+        """Save the store file after a short delay, to batch up changes."""
+        if not self.store_file or self._save_handle is not None:
+            return
+
+        def _save() -> None:
+            self._save_handle = None
+            asyncio.ensure_future(self.save())
+
+        self._save_handle = asyncio.get_running_loop().call_later(
+            DEFAULT_EXTRACTION_CACHE_SAVE_DELAY, _save
+        )
+
+    def load(self) -> None:
+        """Load results from the store file if it exists, skipping expired ones."""
+        if not self.store_file or not self.store_file.is_file():
+            return
+
+        with open(self.store_file, "r", encoding="utf8") as fh:
+            try:
+                data = json.load(fh)
+            except json.JSONDecodeError:
+                log.exception("Failed to load extraction cache.")
+                data = []
+
+        now = time.time()
+        for key, expires_at, info in data[-self.max_entries :]:
+            if expires_at > now:
+                self._entries[key] = (expires_at, info)
+        log.debug("Loaded extraction cache with %s results.", len(self._entries))
+
+    async def save(self) -> None:
+        """
+        Uses asyncio.Lock to save unexpired results as a json file.
+        """
+        if not self.store_file:
+            return
+
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+
+        now = time.time()
+        data = [
+            [key, expires_at, info]
+            for key, (expires_at, info) in self._entries.items()
+            if expires_at > now
+        ]
+        async with self.store_file_lock:
+            try:
+                with open(self.store_file, "w", encoding="utf8") as fh:
+                    json.dump(data, fh)
+            except (TypeError, ValueError, RecursionError, OSError):
+                log.exception("Failed to save extraction cache.")
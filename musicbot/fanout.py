@@ -0,0 +1,237 @@
+import logging
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, List, Optional, Tuple
+
+from discord import AudioSource
+
+from .constants import DEFAULT_SHARED_DECODER_QUEUE_FRAMES
+
+if TYPE_CHECKING:
+    from .player import FFmpegStderrSink
+
+log = logging.getLogger(__name__)
+
+# Callable used to open the decoder source and the sink for its stderr.
+DecoderOpener = Callable[[], Tuple[AudioSource, "FFmpegStderrSink"]]
+
+
+class SharedDecoderSubscriber(AudioSource):
+    def __init__(
+        self,
+        decoder: "SharedDecoder",
+        stderr_sink: "FFmpegStderrSink",
+        max_frames: int = DEFAULT_SHARED_DECODER_QUEUE_FRAMES,
+    ) -> None:
+        """
+        Receive PCM frames from a SharedDecoder through a bounded queue.
+        A subscriber which falls too far behind is detached by the decoder,
+        and joins it again at its current position on the next read.
+
+        :param: decoder:  The SharedDecoder producing frames.
+        :param: stderr_sink:  A sink to resolve when the decoder ends.
+        :param: max_frames:  Size of the frame queue before detaching.
+        """
+        self.decoder = decoder
+        self.stderr_sink = stderr_sink
+        self.frames: "queue.Queue[bytes]" = queue.Queue(maxsize=max_frames)
+        self.detached: bool = False
+        self.closed: bool = False
+
+    def read(self) -> bytes:
+        if self.detached:
+            self.decoder.reattach(self)
+
+        while not self.closed:
+            try:
+                return self.frames.get(timeout=0.5)
+            except queue.Empty:
+                if self.decoder.finished:
+                    return b""
+        return b""
+
+    def cleanup(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.decoder.unsubscribe(self)
+
+
+class SharedDecoder:
+    def __init__(
+        self,
+        key: Hashable,
+        source: AudioSource,
+        stderr_sink: "FFmpegStderrSink",
+        registry: "SharedDecoderRegistry",
+    ) -> None:
+        """
+        Run a single decode of an input and copy each frame to every
+        subscriber. Frames are read at the real-time rate of playback, so
+        subscribers keep up unless their player stops reading.
+        The decoder is stopped when the last subscriber leaves.
+        """
+        self.key = key
+        self.source = source
+        self.stderr_sink = stderr_sink
+        self.registry = registry
+        self.finished: bool = False
+        self._stopping: bool = False
+        self._lock = threading.Lock()
+        self._subscribers: List[SharedDecoderSubscriber] = []
+        self._thread = threading.Thread(
+            target=self._run,
+            name="MB_SharedDecoder",
+            daemon=True,
+        )
+
+    def start(self) -> None:
+        """Start reading frames from the source."""
+        self._thread.start()
+
+    @property
+    def subscriber_count(self) -> int:
+        """Number of players using this decoder."""
+        return len(self._subscribers)
+
+    def subscribe(
+        self, stderr_sink: "FFmpegStderrSink"
+    ) -> Optional[SharedDecoderSubscriber]:
+        """
+        Add a new subscriber to this decoder.
+
+        :returns:  The new subscriber, or None if the decoder is stopping.
+        """
+        with self._lock:
+            if self._stopping or self.finished:
+                return None
+            sub = SharedDecoderSubscriber(self, stderr_sink)
+            self._subscribers.append(sub)
+            return sub
+
+    def unsubscribe(self, sub: SharedDecoderSubscriber) -> None:
+        """Remove `sub` and stop decoding if no subscribers are left."""
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+            if self._subscribers:
+                return
+            self._stopping = True
+
+        log.debug("Last subscriber left, stopping shared decoder:  %s", self.key)
+        self.registry.remove(self)
+
+    def reattach(self, sub: SharedDecoderSubscriber) -> None:
+        """Drop any stale frames of a detached `sub` and resume sending it frames."""
+        with self._lock:
+            while True:
+                try:
+                    sub.frames.get_nowait()
+                except queue.Empty:
+                    break
+            sub.detached = False
+        log.debug("Subscriber rejoined shared decoder:  %s", self.key)
+
+    def _run(self) -> None:
+        """Read frames from the source and queue them for every subscriber."""
+        started = time.perf_counter()
+        frames = 0
+        try:
+            while not self._stopping:
+                data = self.source.read()
+                if not data:
+                    break
+
+                with self._lock:
+                    for sub in self._subscribers:
+                        if sub.detached:
+                            continue
+                        try:
+                            sub.frames.put_nowait(data)
+                        except queue.Full:
+                            sub.detached = True
+                            log.warning(
+                                "Player is lagging behind a shared decoder, detaching it:  %s",
+                                self.key,
+                            )
+
+                frames += 1
+                delay = started + frames * 0.02 - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -1.0:
+                    # input stalled for a while, so restart timing rather than rush.
+                    started = time.perf_counter()
+                    frames = 0
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.exception("Shared decoder failed while reading:  %s", self.key)
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        """Clean up the source and let subscribers know no more frames will come."""
+        with self._lock:
+            self.finished = True
+            subscribers = list(self._subscribers)
+
+        self.registry.remove(self)
+        self.source.cleanup()
+
+        error = self.stderr_sink.error
+        for sub in subscribers:
+            sub.stderr_sink.close(error)
+
+
+class SharedDecoderRegistry:
+    def __init__(self) -> None:
+        """
+        Keep track of running SharedDecoders, so that players opening the
+        same input with the same options can share a single decode.
+        """
+        self._lock = threading.Lock()
+        self._decoders: Dict[Hashable, SharedDecoder] = {}
+
+    def subscribe(
+        self,
+        key: Hashable,
+        opener: DecoderOpener,
+        stderr_sink: "FFmpegStderrSink",
+    ) -> SharedDecoderSubscriber:
+        """
+        Subscribe to the decoder for `key`, using `opener` to start a new
+        decoder if none is running.  The first player to open an input
+        owns the decoder, until it is stopped by its last subscriber.
+        """
+        with self._lock:
+            decoder = self._decoders.get(key)
+            sub = decoder.subscribe(stderr_sink) if decoder else None
+            if sub is not None:
+                log.debug(
+                    "Sharing decoder with %s other players:  %s",
+                    decoder.subscriber_count - 1 if decoder else 0,
+                    key,
+                )
+                return sub
+
+            source, decoder_sink = opener()
+            decoder = SharedDecoder(key, source, decoder_sink, self)
+            sub = decoder.subscribe(stderr_sink)
+            assert sub is not None
+            self._decoders[key] = decoder
+            decoder.start()
+            log.debug("Started new shared decoder:  %s", key)
+            return sub
+
+    def remove(self, decoder: SharedDecoder) -> None:
+        """Forget the given `decoder` if it is still registered."""
+        with self._lock:
+            if self._decoders.get(decoder.key) is decoder:
+                del self._decoders[decoder.key]
+
+    def __len__(self) -> int:
+        return len(self._decoders)
+
+
+# Shared by all players, so any two players can share a decoder.
+shared_decoders = SharedDecoderRegistry()
@@ -1,14 +1,25 @@
 import asyncio
 import glob
+import hashlib
 import json
 import logging
 import os
 import pathlib
 import shutil
 import time
-from typing import TYPE_CHECKING, Dict, Tuple
-
-from .constants import DATA_FILE_CACHEMAP, DEFAULT_DATA_DIR
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from .constants import (
+    DATA_FILE_CACHE_MANIFEST,
+    DATA_FILE_CACHEMAP,
+    DATA_FILE_CONTENTMAP,
+    DATA_FILE_TRANSCODEMAP,
+    DEFAULT_BACKGROUND_PROC_TIMEOUT,
+    DEFAULT_DATA_DIR,
+    DEFAULT_TRANSCODE_BITRATE,
+)
+from .exceptions import ExtractionError
+from .procpool import ProcPriority, helper_procs
 from .utils import format_size_from_bytes
 
 if TYPE_CHECKING:
@@ -18,6 +29,23 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 
+# suffixes of files which downloads are still writing, these are never cache files.
+PARTIAL_FILE_SUFFIXES = (".part", ".ytdl", ".temp")
+
+
+def get_file_sha256(path: str) -> str:
+    """Get the hex sha256 digest of the file at `path`, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_partial_file(path: pathlib.Path) -> bool:
+    """Check if `path` names a file that a download is still writing."""
+    return path.name.endswith(PARTIAL_FILE_SUFFIXES) or ".part-Frag" in path.name
+
 
 class AudioFileCache:
     """
@@ -41,20 +69,74 @@ class AudioFileCache:
         self.auto_playlist_cachemap: Dict[str, str] = {}
         self.cachemap_file_lock: asyncio.Lock = asyncio.Lock()
 
+        # Stores names of files transcoded to Opus, with the size of their original download.
+        self.transcodemap_file = pathlib.Path(DEFAULT_DATA_DIR).joinpath(
+            DATA_FILE_TRANSCODEMAP
+        )
+        self.transcode_map: Dict[str, int] = {}
+        self.transcodemap_file_lock: asyncio.Lock = asyncio.Lock()
+        self._transcode_pending: Set[str] = set()
+        # Transcode one file at a time, so playback is not starved of CPU.
+        self._transcode_lock: asyncio.Lock = asyncio.Lock()
+
+        # Maps media keys and download names to the hash name of their content.
+        self.contentmap_file = pathlib.Path(DEFAULT_DATA_DIR).joinpath(
+            DATA_FILE_CONTENTMAP
+        )
+        self.content_map: Dict[str, str] = {}
+        self.contentmap_file_lock: asyncio.Lock = asyncio.Lock()
+
+        # Stores size, modification time, and sha256 of verified cache files by name.
+        self.manifest_file = pathlib.Path(DEFAULT_DATA_DIR).joinpath(
+            DATA_FILE_CACHE_MANIFEST
+        )
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        self.manifest_file_lock: asyncio.Lock = asyncio.Lock()
+
         if self.config.auto_playlist:
             self.load_autoplay_cachemap()
 
+        self.load_manifest()
+
+        if self.config.save_videos:
+            self.load_content_map()
+
+        if self.config.transcode_cache_to_opus:
+            self.load_transcode_map()
+
     @property
     def folder(self) -> pathlib.Path:
         """Get the configured cache path as a pathlib.Path"""
         return self.cache_path
 
-    def get_if_cached(self, filename: str, ignore_ext: bool = True) -> str:
+    def get_if_cached(
+        self, filename: str, ignore_ext: bool = True, media_key: str = ""
+    ) -> str:
         """
         Check for an existing cache file by the given name, and return the matched path.
         The `filename` will be reduced to its basename and joined with the current cache_path.
         If `ignore_ext` is set, the filename will be matched without its last suffix / extension.
         An exact match is preferred, but only the first of many possible matches will be returned.
+        Content stored under a hash name is found by `media_key` or by the
+        name it was downloaded as.
+
+        :returns: a path string or empty string if not found.
+        """
+        file_path = pathlib.Path(filename)
+        for key in (media_key, file_path.stem):
+            content_stem = self.content_map.get(key) if key else None
+            if content_stem:
+                found = self._find_cache_file(
+                    f"{content_stem}{file_path.suffix}", ignore_ext=True
+                )
+                if found:
+                    return found
+
+        return self._find_cache_file(filename, ignore_ext)
+
+    def _find_cache_file(self, filename: str, ignore_ext: bool) -> str:
+        """
+        Find a cache file by name, see get_if_cached() for details.
 
         :returns: a path string or empty string if not found.
         """
@@ -63,12 +145,18 @@ class AudioFileCache:
         cache_file_path = self.cache_path.with_name(filename)
 
         if ignore_ext:
+            # prefer a transcoded file, in case the original could not be removed.
+            opus_path = self.cache_path.joinpath(f"{file_path.stem}.opus")
+            if self.is_transcoded(str(opus_path)):
+                return str(opus_path)
+
             if cache_file_path.is_file():
                 return str(cache_file_path)
 
             safe_stem = glob.escape(pathlib.Path(filename).stem)
             for item in self.cache_path.glob(f"{safe_stem}.*"):
-                if item.is_file():
+                # never serve a file which is still being downloaded.
+                if item.is_file() and not is_partial_file(item):
                     return str(item)
 
         elif cache_file_path.is_file():
@@ -113,6 +201,7 @@ class AudioFileCache:
         """
         try:
             path.unlink(missing_ok=True)
+            self.manifest.pop(path.name, None)
             return True
         except (OSError, PermissionError, IsADirectoryError):
             log.warning("Failed to delete cache file:  %s", path, exc_info=True)
@@ -277,6 +366,368 @@ class AudioFileCache:
                 # Only running time check if it is the only option enabled, cuts down on IO.
                 self.delete_old_audiocache()
 
+    async def commit_file(
+        self, filename: str, expected_size: int = 0, downloaded_size: int = 0
+    ) -> None:
+        """
+        Verify a complete cache file and record its size and checksum in
+        the manifest, so later plays can trust it without asking the remote.
+        If `expected_size` and `downloaded_size` are both given and do not
+        match, the file is removed.  The downloaded size is the size before
+        any post-processing, which may change the size of the final file.
+
+        :raises: musicbot.exceptions.ExtractionError
+            if the download does not match the expected size.
+        """
+        path = pathlib.Path(filename)
+        stat = path.stat()
+        if expected_size and downloaded_size and downloaded_size != expected_size:
+            self._delete_cache_file(path)
+            raise ExtractionError(
+                f"Downloaded {downloaded_size} bytes, expected {expected_size}."
+            )
+
+        sha256 = await self.bot.loop.run_in_executor(None, get_file_sha256, filename)
+        self.manifest[path.name] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+        }
+        log.debug("Committed cache file to manifest:  %s", path.name)
+        await self.save_manifest()
+
+    async def store_content(
+        self, filename: str, media_keys: List[str]
+    ) -> Tuple[str, bool]:
+        """
+        Move a committed cache file to a name made from the hash of its
+        content, and map the `media_keys` to it.  If the same content is
+        already stored, for example from another URL, the new file is
+        removed and the stored file is used instead.
+        Only applies when SaveVideos is enabled.
+
+        :returns: the path of the stored file, and False if it was already stored.
+        """
+        path = pathlib.Path(filename)
+        record = self.manifest.get(path.name)
+        if not self.config.save_videos or record is None:
+            return filename, True
+
+        content_stem = record["sha256"]
+        content_path = path.with_name(f"{content_stem}{path.suffix}")
+        is_new = True
+        if content_path != path:
+            existing = self._find_cache_file(content_path.name, ignore_ext=True)
+            if existing:
+                log.info(
+                    "Downloaded media is already cached, using existing file:  %s",
+                    existing,
+                )
+                self._delete_cache_file(path)
+                stored = existing
+                is_new = False
+            else:
+                os.replace(path, content_path)
+                self.manifest[content_path.name] = self.manifest.pop(path.name)
+                stored = str(content_path)
+        else:
+            stored = filename
+
+        for key in media_keys:
+            if key:
+                self.content_map[key] = content_stem
+
+        await self.save_manifest()
+        await self.save_content_map()
+        return stored, is_new
+
+    def load_content_map(self) -> None:
+        """
+        Load the content map json file if it exists, dropping any keys
+        whose content is no longer in the cache.
+        """
+        if not self.contentmap_file.is_file():
+            self.content_map = {}
+            return
+
+        with open(self.contentmap_file, "r", encoding="utf8") as fh:
+            try:
+                data = json.load(fh)
+            except json.JSONDecodeError:
+                log.exception("Failed to load content cache map.")
+                data = {}
+
+        stored: Set[str] = set()
+        if self.cache_path.is_dir():
+            stored = {
+                item.stem
+                for item in self.cache_path.iterdir()
+                if item.is_file() and not is_partial_file(item)
+            }
+        self.content_map = {key: stem for key, stem in data.items() if stem in stored}
+        log.debug("Loaded content cache map with %s keys.", len(self.content_map))
+
+    async def save_content_map(self) -> None:
+        """
+        Uses asyncio.Lock to save the content map as a json file.
+        """
+        async with self.contentmap_file_lock:
+            try:
+                with open(self.contentmap_file, "w", encoding="utf8") as fh:
+                    json.dump(self.content_map, fh)
+            except (TypeError, ValueError, RecursionError, OSError):
+                log.exception("Failed to save content cache map.")
+
+    async def verify_file(self, filename: str) -> Optional[bool]:
+        """
+        Check a cache file against its manifest record.  The checksum is
+        only read again if the file was modified since it was recorded.
+        Files which fail verification are removed.
+
+        :returns: True if valid, False if it failed and was removed, or
+            None if the file has no manifest record.
+        """
+        path = pathlib.Path(filename)
+        record = self.manifest.get(path.name)
+        if record is None:
+            return None
+
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+
+        valid = stat.st_size == record["size"]
+        if valid and stat.st_mtime_ns != record["mtime_ns"]:
+            sha256 = await self.bot.loop.run_in_executor(
+                None, get_file_sha256, filename
+            )
+            valid = sha256 == record["sha256"]
+            if valid:
+                record["mtime_ns"] = stat.st_mtime_ns
+                await self.save_manifest()
+
+        if not valid:
+            log.warning("Cache file failed verification, removing it:  %s", path)
+            self._delete_cache_file(path)
+            await self.save_manifest()
+        return valid
+
+    def load_manifest(self) -> None:
+        """
+        Load the cache manifest json file if it exists, dropping any files
+        which are no longer in the cache.
+        """
+        if not self.manifest_file.is_file():
+            self.manifest = {}
+            return
+
+        with open(self.manifest_file, "r", encoding="utf8") as fh:
+            try:
+                data = json.load(fh)
+            except json.JSONDecodeError:
+                log.exception("Failed to load cache manifest.")
+                data = {}
+
+        self.manifest = {
+            name: record
+            for name, record in data.items()
+            if self.cache_path.joinpath(name).is_file()
+        }
+        log.debug("Loaded cache manifest with %s entries.", len(self.manifest))
+
+    async def save_manifest(self) -> None:
+        """
+        Uses asyncio.Lock to save the cache manifest as a json file.
+        The file is written to a temporary name first and then renamed,
+        so an interrupted save never leaves a broken manifest.
+        """
+        async with self.manifest_file_lock:
+            temp_file = self.manifest_file.with_name(f"{self.manifest_file.name}.tmp")
+            try:
+                with open(temp_file, "w", encoding="utf8") as fh:
+                    json.dump(self.manifest, fh)
+                os.replace(temp_file, self.manifest_file)
+            except (TypeError, ValueError, RecursionError, OSError):
+                log.exception("Failed to save cache manifest.")
+
+    def is_transcoded(self, filename: str) -> bool:
+        """
+        Returns True if `filename` is a cache file transcoded to Opus by MusicBot.
+        """
+        path = pathlib.Path(filename)
+        return path.name in self.transcode_map and path.is_file()
+
+    def get_current_path(self, filename: str) -> str:
+        """
+        Get the path where the cache file `filename` can be found now.
+        This is the Opus file it was transcoded to, if the original file
+        has been removed since `filename` was recorded.
+        """
+        if not filename or os.path.isfile(filename):
+            return filename
+
+        opus_path = pathlib.Path(filename).with_suffix(".opus")
+        if self.is_transcoded(str(opus_path)):
+            return str(opus_path)
+        return filename
+
+    def get_original_size(self, filename: str) -> Optional[int]:
+        """
+        Get the size in bytes of the original download, if `filename` was
+        transcoded, so it can be compared to the remote file size.
+        """
+        if self.is_transcoded(filename):
+            return self.transcode_map[pathlib.Path(filename).name]
+        return None
+
+    def queue_transcode(self, entry: "URLPlaylistEntry") -> None:
+        """
+        Start a background transcode of the cache file for `entry` to Opus,
+        if enabled and the file is not already in Opus format.
+        The entry is ready to play while this runs, and is switched over
+        to the new file once it is complete.
+        """
+        if not self.config.transcode_cache_to_opus or not self.config.save_videos:
+            return
+
+        path = pathlib.Path(entry.filename)
+        if not entry.filename or path.suffix.lower() == ".opus":
+            return
+
+        if path.name in self._transcode_pending:
+            return
+
+        self._transcode_pending.add(path.name)
+        self.bot.create_task(
+            self._transcode_to_opus(entry, path), name="MB_TranscodeCacheFile"
+        )
+
+    async def _transcode_to_opus(
+        self, entry: "URLPlaylistEntry", path: pathlib.Path
+    ) -> None:
+        """
+        Transcode the cache file at `path` to an Ogg Opus file with the same
+        name, then record it and remove the original file.
+        """
+        ffmpeg_bin = shutil.which("ffmpeg")
+        if not ffmpeg_bin:
+            log.error("Could not locate ffmpeg on your path!")
+            self._transcode_pending.discard(path.name)
+            return
+
+        opus_path = path.with_suffix(".opus")
+        # use a name which will not be matched by get_if_cached() while incomplete.
+        temp_path = path.with_name(f"~{opus_path.name}")
+        cmd = [
+            ffmpeg_bin,
+            "-nostdin",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            str(path),
+            "-vn",
+            "-map_metadata",
+            "-1",
+            "-threads",
+            "1",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            f"{DEFAULT_TRANSCODE_BITRATE}k",
+            "-ar",
+            "48000",
+            "-ac",
+            "2",
+            "-f",
+            "opus",
+            str(temp_path),
+        ]
+
+        try:
+            async with self._transcode_lock:
+                if not path.is_file():
+                    return
+
+                log.debug("Transcoding cache file to Opus:  %s", path)
+                original_size = os.path.getsize(path)
+                returncode, _, stderr = await helper_procs.run(
+                    cmd,
+                    priority=ProcPriority.BACKGROUND,
+                    timeout=DEFAULT_BACKGROUND_PROC_TIMEOUT,
+                    stdout=asyncio.subprocess.DEVNULL,
+                )
+                if returncode != 0:
+                    log.warning(
+                        "Failed to transcode cache file:  %s\n%s",
+                        path,
+                        stderr.decode("utf8", errors="replace").strip(),
+                    )
+                    self._delete_cache_file(temp_path)
+                    return
+
+                os.replace(temp_path, opus_path)
+                opus_size = os.path.getsize(opus_path)
+                self.transcode_map[opus_path.name] = original_size
+                await self.commit_file(str(opus_path))
+
+            if entry.filename == str(path):
+                entry.filename = str(opus_path)
+
+            if self._delete_cache_file(path):
+                self.size_bytes = max(0, self.size_bytes - original_size + opus_size)
+
+            log.debug(
+                "Transcoded cache file from %s to %s:  %s",
+                format_size_from_bytes(original_size),
+                format_size_from_bytes(opus_size),
+                opus_path,
+            )
+            await self.save_transcode_map()
+        except (OSError, ValueError, asyncio.TimeoutError):
+            log.warning("Failed to transcode cache file:  %s", path, exc_info=True)
+            self._delete_cache_file(temp_path)
+        finally:
+            self._transcode_pending.discard(path.name)
+
+    def load_transcode_map(self) -> None:
+        """
+        Load the transcode map json file if it exists, dropping any files
+        which are no longer in the cache.
+        """
+        if not self.transcodemap_file.is_file():
+            self.transcode_map = {}
+            return
+
+        with open(self.transcodemap_file, "r", encoding="utf8") as fh:
+            try:
+                data = json.load(fh)
+            except json.JSONDecodeError:
+                log.exception("Failed to load transcode cache map.")
+                data = {}
+
+        self.transcode_map = {
+            name: int(size)
+            for name, size in data.items()
+            if self.cache_path.joinpath(name).is_file()
+        }
+        log.debug(
+            "Loaded transcode cache map with %s entries.", len(self.transcode_map)
+        )
+
+    async def save_transcode_map(self) -> None:
+        """
+        Uses asyncio.Lock to save the transcode map as a json file.
+        """
+        async with self.transcodemap_file_lock:
+            try:
+                with open(self.transcodemap_file, "w", encoding="utf8") as fh:
+                    json.dump(self.transcode_map, fh)
+            except (TypeError, ValueError, RecursionError, OSError):
+                log.exception("Failed to save transcode cache map.")
+
     def load_autoplay_cachemap(self) -> None:
         """
         Load cachemap json file if it exists and settings are enabled.
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .constants import (
+    DEFAULT_LOOP_LAG_INTERVAL,
+    DEFAULT_LOOP_LAG_SAMPLES,
+    DEFAULT_LOOP_LAG_STACK_DEPTH,
+)
+
+log = logging.getLogger(__name__)
+
+# A captured stack frame, as (filename, line number, function name, source line).
+StackFrame = Tuple[str, int, str, str]
+
+
+class LagRecord:
+    def __init__(self, stack: List[StackFrame]) -> None:
+        """Totals for loop stalls which were caught at the same stack."""
+        self.stack = stack
+        self.count: int = 0
+        self.total_time: float = 0.0
+        self.max_time: float = 0.0
+        self.last_seen: float = 0.0
+
+    def add(self, lag: float) -> None:
+        """Count a stall of `lag` seconds at this stack."""
+        self.count += 1
+        self.total_time += lag
+        self.max_time = max(self.max_time, lag)
+        self.last_seen = time.time()
+
+    @property
+    def location(self) -> str:
+        """The innermost frame of MusicBot code, or the innermost frame if none."""
+        frames = [f for f in self.stack if f"{os.sep}musicbot{os.sep}" in f[0]]
+        fname, lineno, func, _ = (frames or self.stack or [("?", 0, "?", "")])[-1]
+        return f"{os.path.basename(fname)}:{lineno} in {func}"
+
+    def format_stack(self, depth: int = 0) -> str:
+        """Format the innermost `depth` frames of the stack, or all if 0."""
+        frames = self.stack[-depth:] if depth else self.stack
+        return "".join(traceback.format_list(frames))
+
+
+class LoopLagMonitor:
+    def __init__(
+        self,
+        threshold: float,
+        interval: float = DEFAULT_LOOP_LAG_INTERVAL,
+    ) -> None:
+        """
+        Measure how late the event loop runs a regular heartbeat callback,
+        and find out what blocked it.  A watchdog thread checks that the
+        heartbeat keeps running, and when it stops for longer than
+        `threshold` seconds the stack of the event loop thread is captured.
+        Stalls are grouped by stack, so the worst offenders can be reported.
+
+        :param: threshold:  Seconds of lag which are recorded as a stall.
+        :param: interval:  Seconds between heartbeat callbacks.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.records: Dict[Tuple[StackFrame, ...], LagRecord] = {}
+        self._lags: Deque[float] = deque(maxlen=DEFAULT_LOOP_LAG_SAMPLES)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: int = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._expected: float = 0.0
+        self._last_beat: float = 0.0
+        # stack captured by the watchdog for the stall which started at a beat.
+        self._pending: Dict[float, List[StackFrame]] = {}
+
+    @property
+    def running(self) -> bool:
+        """Returns True if the monitor has been started and not stopped."""
+        return self._handle is not None
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Start monitoring `loop`.  Must be called from the thread which
+        runs the event loop.
+        """
+        if self.running:
+            return
+
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._last_beat = time.monotonic()
+        self._expected = self._last_beat + self.interval
+        self._handle = loop.call_at(loop.time() + self.interval, self._beat)
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            name="MB_LoopLagWatchdog",
+            daemon=True,
+        )
+        self._watchdog.start()
+        log.info(
+            "Event loop lag monitor started, stalls over %.0fms will be recorded.",
+            self.threshold * 1000,
+        )
+
+    def stop(self) -> None:
+        """Stop the heartbeat and the watchdog thread."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._stopped.set()
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    def reset(self) -> None:
+        """Forget all recorded lag samples and stalls."""
+        with self._lock:
+            self.records.clear()
+            self._pending.clear()
+        self._lags.clear()
+
+    def _beat(self) -> None:
+        """Heartbeat run on the event loop, which measures how late it ran."""
+        now = time.monotonic()
+        lag = max(0.0, now - self._expected)
+        self._lags.append(lag)
+
+        with self._lock:
+            stack = self._pending.pop(self._last_beat, None)
+            self._last_beat = now
+
+        if lag >= self.threshold:
+            self._record(lag, stack)
+
+        self._expected = now + self.interval
+        if self._loop is not None and not self._stopped.is_set():
+            self._handle = self._loop.call_at(
+                self._loop.time() + self.interval, self._beat
+            )
+
+    def _record(self, lag: float, stack: Optional[List[StackFrame]]) -> None:
+        """Add a stall of `lag` seconds to the record for `stack`."""
+        if stack is None:
+            # the stall ended before the watchdog could look at it.
+            stack = [("<unknown>", 0, "<stall too short to capture>", "")]
+        key = tuple(stack)
+        with self._lock:
+            record = self.records.get(key)
+            if record is None:
+                record = self.records[key] = LagRecord(stack)
+            record.add(lag)
+
+        log.debug(
+            "Event loop was blocked for %.0fms at:  %s",
+            lag * 1000,
+            record.location,
+        )
+
+    def _watch(self) -> None:
+        """Watchdog thread, captures the loop stack when a heartbeat is late."""
+        poll = min(self.interval, self.threshold / 2)
+        while not self._stopped.wait(poll):
+            with self._lock:
+                beat = self._last_beat
+                if beat in self._pending:
+                    continue
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+
+            stack = self._capture_stack()
+            if stack is None:
+                continue
+            with self._lock:
+                # only keep the capture if the loop is still stuck on the same beat.
+                if self._last_beat == beat:
+                    self._pending[beat] = stack
+
+    def _capture_stack(self) -> Optional[List[StackFrame]]:
+        """Get the stack of the event loop thread, without asyncio internals."""
+        frame = sys._current_frames().get(  # pylint: disable=protected-access
+            self._loop_thread_id
+        )
+        if frame is None:
+            return None
+
+        summary = traceback.extract_stack(frame)
+        frames = [(f.filename, f.lineno or 0, f.name, f.line or "") for f in summary]
+        # drop the frames of the event loop itself, up to the callback it runs.
+        for i in range(len(frames) - 1, -1, -1):
+            fname, _, func, _ = frames[i]
+            if func == "_run" and fname.endswith(os.path.join("asyncio", "events.py")):
+                frames = frames[i + 1 :]
+                break
+        return frames[-DEFAULT_LOOP_LAG_STACK_DEPTH:]
+
+    def get_lag_stats(self) -> Dict[str, float]:
+        """Get the median, 99th percentile, and max lag of recent heartbeats."""
+        lags = sorted(self._lags)
+        if not lags:
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0, "samples": 0}
+        return {
+            "p50": lags[int(0.5 * (len(lags) - 1))],
+            "p99": lags[int(0.99 * (len(lags) - 1))],
+            "max": lags[-1],
+            "samples": len(lags),
+        }
+
+    def get_top_offenders(self, limit: int) -> List[LagRecord]:
+        """Get up to `limit` records which blocked the loop for the longest in total."""
+        with self._lock:
+            records = list(self.records.values())
+        records.sort(key=lambda r: r.total_time, reverse=True)
+        return records[:limit]
+
+    def format_report(self, limit: int, depth: int = 0) -> str:
+        """
+        Format lag stats and the top `limit` offenders as text.
+
+        :param: depth:  Number of stack frames shown per offender, 0 for all.
+        """
+        stats = self.get_lag_stats()
+        lines = [
+            f"Loop lag over {int(stats['samples'])} beats  "
+            f"p50: {stats['p50'] * 1000:.1f}ms  "
+            f"p99: {stats['p99'] * 1000:.1f}ms  "
+            f"max: {stats['max'] * 1000:.1f}ms",
+            f"Stalls over {self.threshold * 1000:.0f}ms:  "
+            f"{sum(r.count for r in self.records.values())}",
+        ]
+        for n, record in enumerate(self.get_top_offenders(limit), 1):
+            lines.append(
+                f"\n#{n} {record.location}\n"
+                f"  count: {record.count}  total: {record.total_time:.2f}s  "
+                f"max: {record.max_time * 1000:.0f}ms\n"
+                f"{record.format_stack(depth).rstrip()}"
+            )
+        return "\n".join(lines)
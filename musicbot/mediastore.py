@@ -0,0 +1,603 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from .constants import (
+    DATA_FILE_MEDIA_INDEX,
+    DEFAULT_BACKGROUND_PROC_TIMEOUT,
+    DEFAULT_DATA_DIR,
+    DEFAULT_MEDIA_ANALYSIS_QUEUE,
+    DEFAULT_MEDIA_IDENTITY_CACHE,
+    DEFAULT_MEDIA_IDENTITY_TTL,
+    DEFAULT_MEDIA_PROBE_BATCH,
+    DEFAULT_PROBE_TIMEOUT,
+    DEFAULT_SILENCE_MIN_DURATION,
+    DEFAULT_SILENCE_NOISE_DB,
+)
+from .procpool import ProcPriority, helper_procs
+
+if TYPE_CHECKING:
+    from .bot import MusicBot
+
+log = logging.getLogger(__name__)
+
+# optionally using pymediainfo instead of ffprobe if presents
+try:
+    import pymediainfo  # type: ignore[import-untyped]
+except ImportError:
+    log.debug("module 'pymediainfo' not found, will fall back to ffprobe.")
+    pymediainfo = None  # type: ignore[assignment]
+
+# Callable used to get the results of a media analysis.
+AnalysisCallback = Callable[[Dict[str, Any]], None]
+
+_SILENCE_START_RE = re.compile(rb"silence_start: (-?[0-9.]+)")
+_SILENCE_END_RE = re.compile(rb"silence_end: (-?[0-9.]+)")
+_DURATION_RE = re.compile(rb"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+# Silence within this many seconds of the start or end counts as leading or trailing.
+_SILENCE_EDGE = 0.05
+# Loudness targets used when measuring and when normalizing playback.
+_LOUDNORM_TARGET = "I=-24.0:LRA=7.0:TP=-2.0:linear=true"
+# Measured values printed by loudnorm, and the playback options they are passed to.
+_LOUDNORM_FIELDS = {
+    "input_i": "measured_I",
+    "input_lra": "measured_LRA",
+    "input_tp": "measured_TP",
+    "input_thresh": "measured_thresh",
+    "target_offset": "offset",
+}
+_LOUDNORM_RE = re.compile(
+    rb'"(input_i|input_lra|input_tp|input_thresh|target_offset)" : "(-?[0-9]*\.?[0-9]+)"'
+)
+
+
+def get_silence_bounds(
+    output: bytes, duration: Optional[float]
+) -> Tuple[float, Optional[float]]:
+    """
+    Find where audio starts and ends, from the output of ffmpeg silencedetect.
+
+    :param: output:  stderr output of ffmpeg with the silencedetect filter.
+    :param: duration:  Duration of the media, used to find trailing silence.
+
+    :returns:  The start offset, and end offset or None if there is no
+        trailing silence.
+    """
+    periods: List[Tuple[float, Optional[float]]] = []
+    for line in output.splitlines():
+        match = _SILENCE_START_RE.search(line)
+        if match:
+            periods.append((max(0.0, float(match.group(1))), None))
+            continue
+        match = _SILENCE_END_RE.search(line)
+        if match and periods and periods[-1][1] is None:
+            periods[-1] = (periods[-1][0], float(match.group(1)))
+
+    start = 0.0
+    end: Optional[float] = None
+    if not periods:
+        return start, end
+
+    first_start, first_end = periods[0]
+    if first_start <= _SILENCE_EDGE and first_end is not None:
+        start = first_end
+
+    last_start, last_end = periods[-1]
+    if last_start > start and (
+        last_end is None
+        or (duration is not None and last_end >= duration - _SILENCE_EDGE)
+    ):
+        end = last_start
+
+    return start, end
+
+
+def get_loudness_from_output(output: bytes) -> Dict[str, float]:
+    """
+    Parse the measured values printed by the ffmpeg loudnorm filter.
+    Values which could not be parsed are left out.
+    """
+    values: Dict[str, float] = {}
+    for match in _LOUDNORM_RE.finditer(output):
+        values[match.group(1).decode()] = float(match.group(2))
+    return values
+
+
+def get_duration_from_output(output: bytes) -> Optional[float]:
+    """Parse the input duration printed by ffmpeg, if there is one."""
+    match = _DURATION_RE.search(output)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def get_metadata_from_ffprobe(output: bytes) -> Dict[str, Any]:
+    """
+    Get duration, codec, bitrate, and channel layout from ffprobe JSON
+    output, for the first audio stream.  Missing values are left out.
+    """
+    try:
+        data = json.loads(output)
+    except (ValueError, UnicodeError):
+        return {}
+
+    fmt = data.get("format", {})
+    streams = [s for s in data.get("streams", []) if s.get("codec_type") == "audio"]
+    stream = streams[0] if streams else {}
+
+    metadata: Dict[str, Any] = {}
+    for key, values, cast in (
+        ("duration", (fmt.get("duration"), stream.get("duration")), float),
+        ("codec", (stream.get("codec_name"),), str),
+        ("bitrate", (stream.get("bit_rate"), fmt.get("bit_rate")), int),
+        ("channel_layout", (stream.get("channel_layout"),), str),
+        ("sample_rate", (stream.get("sample_rate"),), int),
+    ):
+        for value in values:
+            if value in (None, "", "N/A"):
+                continue
+            try:
+                metadata[key] = cast(value)
+                break
+            except (TypeError, ValueError):
+                continue
+    return metadata
+
+
+def get_metadata_from_mediainfo(filename: str) -> Dict[str, Any]:
+    """
+    Get duration, codec, bitrate, and channel layout using pymediainfo.
+    This blocks while the file is parsed, so it should be run in an executor.
+    """
+    if not pymediainfo:
+        return {}
+
+    try:
+        mediainfo = pymediainfo.MediaInfo.parse(filename)
+    except (FileNotFoundError, OSError, RuntimeError, ValueError, TypeError):
+        log.exception("Failed to get metadata via pymediainfo.")
+        return {}
+
+    metadata: Dict[str, Any] = {}
+    general = mediainfo.general_tracks[0] if mediainfo.general_tracks else None
+    audio = mediainfo.audio_tracks[0] if mediainfo.audio_tracks else None
+    try:
+        if general is not None and general.duration:
+            metadata["duration"] = float(general.duration) / 1000
+        if audio is not None:
+            if audio.format:
+                metadata["codec"] = str(audio.format).lower()
+            if audio.bit_rate:
+                metadata["bitrate"] = int(audio.bit_rate)
+            if audio.channel_layout:
+                metadata["channel_layout"] = str(audio.channel_layout)
+            if audio.sampling_rate:
+                metadata["sample_rate"] = int(audio.sampling_rate)
+    except (TypeError, ValueError):
+        log.debug("Unexpected metadata from pymediainfo for:  %s", filename)
+    return metadata
+
+
+class MediaStore:
+    def __init__(self, bot: "MusicBot") -> None:
+        """
+        Store results of media analysis on disk, keyed by the path, size,
+        and modification time of each file, so results are reused across
+        plays and restarts until the file changes.
+        Analysis is done by a background worker with a bounded queue, so
+        it never holds up entries getting ready to play.
+        """
+        self.bot = bot
+        self.index_file = pathlib.Path(DEFAULT_DATA_DIR).joinpath(DATA_FILE_MEDIA_INDEX)
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._index_lock: asyncio.Lock = asyncio.Lock()
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(
+            maxsize=DEFAULT_MEDIA_ANALYSIS_QUEUE
+        )
+        self._pending: Dict[str, List[AnalysisCallback]] = {}
+        self._worker: Optional[asyncio.Task[None]] = None
+        self._probe_waiting: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+        self._prober: Optional[asyncio.Task[None]] = None
+        # recent file identities, so lookups from entry properties do not stat.
+        self._identities: Dict[str, Tuple[float, Optional[Tuple[str, int, int]]]] = {}
+
+        self.load_index()
+
+    @staticmethod
+    def _get_identity(filename: str) -> Optional[Tuple[str, int, int]]:
+        """Get the path, size, and mtime in nanoseconds of a file, if it exists."""
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+    def _get_recent_identity(self, filename: str) -> Optional[Tuple[str, int, int]]:
+        """
+        Like _get_identity() but reuses a result from the last few seconds,
+        so repeated lookups for queued entries do not block the event loop.
+        """
+        now = time.monotonic()
+        cached = self._identities.get(filename)
+        if cached is not None and now - cached[0] < DEFAULT_MEDIA_IDENTITY_TTL:
+            return cached[1]
+
+        # drop expired identities, so files which are gone do not pile up.
+        if len(self._identities) >= DEFAULT_MEDIA_IDENTITY_CACHE:
+            self._identities = {
+                fn: item
+                for fn, item in self._identities.items()
+                if now - item[0] < DEFAULT_MEDIA_IDENTITY_TTL
+            }
+
+        ident = self._get_identity(filename)
+        self._identities[filename] = (now, ident)
+        return ident
+
+    def get(self, filename: str) -> Dict[str, Any]:
+        """
+        Get stored analysis results for `filename`, or an empty dict if the
+        file has not been analyzed or has changed since it was.
+        """
+        ident = self._get_recent_identity(filename)
+        if ident is None:
+            return {}
+
+        path, size, mtime = ident
+        record = self._index.get(path)
+        if not record or record.get("size") != size or record.get("mtime") != mtime:
+            return {}
+        return record
+
+    def update(self, filename: str, **data: Any) -> None:
+        """Store analysis results for `filename` along with its identity."""
+        ident = self._get_identity(filename)
+        self._identities[filename] = (time.monotonic(), ident)
+        if ident is None:
+            return
+
+        path, size, mtime = ident
+        record = self._index.get(path)
+        if not record or record.get("size") != size or record.get("mtime") != mtime:
+            record = {"size": size, "mtime": mtime}
+            self._index[path] = record
+        record.update(data)
+
+    def get_metadata(self, filename: str) -> Dict[str, Any]:
+        """
+        Get stored metadata for `filename`, without probing it.
+
+        :returns:  A dict which may contain duration, codec, bitrate,
+            channel_layout, and sample_rate keys.
+        """
+        metadata: Dict[str, Any] = self.get(filename).get("metadata", {})
+        return metadata
+
+    async def probe(self, filename: str) -> Dict[str, Any]:
+        """
+        Get metadata for `filename` from the index, or wait for it to be
+        probed along with any other files requested at the same time.
+
+        :returns:  Metadata as returned by get_metadata().  Empty if the
+            file could not be probed.
+        """
+        record = self.get(filename)
+        if "metadata" in record:
+            metadata: Dict[str, Any] = record["metadata"]
+            # analysis may have found a duration that probing could not.
+            if "duration" not in metadata and record.get("duration"):
+                return {**metadata, "duration": record["duration"]}
+            return metadata
+
+        if self._get_identity(filename) is None:
+            return {}
+
+        path = os.path.abspath(filename)
+        future = self._probe_waiting.get(path)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._probe_waiting[path] = future
+            if self._prober is None or self._prober.done():
+                self._prober = self.bot.loop.create_task(
+                    self._run_prober(), name="MB_MediaProber"
+                )
+        return await asyncio.shield(future)
+
+    async def _run_prober(self) -> None:
+        """Probe waiting files in batches, until none are left."""
+        # give other callers a chance to join the first batch.
+        await asyncio.sleep(0)
+        while self._probe_waiting:
+            batch = list(self._probe_waiting.items())[:DEFAULT_MEDIA_PROBE_BATCH]
+            for path, _ in batch:
+                del self._probe_waiting[path]
+
+            paths = [path for path, _ in batch]
+            try:
+                results = await self._probe_batch(paths)
+            except Exception:  # pylint: disable=broad-exception-caught
+                log.exception("Failed to probe media files.")
+                results = [{} for _ in paths]
+
+            for (path, future), metadata in zip(batch, results):
+                if metadata:
+                    self.update(path, metadata=metadata)
+                if not future.done():
+                    future.set_result(metadata)
+
+            await self.save_index()
+
+    async def _probe_batch(self, paths: List[str]) -> List[Dict[str, Any]]:
+        """
+        Probe a batch of files, using pymediainfo in an executor if it is
+        available, and ffprobe for anything it could not read.
+        """
+        log.debug("Probing metadata of %s media file(s).", len(paths))
+        results: List[Dict[str, Any]] = [{} for _ in paths]
+        if pymediainfo:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(
+                None, lambda: [get_metadata_from_mediainfo(p) for p in paths]
+            )
+
+        missing = [i for i, r in enumerate(results) if "duration" not in r]
+        if missing:
+            probed = await asyncio.gather(
+                *[self._probe_ffprobe(paths[i]) for i in missing]
+            )
+            for i, metadata in zip(missing, probed):
+                results[i] = {**metadata, **results[i]}
+        return results
+
+    async def _probe_ffprobe(self, filename: str) -> Dict[str, Any]:
+        """Use ffprobe to get metadata for `filename`."""
+        ffprobe_bin = shutil.which("ffprobe")
+        if not ffprobe_bin:
+            log.error("Could not locate ffprobe in your path!")
+            return {}
+
+        cmd = [
+            ffprobe_bin,
+            "-v",
+            "quiet",
+            "-print_format",
+            "json",
+            "-show_format",
+            "-show_streams",
+            filename,
+        ]
+        try:
+            _, output, _ = await helper_procs.run(
+                cmd,
+                priority=ProcPriority.PLAYBACK,
+                timeout=DEFAULT_PROBE_TIMEOUT,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except asyncio.TimeoutError:
+            log.error("ffprobe took too long to read:  %s", filename)
+            return {}
+        except OSError:
+            log.exception("ffprobe could not be executed for some reason.")
+            return {}
+
+        metadata = get_metadata_from_ffprobe(output)
+        if not metadata:
+            log.error("ffprobe returned something that could not be used.")
+        return metadata
+
+    @property
+    def analysis_enabled(self) -> bool:
+        """Returns True if any option which needs media analysis is enabled."""
+        return (
+            self.bot.config.trim_silence
+            or self.bot.config.use_experimental_equalization
+        )
+
+    def _needs_analysis(self, record: Dict[str, Any]) -> bool:
+        """Check if results for an enabled option are missing from `record`."""
+        if self.bot.config.trim_silence and "silence" not in record:
+            return True
+        if self.bot.config.use_experimental_equalization and "loudness" not in record:
+            return True
+        return False
+
+    def queue_analysis(
+        self, filename: str, callback: Optional[AnalysisCallback] = None
+    ) -> None:
+        """
+        Queue `filename` for background analysis, unless it already has
+        results, is already queued, or the queue is full.
+
+        :param: callback:  Called with the results once they are available.
+        """
+        if not self.analysis_enabled or not filename:
+            return
+
+        record = self.get(filename)
+        if not self._needs_analysis(record):
+            if callback and record:
+                callback(record)
+            return
+
+        path = os.path.abspath(filename)
+        if path in self._pending:
+            if callback:
+                self._pending[path].append(callback)
+            return
+
+        try:
+            self._queue.put_nowait(path)
+        except asyncio.QueueFull:
+            log.debug("Media analysis queue is full, skipping:  %s", filename)
+            return
+
+        self._pending[path] = [callback] if callback else []
+        if self._worker is None or self._worker.done():
+            self._worker = self.bot.loop.create_task(
+                self._run_worker(), name="MB_MediaAnalysis"
+            )
+
+    async def _run_worker(self) -> None:
+        """Analyze queued files one at a time until the queue is empty."""
+        while not self._queue.empty():
+            path = self._queue.get_nowait()
+            try:
+                await self.analyze(path)
+            except Exception:  # pylint: disable=broad-exception-caught
+                log.exception("Failed to analyze media file:  %s", path)
+            finally:
+                callbacks = self._pending.pop(path, [])
+                self._queue.task_done()
+
+            record = self.get(path)
+            for callback in callbacks if record else []:
+                try:
+                    callback(record)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    log.exception("Error in media analysis callback.")
+
+    async def analyze(self, filename: str) -> None:
+        """
+        Run a single ffmpeg decode of `filename` to find its duration, and
+        detect silence or measure loudness as enabled, then store the results.
+        """
+        ffmpeg_bin = shutil.which("ffmpeg")
+        if not ffmpeg_bin:
+            log.error("Could not locate ffmpeg on your path!")
+            return
+
+        if self._get_identity(filename) is None:
+            return
+
+        filters = []
+        if self.bot.config.trim_silence:
+            filters.append(
+                f"silencedetect=noise={DEFAULT_SILENCE_NOISE_DB}dB"
+                f":d={DEFAULT_SILENCE_MIN_DURATION}"
+            )
+        if self.bot.config.use_experimental_equalization:
+            filters.append(f"loudnorm={_LOUDNORM_TARGET}:print_format=json")
+        if not filters:
+            return
+
+        log.debug("Analyzing media file:  %s", filename)
+        cmd = [
+            ffmpeg_bin,
+            "-nostdin",
+            "-hide_banner",
+            "-nostats",
+            "-i",
+            filename,
+            "-vn",
+            "-af",
+            ",".join(filters),
+            "-f",
+            "null",
+            "-",
+        ]
+        try:
+            returncode, _, output = await helper_procs.run(
+                cmd,
+                priority=ProcPriority.BACKGROUND,
+                timeout=DEFAULT_BACKGROUND_PROC_TIMEOUT,
+                stdout=asyncio.subprocess.DEVNULL,
+            )
+        except asyncio.TimeoutError:
+            log.warning("ffmpeg took too long to analyze media file:  %s", filename)
+            return
+        if returncode != 0:
+            log.warning("ffmpeg could not analyze media file:  %s", filename)
+            return
+
+        results: Dict[str, Any] = {}
+        duration = get_duration_from_output(output)
+        if duration:
+            results["duration"] = duration
+
+        if self.bot.config.trim_silence:
+            start, end = get_silence_bounds(output, duration)
+            log.debug(
+                "Media analysis found audio from %.2f to %s in:  %s",
+                start,
+                f"{end:.2f}" if end is not None else "the end",
+                filename,
+            )
+            results["silence"] = [start, end]
+
+        if self.bot.config.use_experimental_equalization:
+            loudness = get_loudness_from_output(output)
+            if len(loudness) != len(_LOUDNORM_FIELDS):
+                log.debug("Could not parse all loudnorm values for:  %s", filename)
+            results["loudness"] = loudness
+
+        self.update(filename, **results)
+        await self.save_index()
+
+    def get_silence_trim(self, filename: str) -> Tuple[float, Optional[float]]:
+        """
+        Get the start and end offsets of audio in `filename`, if trimming
+        is enabled and the file has been analyzed.
+        """
+        if not self.bot.config.trim_silence:
+            return 0.0, None
+        bounds = self.get(filename).get("silence")
+        if not bounds:
+            return 0.0, None
+        return float(bounds[0]), bounds[1]
+
+    def get_loudnorm_options(self, filename: str) -> str:
+        """
+        Get ffmpeg options to normalize loudness of `filename` during playback,
+        or an empty string if it has not been measured.
+        """
+        loudness = self.get(filename).get("loudness")
+        if loudness is None:
+            return ""
+
+        measured = ":".join(
+            f"{opt}={float(loudness.get(field, 0.0))}"
+            for field, opt in _LOUDNORM_FIELDS.items()
+        )
+        return f"-af loudnorm={_LOUDNORM_TARGET}:{measured}"
+
+    def load_index(self) -> None:
+        """
+        Load the media index file if it exists, dropping records of files
+        which no longer exist.
+        """
+        if not self.index_file.is_file():
+            return
+
+        try:
+            with open(self.index_file, "r", encoding="utf8") as fh:
+                data = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            log.exception("Failed to load media index.")
+            return
+
+        self._index = {
+            path: record
+            for path, record in data.items()
+            if isinstance(record, dict) and os.path.isfile(path)
+        }
+        log.debug("Loaded media index with %s entries.", len(self._index))
+
+    async def save_index(self) -> None:
+        """
+        Uses asyncio.Lock to save the media index as a json file.
+        """
+        async with self._index_lock:
+            temp_file = self.index_file.with_suffix(".tmp")
+            try:
+                with open(temp_file, "w", encoding="utf8") as fh:
+                    json.dump(self._index, fh)
+                os.replace(temp_file, self.index_file)
+            except (TypeError, ValueError, RecursionError, OSError):
+                log.exception("Failed to save media index.")
@@ -0,0 +1,250 @@
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+from discord import AudioSource
+from discord.opus import Encoder as OpusEncoder
+
+from .constants import DEFAULT_MIXER_RAMP_FRAMES
+
+log = logging.getLogger(__name__)
+
+# optionally using numpy to process PCM audio if present
+try:
+    import numpy
+except ImportError:
+    log.debug("module 'numpy' not found, will fall back to PCMVolumeTransformer.")
+    numpy = None  # type: ignore[assignment]
+
+# Number of interleaved 16-bit samples in a single 20ms frame of PCM audio.
+FRAME_SAMPLES = OpusEncoder.SAMPLES_PER_FRAME * OpusEncoder.CHANNELS
+# Volume limits, matching those used by discord.PCMVolumeTransformer.
+MIN_GAIN = 0.0
+MAX_GAIN = 2.0
+
+
+def pcm_mixer_available() -> bool:
+    """Returns True if the optional numpy module is available for PCMMixer."""
+    return numpy is not None
+
+
+class MixerInput:
+    def __init__(self, source: AudioSource, gain: float, ramp_frames: int) -> None:
+        """
+        Hold a PCM audio source that is mixed by PCMMixer, along with its
+        gain, which moves toward a target gain over a number of frames.
+
+        :param: source:  An AudioSource which produces 16-bit stereo PCM.
+        :param: gain:  The starting gain for the source.
+        :param: ramp_frames:  Default number of frames to reach a new target gain.
+        """
+        self.source = source
+        self.gain: float = gain
+        self.target_gain: float = gain
+        self.ramp_frames: int = max(1, ramp_frames)
+        self.finished: bool = False
+        self._step: float = 0.0
+        self._primed: Deque[bytes] = deque()
+
+    def prime(self, frames: int) -> int:
+        """
+        Read up to `frames` frames from the source ahead of time and hold
+        on to them.  Gain is applied to primed frames when they are mixed,
+        so later gain changes still apply to them.
+
+        :returns:  The number of frames now held in the prime buffer.
+        """
+        while len(self._primed) < frames:
+            data = self.source.read()
+            if not data:
+                break
+            self._primed.append(data)
+        return len(self._primed)
+
+    def read(self) -> bytes:
+        """Read a frame of audio, using any primed frames first."""
+        if self._primed:
+            return self._primed.popleft()
+        return self.source.read()
+
+    def set_target(self, gain: float, frames: Optional[int] = None) -> None:
+        """
+        Set a new target gain, reached after the given number of `frames`
+        or after the default ramp if `frames` is not given.
+        """
+        frames = self.ramp_frames if frames is None else max(1, frames)
+        self.target_gain = min(max(gain, MIN_GAIN), MAX_GAIN)
+        self._step = (self.target_gain - self.gain) / frames
+
+    def next_gain(self) -> float:
+        """
+        Move the gain one frame along its ramp.
+
+        :returns:  The gain at the end of the next frame.
+        """
+        if self.gain != self.target_gain:
+            gain = self.gain + self._step
+            if (self._step >= 0 and gain >= self.target_gain) or (
+                self._step <= 0 and gain <= self.target_gain
+            ):
+                gain = self.target_gain
+            self.gain = gain
+        return self.gain
+
+    @property
+    def is_ramping(self) -> bool:
+        """Returns True if gain has not reached its target yet."""
+        return self.gain != self.target_gain
+
+
+class PCMMixer(AudioSource):
+    def __init__(
+        self,
+        source: AudioSource,
+        volume: float = 1.0,
+        ramp_frames: int = DEFAULT_MIXER_RAMP_FRAMES,
+    ) -> None:
+        """
+        Apply volume to a PCM `source` and mix other PCM sources in with it.
+        Audio is processed with numpy, using buffers that are allocated once
+        when the mixer is created, so reading a frame does not allocate any
+        working memory.  Gain changes are ramped over several frames to
+        avoid clicks, and the mixed audio is clipped to the 16-bit range.
+
+        :param: source:  The main AudioSource, producing 16-bit stereo PCM.
+        :param: volume:  The gain applied to the main source.
+        :param: ramp_frames:  Number of 20ms frames used to ramp gain changes.
+
+        :raises: RuntimeError  if numpy is not available.
+        """
+        if numpy is None:
+            raise RuntimeError("PCMMixer cannot be used without numpy.")
+
+        self._ramp_frames = ramp_frames
+        self._main = MixerInput(
+            source, min(max(volume, MIN_GAIN), MAX_GAIN), ramp_frames
+        )
+        self._overlays: List[MixerInput] = []
+        # overlays are added from the event loop while the player thread reads.
+        self._overlay_lock = threading.Lock()
+
+        # Working buffers, reused for every frame.
+        self._mix: Any = numpy.zeros(FRAME_SAMPLES, dtype=numpy.float32)
+        self._work: Any = numpy.zeros(FRAME_SAMPLES, dtype=numpy.float32)
+        self._gain: Any = numpy.zeros(FRAME_SAMPLES, dtype=numpy.float32)
+        self._out: Any = numpy.zeros(FRAME_SAMPLES, dtype=numpy.int16)
+        # Position of each sample within a frame, from just above 0 to 1.
+        # Both channels of a sample share the same position.
+        self._ramp: Any = numpy.repeat(
+            numpy.linspace(
+                1 / OpusEncoder.SAMPLES_PER_FRAME,
+                1.0,
+                OpusEncoder.SAMPLES_PER_FRAME,
+                dtype=numpy.float32,
+            ),
+            OpusEncoder.CHANNELS,
+        )
+
+    @property
+    def volume(self) -> float:
+        """The target gain of the main source."""
+        return self._main.target_gain
+
+    @volume.setter
+    def volume(self, value: float) -> None:
+        self._main.set_target(value)
+
+    @property
+    def main(self) -> MixerInput:
+        """The input for the main source of this mixer."""
+        return self._main
+
+    def add_source(self, source: AudioSource, gain: float = 1.0) -> MixerInput:
+        """
+        Mix the PCM `source` in with the main source, until it runs out.
+
+        :param: gain:  The gain to apply to the added source.
+
+        :returns:  The MixerInput, which can be used to change gain later.
+        """
+        inp = MixerInput(source, gain, self._ramp_frames)
+        with self._overlay_lock:
+            self._overlays.append(inp)
+        return inp
+
+    def _mix_input(self, inp: MixerInput) -> bool:
+        """
+        Read a frame from `inp` and add it to the mix buffer.
+
+        :returns:  False if the input has run out of audio.
+        """
+        if inp.finished:
+            return False
+
+        data = inp.read()
+        if not data:
+            inp.finished = True
+            return False
+
+        samples = numpy.frombuffer(data, dtype=numpy.int16)
+        count = samples.shape[0]
+        if count >= FRAME_SAMPLES:
+            numpy.copyto(self._work, samples[:FRAME_SAMPLES])
+        else:
+            # short reads happen at the end of a stream, pad them with silence.
+            numpy.copyto(self._work[:count], samples)
+            self._work[count:] = 0
+
+        start = inp.gain
+        end = inp.next_gain()
+        if start == end:
+            if end != 1.0:
+                numpy.multiply(self._work, end, out=self._work)
+        else:
+            numpy.multiply(self._ramp, end - start, out=self._gain)
+            numpy.add(self._gain, start, out=self._gain)
+            numpy.multiply(self._work, self._gain, out=self._work)
+
+        numpy.add(self._mix, self._work, out=self._mix)
+        return True
+
+    def read(self) -> bytes:
+        self._mix.fill(0)
+        has_audio = self._mix_input(self._main)
+
+        with self._overlay_lock:
+            overlays = list(self._overlays)
+
+        finished = []
+        for inp in overlays:
+            if self._mix_input(inp):
+                has_audio = True
+            # inputs which have faded out completely are not needed anymore.
+            if inp.gain == 0.0 and inp.target_gain == 0.0:
+                inp.finished = True
+            if inp.finished:
+                finished.append(inp)
+
+        if finished:
+            with self._overlay_lock:
+                for inp in finished:
+                    self._overlays.remove(inp)
+            for inp in finished:
+                inp.source.cleanup()
+
+        if not has_audio:
+            return b""
+
+        numpy.clip(self._mix, -32768, 32767, out=self._mix)
+        numpy.copyto(self._out, self._mix, casting="unsafe")
+        # discord.py needs an immutable bytes object for the encoder.
+        return self._out.tobytes()  # type: ignore[no-any-return]
+
+    def cleanup(self) -> None:
+        with self._overlay_lock:
+            overlays = list(self._overlays)
+            self._overlays.clear()
+        for inp in overlays:
+            inp.source.cleanup()
+        self._main.source.cleanup()
@@ -1,20 +1,52 @@
+import array
 import asyncio
-import io
+import functools
 import json
 import logging
 import os
+import re
+import selectors
 import sys
+import threading
 import time
+from collections import Counter, deque
 from enum import Enum
-from threading import Thread
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
-
-from discord import AudioSource, FFmpegPCMAudio, PCMVolumeTransformer, VoiceClient
-
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from discord import (
+    AudioSource,
+    FFmpegOpusAudio,
+    FFmpegPCMAudio,
+    PCMVolumeTransformer,
+    VoiceClient,
+)
+from discord.opus import Encoder as OpusEncoder
+
+from .constants import (
+    DEFAULT_FFMPEG_STDERR_LINES,
+    DEFAULT_FRAME_TIMING_WINDOW,
+    DEFAULT_GAPLESS_PRIME_FRAMES,
+    DEFAULT_GAPLESS_PRIME_LEAD,
+)
 from .constructs import Serializable, Serializer, SkipState
 from .entry import LocalFilePlaylistEntry, StreamPlaylistEntry, URLPlaylistEntry
-from .exceptions import FFmpegError, FFmpegWarning
+from .exceptions import FFmpegError
+from .fanout import shared_decoders
 from .lib.event_emitter import EventEmitter
+from .mixer import PCMMixer, pcm_mixer_available
+from .scheduler import DownloadPriority
+from .workers import WorkerOpusSource, audio_workers
 
 if TYPE_CHECKING:
     from .bot import MusicBot
@@ -29,6 +61,9 @@ EntryTypes = Union[URLPlaylistEntry, StreamPlaylistEntry, LocalFilePlaylistEntry
 
 log = logging.getLogger(__name__)
 
+# Number of bytes in one second of the 16-bit stereo PCM made by ffmpeg.
+PCM_BYTES_PER_SECOND = OpusEncoder.SAMPLING_RATE * OpusEncoder.CHANNELS * 2
+
 
 class MusicPlayerState(Enum):
     STOPPED = 0  # When the player isn't playing anything
@@ -43,38 +78,219 @@ class MusicPlayerState(Enum):
         return self.name
 
 
+class FFmpegDiagnostic(Enum):
+    OTHER = 0  # Output we do not recognise, passed on to the console.
+    WARNING = 1  # Harmless complaints from ffmpeg.
+    FATAL = 2  # Errors that mean playback of the source has failed.
+    NETWORK = 3  # Connection problems, ffmpeg may recover from these.
+    CODEC = 4  # Problems decoding parts of the media.
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FFmpegStderrLine(NamedTuple):
+    category: FFmpegDiagnostic
+    message: str
+
+
+class FrameTimingStats:
+    # Upper limits of the histogram buckets in milliseconds, slower frames go in a final bucket.
+    BUCKETS_MS = (1, 2, 5, 10, 20, 40, 80)
+
+    def __init__(self, window: int = DEFAULT_FRAME_TIMING_WINDOW) -> None:
+        """
+        Keep a rolling record of the time taken to produce each audio frame,
+        along with counts of empty and short reads.
+        Frame times are kept in a fixed-size ring, so the histogram only
+        covers the most recent `window` frames while counters are totals.
+        """
+        self._times = array.array("f", [0.0]) * max(1, window)
+        self._pos: int = 0
+        self._filled: int = 0
+        self.frames: int = 0
+        self.empty_reads: int = 0
+        self.short_reads: int = 0
+        self.slow_frames: int = 0
+        self.max_time: float = 0.0
+
+    def record(self, elapsed: float, size: int, is_opus: bool) -> None:
+        """
+        Record a single read which took `elapsed` seconds and returned
+        `size` bytes. Called from the audio player thread.
+        """
+        self._times[self._pos] = elapsed
+        self._pos = (self._pos + 1) % len(self._times)
+        if self._filled < len(self._times):
+            self._filled += 1
+
+        self.frames += 1
+        if size == 0:
+            self.empty_reads += 1
+        elif not is_opus and size < OpusEncoder.FRAME_SIZE:
+            self.short_reads += 1
+
+        # A frame must be ready within its own 20ms or playback will stutter.
+        if elapsed > 0.02:
+            self.slow_frames += 1
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def histogram(self) -> List[int]:
+        """
+        Get the number of recent frames in each bucket of BUCKETS_MS, plus
+        a final count of frames slower than the last bucket.
+        """
+        counts = [0] * (len(self.BUCKETS_MS) + 1)
+        for elapsed in self._times[: self._filled]:
+            ms = elapsed * 1000
+            for idx, limit in enumerate(self.BUCKETS_MS):
+                if ms <= limit:
+                    counts[idx] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return counts
+
+    def percentile(self, pct: float) -> float:
+        """Get the frame time in seconds at `pct` percent of recent frames."""
+        if not self._filled:
+            return 0.0
+        times = sorted(self._times[: self._filled])
+        idx = min(len(times) - 1, int(len(times) * pct / 100))
+        return times[idx]
+
+
 class SourcePlaybackCounter(AudioSource):
     def __init__(
         self,
-        source: PCMVolumeTransformer[FFmpegPCMAudio],
+        source: Union[
+            PCMMixer,
+            PCMVolumeTransformer[AudioSource],
+            FFmpegOpusAudio,
+            WorkerOpusSource,
+        ],
         start_time: float = 0,
         playback_speed: float = 1.0,
+        stderr_sink: Optional["FFmpegStderrSink"] = None,
+        timing: Optional[FrameTimingStats] = None,
     ) -> None:
         """
-        Manage playback source and attempt to count progress frames used
-        to measure playback progress.
+        Manage playback source and measure playback progress, using the
+        progress reported by ffmpeg or by counting frames.
 
+        :param: source:  A PCM source with volume control, either a PCMMixer
+            or a PCMVolumeTransformer, or an Opus source with volume applied
+            by ffmpeg or by an audio worker process.
         :param: start_time:  A time in seconds that was used in ffmpeg -ss flag.
+        :param: stderr_sink:  The sink for ffmpeg stderr, which collects the
+            progress reports from ffmpeg.
+        :param: timing:  Stats to record the time taken by each read.
         """
         # NOTE: PCMVolumeTransformer will let you set any crazy value.
         # But internally it limits between 0 and 2.0.
         self._source = source
         self._num_reads: int = 0
+        self._bytes_read: int = 0
+        self._stderr_sink = stderr_sink
+        self._timing = timing
         self._start_time: float = start_time
         self._playback_speed: float = playback_speed
+        self._primed_frames: Deque[bytes] = deque()
+        self._eof_time: float = 0.0
+
+        # Time of the previous source EOF, used to measure the gap between tracks.
+        self.gap_origin: float = 0.0
+        self.transition_gap: Optional[float] = None
+
+    def prime(self, frames: int) -> int:
+        """
+        Read up to `frames` frames ahead of playback and hold on to them,
+        so the first reads made by the VoiceClient do not wait on ffmpeg.
+        This call blocks while ffmpeg starts up, so it should be run in
+        an executor before the source is handed to a VoiceClient.
+
+        :returns:  The number of frames now held in the prime buffer.
+        """
+        mixer = self.mixer
+        if mixer is not None:
+            # buffer below the mixer, so gain set by crossfade applies to them.
+            return mixer.main.prime(frames)
+
+        while len(self._primed_frames) < frames:
+            data = self._source.read()
+            if not data:
+                break
+            self._primed_frames.append(data)
+        return len(self._primed_frames)
 
     def read(self) -> bytes:
-        res = self._source.read()
+        started = time.perf_counter()
+        if self._primed_frames:
+            res = self._primed_frames.popleft()
+        else:
+            res = self._source.read()
+
+        if self._timing is not None:
+            self._timing.record(
+                time.perf_counter() - started, len(res), self._source.is_opus()
+            )
+
         if res:
             self._num_reads += 1
+            self._bytes_read += len(res)
+            if self._num_reads == 1 and self.gap_origin:
+                self.transition_gap = time.perf_counter() - self.gap_origin
+                log.voicedebug(  # type: ignore[attr-defined]
+                    "Measured gap between tracks:  %.1f ms",
+                    self.transition_gap * 1000,
+                )
+        elif not self._eof_time:
+            self._eof_time = time.perf_counter()
         return res
 
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def stop_timing(self) -> None:
+        """
+        Stop recording frame times, used once this source is mixed into
+        another source whose reads are already being timed.
+        """
+        self._timing = None
+
     def cleanup(self) -> None:
         log.noise(  # type: ignore[attr-defined]
             "Cleanup got called on the audio source:  %r", self
         )
         self._source.cleanup()
 
+    def set_volume(self, volume: float) -> bool:
+        """
+        Apply `volume` to the source, if it can be changed in place.
+
+        :returns:  False if the source must be re-opened to change volume.
+        """
+        if isinstance(self._source, (PCMMixer, PCMVolumeTransformer, WorkerOpusSource)):
+            self._source.volume = volume
+            return True
+        return False
+
+    @property
+    def mixer(self) -> Optional[PCMMixer]:
+        """The PCMMixer used by this source, if there is one."""
+        if isinstance(self._source, PCMMixer):
+            return self._source
+        return None
+
+    @property
+    def eof_time(self) -> float:
+        """
+        The perf_counter() time when the source first returned no data,
+        or 0 if the source has not reached its end.
+        """
+        return self._eof_time
+
     @property
     def frames(self) -> int:
         """
@@ -86,10 +302,19 @@ class SourcePlaybackCounter(AudioSource):
     @property
     def session_progress(self) -> float:
         """
-        Like progress but only counts frames from this session.
+        Like progress but only counts playback from this session.
+        PCM sources use the latest progress report from ffmpeg, less the
+        audio ffmpeg has output that was not played yet. Otherwise this
+        falls back to counting frames.
         Adjusts the estimated time by playback speed.
         """
-        return (self._num_reads * 0.02) * self._playback_speed
+        played = self._num_reads * 0.02
+        report = self._stderr_sink.progress if self._stderr_sink else None
+        if report is not None and not self.is_opus():
+            out_time, total_size = report
+            unplayed = (total_size - self._bytes_read) / PCM_BYTES_PER_SECOND
+            played = max(0.0, out_time - unplayed)
+        return played * self._playback_speed
 
     @property
     def progress(self) -> float:
@@ -130,9 +355,25 @@ class MusicPlayer(EventEmitter, Serializable):
         self._current_player: Optional[VoiceClient] = None
         self._current_entry: Optional[EntryTypes] = None
         self._stderr_future: Optional[AsyncFuture] = None
+        # Lines of ffmpeg stderr output seen by this player, by category.
+        self.ffmpeg_diagnostics: Counter[FFmpegDiagnostic] = Counter()
+        # Time taken to produce each audio frame read by the VoiceClient.
+        self.frame_timing: FrameTimingStats = FrameTimingStats()
 
         self._source: Optional[SourcePlaybackCounter] = None
 
+        # Gapless playback keeps the next entry's source open ahead of time.
+        self._primed_source: Optional[
+            Tuple[
+                EntryTypes, Tuple[str, str], SourcePlaybackCounter, "FFmpegStderrSink"
+            ]
+        ] = None
+        self._gapless_pending: bool = False
+        self._last_eof_time: float = 0.0
+        self._last_transition_gap: Optional[float] = None
+        # Time taken by the last call to restart_source(), in seconds.
+        self.last_seek_latency: Optional[float] = None
+
         self.playlist.on("entry-added", self.on_entry_added)
         self.playlist.on("entry-failed", self.on_entry_failed)
 
@@ -148,8 +389,8 @@ class MusicPlayer(EventEmitter, Serializable):
         active playback source.
         """
         self._volume = value
-        if self._source:
-            self._source._source.volume = value
+        if self._source and not self._source.set_volume(value):
+            self.bot.create_task(self.restart_source(), name="MB_RestartSource")
 
     def on_entry_added(
         self, playlist: "Playlist", entry: EntryTypes, defer_serialize: bool = False
@@ -176,6 +417,14 @@ class MusicPlayer(EventEmitter, Serializable):
         log.noise(  # type: ignore[attr-defined]
             "MusicPlayer.skip() is called:  %s", repr(self)
         )
+        # without the cache, the rest of a skipped progressive download is not needed.
+        entry = self.current_entry
+        if (
+            isinstance(entry, URLPlaylistEntry)
+            and entry.is_progressive
+            and not self.bot.config.save_videos
+        ):
+            entry.cancel_download()
         self._kill_current_player()
 
     def stop(self) -> None:
@@ -249,8 +498,10 @@ class MusicPlayer(EventEmitter, Serializable):
         )
         self.state = MusicPlayerState.DEAD
         self.playlist.clear()
+        self.playlist.cancel_downloads()
         self._events.clear()
         self._kill_current_player()
+        self._discard_primed_source()
 
     def _playback_finished(self, error: Optional[Exception] = None) -> None:
         """
@@ -279,6 +530,11 @@ class MusicPlayer(EventEmitter, Serializable):
         elif self.loopqueue:
             self.playlist.entries.append(entry)
 
+        # Remember when the source ran out, so the gap to the next track can be measured.
+        if self._source:
+            self._last_eof_time = self._source.eof_time
+            self._last_transition_gap = self.transition_gap
+
         # TODO: investigate if this is cruft code or not.
         if self._current_player:
             if hasattr(self._current_player, "after"):
@@ -313,6 +569,11 @@ class MusicPlayer(EventEmitter, Serializable):
                 self._handle_file_cleanup(entry), name="MB_CacheCleanup"
             )
 
+        # start the primed source right away, before event handlers can delay it.
+        if self._primed_source is not None and not self.is_dead:
+            self._gapless_pending = True
+            self.loop.call_soon_threadsafe(self._play_gapless)
+
         # finally, tell the rest of MusicBot that playback is done.
         self.emit("finished-playing", player=self, entry=entry)
 
@@ -349,10 +610,27 @@ class MusicPlayer(EventEmitter, Serializable):
         )
         self.bot.create_task(self._play(_continue=_continue), name="MB_Play")
 
-    async def _play(self, _continue: bool = False) -> None:
+    def _play_gapless(self) -> None:
+        """
+        Start the next entry using its primed source as soon as the
+        current playback has finished.
+        """
+        self.bot.create_task(
+            self._play(_continue=True, _gapless=True), name="MB_PlayGapless"
+        )
+
+    async def _play(self, _continue: bool = False, _gapless: bool = False) -> None:
         """
         Plays the next entry from the playlist, or resumes playback of the current entry if paused.
         """
+        if _gapless:
+            self._gapless_pending = False
+        elif self._gapless_pending:
+            log.voicedebug(  # type: ignore[attr-defined]
+                "MusicPlayer has a gapless transition pending, this call is ignored."
+            )
+            return
+
         if self.is_dead:
             log.voicedebug(  # type: ignore[attr-defined]
                 "MusicPlayer is dead, cannot play."
@@ -392,74 +670,553 @@ class MusicPlayer(EventEmitter, Serializable):
 
                 # If nothing left to play, transition to the stopped state.
                 if not entry:
+                    self._discard_primed_source()
                     self.stop()
                     return
 
                 # In-case there was a player, kill it. RIP.
                 self._kill_current_player()
 
-                boptions = "-nostdin"
-                # aoptions = "-vn -b:a 192k"
-                if isinstance(entry, (URLPlaylistEntry, LocalFilePlaylistEntry)):
-                    aoptions = entry.aoptions
-                    # check for before options, currently just -ss here.
-                    if entry.boptions:
-                        boptions += f" {entry.boptions}"
+                self._resolve_cache_file(entry)
+                primed = self._take_primed_source(entry)
+                if primed:
+                    self._source, stderr_sink = primed
+                    self._source.set_volume(self.volume)
                 else:
-                    aoptions = "-vn"
+                    codec = await self._get_source_codec(entry)
+                    self._source, stderr_sink = self._create_source(entry, codec)
 
-                log.ffmpeg(  # type: ignore[attr-defined]
-                    "Creating player with options: %s %s %s",
-                    boptions,
-                    aoptions,
-                    entry.filename,
+                if self._last_eof_time:
+                    self._source.gap_origin = self._last_eof_time
+                    self._last_eof_time = 0.0
+
+                log.voicedebug(  # type: ignore[attr-defined]
+                    "Playing %r using %r", self._source, self.voice_client
                 )
+                self.voice_client.play(self._source, after=self._playback_finished)
+
+                self._current_player = self.voice_client
+
+                # I need to add ytdl hooks
+                self.state = MusicPlayerState.PLAYING
+                self._current_entry = entry
+
+                self._watch_stderr(stderr_sink)
+
+                self.emit("play", player=self, entry=entry)
+
+                if self.bot.config.gapless_playback or self.crossfade_enabled:
+                    self.bot.create_task(
+                        self._prime_next_source(entry), name="MB_PrimeNextSource"
+                    )
+
+    def _get_source_options(self, entry: EntryTypes) -> Tuple[str, str]:
+        """
+        Get the ffmpeg before-options and options used to play `entry`.
+        """
+        boptions = "-nostdin"
+        # ffmpeg progress reports are used to measure PCM playback position.
+        if not self.bot.config.use_opus_audio and not self._use_audio_workers():
+            boptions += " -progress pipe:2"
+        # aoptions = "-vn -b:a 192k"
+        if isinstance(entry, (URLPlaylistEntry, LocalFilePlaylistEntry)):
+            aoptions = entry.aoptions
+            # check for before options, currently just -ss here.
+            if entry.boptions:
+                boptions += f" {entry.boptions}"
+        else:
+            aoptions = "-vn"
+
+        # In Opus mode volume cannot be changed in python, so ffmpeg must apply it.
+        if self.bot.config.use_opus_audio:
+            aoptions = _add_volume_filter(aoptions, self.volume)
+        return boptions, aoptions
+
+    def _resolve_cache_file(self, entry: EntryTypes) -> None:
+        """
+        Point `entry` at the Opus file its cache file was transcoded to, in
+        case the original was removed after the entry was made ready.
+        """
+        if isinstance(entry, URLPlaylistEntry):
+            entry.filename = self.bot.filecache.get_current_path(entry.filename)
+
+    async def _get_source_codec(self, entry: EntryTypes) -> Optional[str]:
+        """
+        Probe the codec of the media for `entry` when Opus playback could
+        stream-copy it, that is when no ffmpeg filters are needed.
+
+        :returns:  The codec name if it was probed, otherwise None.
+        """
+        if not self.bot.config.use_opus_audio:
+            return None
+
+        if isinstance(entry, StreamPlaylistEntry):
+            return None
+
+        _, aoptions = self._get_source_options(entry)
+        if aoptions != "-vn":
+            return None
+
+        # files transcoded into the cache are known to be Opus already.
+        if self.bot.filecache.is_transcoded(entry.filename):
+            return "opus"
+
+        # use the media index, if the file has been probed before.
+        codec = self.bot.media_store.get_metadata(entry.filename).get("codec")
+        if codec:
+            return str(codec)
+
+        try:
+            codec, _ = await FFmpegOpusAudio.probe(entry.filename)
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.debug("Failed to probe codec for:  %s", entry.filename, exc_info=True)
+            return None
+
+        log.voicedebug(  # type: ignore[attr-defined]
+            "Probed codec %s for:  %s", codec, entry.filename
+        )
+        return codec
+
+    def _create_source(
+        self, entry: EntryTypes, codec: Optional[str] = None
+    ) -> Tuple[SourcePlaybackCounter, "FFmpegStderrSink"]:
+        """
+        Spawn ffmpeg for the given `entry` and wrap it in the audio source
+        chain used for playback.
 
-                stderr_io = io.BytesIO()
+        :param: codec:  Codec of the media, if known. Opus media is copied
+            without re-encoding when Opus playback is enabled.
 
-                self._source = SourcePlaybackCounter(
-                    PCMVolumeTransformer(
+        :returns:  The playback source and the sink ffmpeg stderr is written to.
+        """
+        boptions, aoptions = self._get_source_options(entry)
+
+        log.ffmpeg(  # type: ignore[attr-defined]
+            "Creating player with options: %s %s %s",
+            boptions,
+            aoptions,
+            entry.filename,
+        )
+
+        stderr_sink = FFmpegStderrSink(self.loop, self.ffmpeg_diagnostics)
+
+        audio: Union[
+            PCMMixer,
+            PCMVolumeTransformer[AudioSource],
+            FFmpegOpusAudio,
+            WorkerOpusSource,
+        ]
+        if self._use_shared_decoder(entry):
+            audio = self._apply_volume(
+                shared_decoders.subscribe(
+                    (entry.filename, boptions, aoptions),
+                    functools.partial(
+                        self._open_shared_decoder, entry.filename, boptions, aoptions
+                    ),
+                    stderr_sink,
+                )
+            )
+        elif self._use_audio_workers():
+            audio = audio_workers.open_stream(
+                self.bot.config.audio_worker_processes,
+                entry.filename,
+                boptions,
+                aoptions,
+                self.volume,
+                stderr_sink,
+            )
+        else:
+            stderr = _stderr_reader.open(stderr_sink)
+            try:
+                if self.bot.config.use_opus_audio:
+                    audio = FFmpegOpusAudio(
+                        entry.filename,
+                        codec=codec,
+                        before_options=boptions,
+                        options=aoptions,
+                        stderr=stderr,
+                    )
+                else:
+                    audio = self._apply_volume(
                         FFmpegPCMAudio(
                             entry.filename,
                             before_options=boptions,
                             options=aoptions,
-                            stderr=stderr_io,
-                        ),
-                        self.volume,
-                    ),
-                    start_time=entry.start_time,
-                    playback_speed=entry.playback_speed,
+                            stderr=stderr,
+                        )
+                    )
+            finally:
+                # ffmpeg holds its own copy of the pipe now, if one is used.
+                if stderr is not stderr_sink:
+                    stderr.close()
+
+        source = SourcePlaybackCounter(
+            audio,
+            start_time=entry.start_time,
+            playback_speed=entry.playback_speed,
+            stderr_sink=stderr_sink,
+            timing=self.frame_timing,
+        )
+        return source, stderr_sink
+
+    def _apply_volume(
+        self, pcm: AudioSource
+    ) -> Union[PCMMixer, PCMVolumeTransformer[AudioSource]]:
+        """
+        Wrap the `pcm` source with volume control, using PCMMixer when it is
+        available.
+        """
+        if pcm_mixer_available():
+            return PCMMixer(pcm, self.volume)
+        return PCMVolumeTransformer(pcm, self.volume)
+
+    def _use_audio_workers(self) -> bool:
+        """
+        Check if decoding and encoding should be done by audio worker processes.
+        """
+        return (
+            self.bot.config.audio_worker_processes > 0
+            and not self.bot.config.use_opus_audio
+        )
+
+    def _use_shared_decoder(self, entry: EntryTypes) -> bool:
+        """
+        Check if the `entry` is a live stream which can share its decoder
+        with other players playing the same stream.
+        """
+        if not self.bot.config.share_stream_decoders:
+            return False
+        # shared frames are PCM, so volume can be applied by each player.
+        if self.bot.config.use_opus_audio:
+            return False
+        if not isinstance(entry, StreamPlaylistEntry):
+            return False
+        return entry.info.is_live or not entry.duration
+
+    def _open_shared_decoder(
+        self, filename: str, boptions: str, aoptions: str
+    ) -> Tuple[AudioSource, "FFmpegStderrSink"]:
+        """
+        Spawn ffmpeg for a shared decoder, which has its own stderr sink
+        so its output is not counted against any single player.
+        """
+        stderr_sink = FFmpegStderrSink(self.loop)
+        stderr = _stderr_reader.open(stderr_sink)
+        try:
+            source = FFmpegPCMAudio(
+                filename,
+                before_options=boptions,
+                options=aoptions,
+                stderr=stderr,
+            )
+        finally:
+            if stderr is not stderr_sink:
+                stderr.close()
+        return source, stderr_sink
+
+    def _watch_stderr(self, stderr_sink: "FFmpegStderrSink") -> None:
+        """
+        Use the future of the given `stderr_sink` to check for ffmpeg errors
+        in the current source. Any future for a previous source is resolved.
+        """
+        if (
+            isinstance(self._stderr_future, asyncio.Future)
+            and not self._stderr_future.done()
+        ):
+            self._stderr_future.set_result(True)
+
+        self._stderr_future = stderr_sink.future
+
+    async def restart_source(
+        self,
+        start_time: Optional[float] = None,
+        playback_speed: Optional[float] = None,
+    ) -> bool:
+        """
+        Replace the playing source with a new one opened at `start_time`,
+        or the current progress, without stopping the VoiceClient player.
+        This avoids the player restart and the finished / play events that
+        skipping and re-queuing the current entry would cause.
+        It is used to seek, to change speed, and to apply volume changes
+        when ffmpeg is applying volume.
+
+        :param: start_time:  Position in seconds to restart playback at.
+        :param: playback_speed:  A new playback speed for the current entry.
+
+        :returns:  False if the current entry cannot be restarted this way.
+        """
+        started = time.perf_counter()
+        async with self._play_lock:
+            entry = self._current_entry
+            if (
+                entry is None
+                or self._source is None
+                or self._current_player is None
+                or not (
+                    self._current_player.is_playing()
+                    or self._current_player.is_paused()
                 )
+                or isinstance(entry, StreamPlaylistEntry)
+            ):
+                return False
+
+            entry.set_start_time(self.progress if start_time is None else start_time)
+            if playback_speed is not None:
+                entry.set_playback_speed(playback_speed)
+            self._resolve_cache_file(entry)
+            codec = await self._get_source_codec(entry)
+            source, stderr_sink = self._create_source(entry, codec)
+            await self.loop.run_in_executor(
+                None, source.prime, DEFAULT_GAPLESS_PRIME_FRAMES
+            )
+
+            # Playback may have moved on while ffmpeg was starting.
+            if self._current_entry is not entry or self._current_player is None:
+                source.cleanup()
+                return True
+
+            log.voicedebug(  # type: ignore[attr-defined]
+                "Restarting source at %.2f for entry:  %r", entry.start_time, entry
+            )
+            old_source = self._source
+            self._source = source
+            self._current_player.source = source
+            # Setting the source resumes the audio player, so keep it paused if needed.
+            if self.is_paused:
+                self._current_player.pause()
+            old_source.cleanup()
+            self._watch_stderr(stderr_sink)
+
+            self.last_seek_latency = time.perf_counter() - started
+            log.voicedebug(  # type: ignore[attr-defined]
+                "Source restarted in %.1f ms", self.last_seek_latency * 1000
+            )
+            return True
+
+    async def _prime_next_source(self, entry: EntryTypes) -> None:
+        """
+        Wait until the given `entry` is about to finish, then ready the
+        entry that will play after it and open its source ahead of time.
+        Used by gapless playback and crossfade, this does nothing if `entry`
+        stops being the current entry before it is done.
+        """
+        lead = DEFAULT_GAPLESS_PRIME_LEAD
+        if self.crossfade_enabled:
+            lead += self.bot.config.crossfade_seconds
+
+        if not await self._wait_for_remaining(entry, lead):
+            return
+
+        next_entry = self._get_entry_after(entry)
+        if next_entry is None:
+            return
+
+        try:
+            await next_entry.get_ready_future(DownloadPriority.NEXT_UP)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # Any error will be reported when the entry is actually played.
+            log.debug("Could not ready the next entry for gapless playback.")
+            return
+
+        if self._current_entry is not entry or self.is_dead:
+            return
+
+        self._discard_primed_source()
+        self._resolve_cache_file(next_entry)
+        options = self._get_source_options(next_entry)
+        codec = await self._get_source_codec(next_entry)
+        source, stderr_sink = self._create_source(next_entry, codec)
+        frames = await self.loop.run_in_executor(
+            None, source.prime, DEFAULT_GAPLESS_PRIME_FRAMES
+        )
+
+        # Playback may have moved on while ffmpeg was starting.
+        if self._current_entry is not entry or self.is_dead:
+            source.cleanup()
+            return
+
+        log.voicedebug(  # type: ignore[attr-defined]
+            "Primed %s frames for the next entry:  %r", frames, next_entry
+        )
+        self._primed_source = (next_entry, options, source, stderr_sink)
+
+        if self.crossfade_enabled:
+            await self._crossfade_next_source(entry)
+
+    async def _wait_for_remaining(self, entry: EntryTypes, remaining: float) -> bool:
+        """
+        Wait until the current `entry` has no more than `remaining` seconds
+        of playback left.
+
+        :returns:  False if `entry` stopped playing or has no duration.
+        """
+        while self._current_entry is entry and not self.is_dead:
+            # trailing silence may be trimmed, so playback can end before duration.
+            end_time = entry.end_time
+            if not end_time:
                 log.voicedebug(  # type: ignore[attr-defined]
-                    "Playing %r using %r", self._source, self.voice_client
+                    "Cannot wait for the end of an entry without duration."
                 )
-                self.voice_client.play(self._source, after=self._playback_finished)
+                return False
 
-                self._current_player = self.voice_client
+            left = (end_time - self.progress) / entry.playback_speed
+            if left <= remaining:
+                return True
+            await asyncio.sleep(max(left - remaining, 0.02))
 
-                # I need to add ytdl hooks
-                self.state = MusicPlayerState.PLAYING
-                self._current_entry = entry
+        return False
+
+    def _get_entry_after(self, entry: EntryTypes) -> Optional[EntryTypes]:
+        """
+        Get the entry which will be played once `entry` is finished,
+        taking repeatsong and loopqueue into account.
+        """
+        if self.repeatsong:
+            return entry
+
+        next_entry = self.playlist.peek()
+        if next_entry is None and self.loopqueue:
+            return entry
+        return next_entry
+
+    @property
+    def crossfade_enabled(self) -> bool:
+        """Returns True if crossfade is configured and can be used."""
+        return (
+            self.bot.config.crossfade_seconds > 0
+            and not self.bot.config.use_opus_audio
+            and not self._use_audio_workers()
+            and pcm_mixer_available()
+        )
+
+    async def _crossfade_next_source(self, entry: EntryTypes) -> None:
+        """
+        Wait until `entry` reaches the crossfade point, then start the primed
+        next entry in the running VoiceClient player.
+        The next source fades in while `entry` is mixed in on top of it and
+        fades out, so there is no restart of the player between the two.
+        """
+        fade_time = self.bot.config.crossfade_seconds
+        if not await self._wait_for_remaining(entry, fade_time):
+            return
+
+        async with self._play_lock:
+            if (
+                self._current_entry is not entry
+                or not self.is_playing
+                or self._primed_source is None
+                or self._source is None
+                or self._current_player is None
+            ):
+                return
+
+            next_entry, options, next_source, stderr_sink = self._primed_source
+            mixer = next_source.mixer
+            if (
+                mixer is None
+                or next_entry is not self._get_entry_after(entry)
+                or options != self._get_source_options(next_entry)
+            ):
+                log.voicedebug(  # type: ignore[attr-defined]
+                    "Primed source cannot be used for crossfade, playback will continue without it."
+                )
+                return
+
+            self._primed_source = None
+            old_source = self._source
 
-                self._stderr_future = asyncio.Future()
+            # Queue is updated the same way as when playback finishes.
+            if self.repeatsong:
+                self.playlist.entries.appendleft(entry)
+            elif self.loopqueue:
+                self.playlist.entries.append(entry)
+            await self.playlist.get_next_entry()
 
-                stderr_thread = Thread(
-                    target=filter_stderr,
-                    args=(stderr_io, self._stderr_future),
-                    name="MB_FFmpegStdErrReader",
+            frames = max(1, int(fade_time / 0.02))
+            mixer.main.gain = 0.0
+            mixer.main.set_target(self.volume, frames)
+            old_source.stop_timing()
+            fade_out = mixer.add_source(old_source)
+            fade_out.set_target(0.0, frames)
+
+            log.voicedebug(  # type: ignore[attr-defined]
+                "Crossfading over %.1f seconds into entry:  %r", fade_time, next_entry
+            )
+            self._source = next_source
+            self._current_entry = next_entry
+            self._current_player.source = next_source
+            self._watch_stderr(stderr_sink)
+
+            if not self.bot.config.save_videos:
+                self.loop.call_later(
+                    fade_time + 1,
+                    lambda: self.bot.create_task(
+                        self._handle_file_cleanup(entry), name="MB_CacheCleanup"
+                    ),
                 )
 
-                stderr_thread.start()
+            self.emit("finished-playing", player=self, entry=entry)
+            self.emit("play", player=self, entry=next_entry)
 
-                self.emit("play", player=self, entry=entry)
+            self.bot.create_task(
+                self._prime_next_source(next_entry), name="MB_PrimeNextSource"
+            )
+
+    def _take_primed_source(
+        self, entry: EntryTypes
+    ) -> Optional[Tuple[SourcePlaybackCounter, "FFmpegStderrSink"]]:
+        """
+        Get the primed source if it was opened for `entry` with the same
+        options it would be played with now. Any other primed source is
+        discarded.
+        """
+        if self._primed_source is None:
+            return None
+
+        primed_entry, options, source, stderr_sink = self._primed_source
+        if primed_entry is entry and options == self._get_source_options(entry):
+            self._primed_source = None
+            log.voicedebug(  # type: ignore[attr-defined]
+                "Using primed source for entry:  %r", entry
+            )
+            return source, stderr_sink
+
+        self._discard_primed_source()
+        return None
+
+    def _discard_primed_source(self) -> None:
+        """Close the primed source, if there is one."""
+        if self._primed_source is None:
+            return
+
+        log.voicedebug(  # type: ignore[attr-defined]
+            "Discarding primed source for entry:  %r", self._primed_source[0]
+        )
+        source = self._primed_source[2]
+        self._primed_source = None
+        source.cleanup()
 
     async def _handle_file_cleanup(self, entry: EntryTypes) -> None:
         """
         A helper used to clean up media files via call-later, when file
         cache is not enabled.
         """
+        # the partial file is renamed when complete, so wait for the final name.
+        if isinstance(entry, URLPlaylistEntry) and entry.is_progressive:
+            await entry.wait_for_progressive()
+            # a cancelled download has already removed its partial files.
+            if not os.path.isfile(entry.filename):
+                return
+
         if not isinstance(entry, StreamPlaylistEntry):
-            if any(entry.filename == e.filename for e in self.playlist.entries):
+            # crossfade cleans up while the next entry, maybe this one again, plays.
+            in_use = [e.filename for e in self.playlist.entries]
+            if self._current_entry is not None:
+                in_use.append(self._current_entry.filename)
+            if self._primed_source is not None:
+                in_use.append(self._primed_source[0].filename)
+
+            if entry.filename in in_use:
                 log.debug(
                     "Skipping deletion of '%s', found song in queue",
                     entry.filename,
@@ -608,95 +1365,297 @@ class MusicPlayer(EventEmitter, Serializable):
             return self._source.session_progress
         return 0
 
+    @property
+    def transition_gap(self) -> Optional[float]:
+        """
+        Return the measured time in seconds between the end of the previous
+        track and the first audio of the current one, if it is known.
+        Gaps are only measured when a track plays through to its end.
+        """
+        if self._source and self._source.transition_gap is not None:
+            return self._source.transition_gap
+        return self._last_transition_gap
+
 
 # TODO: I need to add a check if the event loop is closed?
 
 
-def filter_stderr(stderr: io.BytesIO, future: AsyncFuture) -> None:
+def _add_volume_filter(options: str, volume: float) -> str:
     """
-    Consume a `stderr` bytes stream and check it for errors or warnings.
-    Set the given `future` with either an error found in the stream or
-    set the future with a successful result.
+    Add a volume filter to the audio filters in the given ffmpeg `options`.
+    No filter is added if `volume` would not change the audio.
     """
-    last_ex = None
-    while not future.done():
-        data = stderr.readline()
-        if data:
+    if volume == 1.0:
+        return options
+
+    vol_filter = f"volume={volume:.3f}"
+    if "-af " in options:
+        return options.replace("-af ", f"-af {vol_filter},", 1)
+    return f"-af {vol_filter} {options}"
+
+
+class FFmpegStderrSink:
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        counts: Optional["Counter[FFmpegDiagnostic]"] = None,
+        max_lines: int = DEFAULT_FFMPEG_STDERR_LINES,
+    ) -> None:
+        """
+        Collect stderr output from a single ffmpeg process and check each
+        line as it arrives, keeping only the most recent lines.
+        The `future` is set with the first error found in the output, or
+        with a successful result once the output ends.
+
+        :param: loop:  The event loop that owns the future.
+        :param: counts:  Counter updated with the category of each line.
+        :param: max_lines:  Number of recent lines to keep for inspection.
+        """
+        self.loop = loop
+        self.future: AsyncFuture = loop.create_future()
+        self.lines: Deque[bytes] = deque(maxlen=max_lines)
+        self.counts: Counter[FFmpegDiagnostic] = (
+            counts if counts is not None else Counter()
+        )
+        self._partial: bytes = b""
+        self._last_ex: Optional[FFmpegError] = None
+        # Values from ffmpeg -progress output, committed as a pair once complete.
+        self.progress: Optional[Tuple[float, int]] = None
+        self._progress_values: Dict[bytes, bytes] = {}
+
+    def write(self, data: bytes) -> int:
+        """
+        Accept a chunk of stderr output and check any complete lines in it.
+        Called from the thread reading the ffmpeg stderr pipe.
+        """
+        if not data:
+            return 0
+
+        buf = self._partial + data
+        *lines, self._partial = buf.split(b"\n")
+        # A very long line without a newline should not grow without bounds.
+        if len(self._partial) > 4096:
+            lines.append(self._partial)
+            self._partial = b""
+
+        for line in lines:
+            if line.strip():
+                self._check_line(line + b"\n")
+        return len(data)
+
+    def close(self, ex: Optional[FFmpegError] = None) -> None:
+        """
+        Check any remaining output and resolve the future.
+        Called when the ffmpeg stderr pipe is closed.
+
+        :param: ex:  An error found elsewhere, such as by a shared decoder.
+        """
+        if self._partial.strip():
+            self._check_line(self._partial)
+        self._partial = b""
+        if ex is not None:
+            self._last_ex = ex
+        self._resolve(self._last_ex)
+
+    @property
+    def error(self) -> Optional[FFmpegError]:
+        """The last error found in the output, if any."""
+        return self._last_ex
+
+    def _check_line(self, data: bytes) -> None:
+        """Store and inspect a single line of stderr output."""
+        progress = _FFMPEG_PROGRESS_RE.match(data)
+        if progress:
+            self._update_progress(progress.group(1), progress.group(2))
+            return
+
+        self.lines.append(data)
+        log.ffmpeg(  # type: ignore[attr-defined]
+            "Data from ffmpeg: %s",
+            repr(data),
+        )
+        result = classify_stderr(data)
+        self.counts[result.category] += 1
+
+        if result.category == FFmpegDiagnostic.OTHER:
+            sys.stderr.buffer.write(data)
+            sys.stderr.buffer.flush()
+
+        elif result.category == FFmpegDiagnostic.FATAL:
             log.ffmpeg(  # type: ignore[attr-defined]
-                "Data from ffmpeg: %s",
-                repr(data),
+                "Error from ffmpeg: %s", result.message
             )
-            try:
-                if check_stderr(data):
-                    sys.stderr.buffer.write(data)
-                    sys.stderr.buffer.flush()
+            self._last_ex = FFmpegError(result.message)
+            self._resolve(self._last_ex)
 
-            except FFmpegError as e:
-                log.ffmpeg(  # type: ignore[attr-defined]
-                    "Error from ffmpeg: %s", str(e).strip()
-                )
-                last_ex = e
-                if not future.done():
-                    future.set_exception(e)
-
-            except FFmpegWarning as e:
-                log.ffmpeg(  # type: ignore[attr-defined]
-                    "Warning from ffmpeg:  %s", str(e).strip()
-                )
         else:
-            time.sleep(0.5)
+            log.ffmpeg(  # type: ignore[attr-defined]
+                "%s from ffmpeg:  %s", result.category, result.message
+            )
 
-    if not future.done():
-        if last_ex:
-            future.set_exception(last_ex)
-        else:
-            future.set_result(True)
+    def _update_progress(self, key: bytes, value: bytes) -> None:
+        """
+        Collect a key from an ffmpeg -progress report. Each report ends with
+        a `progress` key, when the output time and size are stored together.
+        """
+        if key != b"progress":
+            self._progress_values[key] = value
+            return
 
+        out_time_us = self._progress_values.get(b"out_time_us", b"")
+        total_size = self._progress_values.get(b"total_size", b"")
+        if out_time_us.isdigit() and total_size.isdigit():
+            self.progress = (int(out_time_us) / 1000000, int(total_size))
 
-def check_stderr(data: bytes) -> bool:
-    """
-    Inspect `data` from a subprocess call's stderr output for specific
-    messages and raise them as a suitable exception.
+    def _resolve(self, ex: Optional[Exception]) -> None:
+        """Thread-safe way to set the future with `ex` or a successful result."""
 
-    :returns:  True if nothing was detected or nothing could be detected.
+        def _set() -> None:
+            if self.future.done():
+                return
+            if ex:
+                self.future.set_exception(ex)
+            else:
+                self.future.set_result(True)
 
-    :raises: musicbot.exceptions.FFmpegWarning
-        If a warning level message was detected in the `data`
-    :raises: musicbot.exceptions.FFmpegError
-        If an error message was detected in the `data`
-    """
-    ddata = ""
-    try:
-        ddata = data.decode("utf8")
-    except UnicodeDecodeError:
-        log.ffmpeg(  # type: ignore[attr-defined]
-            "Unknown error decoding message from ffmpeg", exc_info=True
+        try:
+            self.loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            log.noise(  # type: ignore[attr-defined]
+                "Event loop closed before ffmpeg stderr was resolved."
+            )
+
+
+class FFmpegStderrReader:
+    def __init__(self) -> None:
+        """
+        Read the stderr pipes of all ffmpeg processes from one thread, and
+        pass the output to the sink for each process.
+        On platforms where pipes cannot be used with select, like Windows,
+        sinks are handed directly to discord.py which reads each pipe itself.
+        """
+        self._use_pipes: bool = os.name != "nt"
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[int, FFmpegStderrSink]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._wake_r: int = -1
+        self._wake_w: int = -1
+
+    def open(self, sink: FFmpegStderrSink) -> IO[bytes]:
+        """
+        Get a writable stderr target for a new ffmpeg process, which feeds
+        the given `sink`.  If a pipe is returned, the caller must close it
+        once the process has been started.
+        """
+        if not self._use_pipes:
+            # discord.py only calls write() on a stderr object with no fileno().
+            return sink  # type: ignore[return-value]
+
+        read_fd, write_fd = os.pipe()
+        with self._lock:
+            self._pending.append((read_fd, sink))
+            self._ensure_thread()
+        os.write(self._wake_w, b"\0")
+        return os.fdopen(write_fd, "wb", buffering=0)
+
+    def _ensure_thread(self) -> None:
+        """Start the reader thread if it is not running. Requires the lock."""
+        if self._thread is not None:
+            return
+
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._thread = threading.Thread(
+            target=self._run,
+            name="MB_FFmpegStdErrReader",
+            daemon=True,
         )
-        return True  # fuck it
-
-    log.ffmpeg("Decoded data from ffmpeg: %s", ddata)  # type: ignore[attr-defined]
-
-    # TODO: Regex
-    warnings = [
-        "Header missing",
-        "Estimating duration from birate, this may be inaccurate",
-        "Using AVStream.codec to pass codec parameters to muxers is deprecated, use AVStream.codecpar instead.",
-        "Application provided invalid, non monotonically increasing dts to muxer in stream",
-        "Last message repeated",
-        "Failed to send close message",
-        "decode_band_types: Input buffer exhausted before END element found",
-    ]
-    errors = [
-        "Invalid data found when processing input",  # need to regex this properly, its both a warning and an error
-    ]
-
-    if any(msg in ddata for msg in warnings):
-        raise FFmpegWarning(ddata)
-
-    if any(msg in ddata for msg in errors):
-        raise FFmpegError(ddata)
-
-    return True
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Wait for output on any registered pipe and pass it to its sink."""
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_r, selectors.EVENT_READ, None)
+        while True:
+            for key, _ in selector.select():
+                if key.data is None:
+                    self._register_pending(selector)
+                    continue
+
+                try:
+                    data = os.read(key.fd, 4096)
+                except OSError:
+                    data = b""
+
+                sink: FFmpegStderrSink = key.data
+                if not data:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+
+                # One bad sink should not stop the reader for every other player.
+                try:
+                    if data:
+                        sink.write(data)
+                    else:
+                        sink.close()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    log.exception("Failed to handle ffmpeg stderr output.")
+
+    def _register_pending(self, selector: selectors.BaseSelector) -> None:
+        """Add newly opened pipes to the `selector`."""
+        try:
+            os.read(self._wake_r, 4096)
+        except BlockingIOError:
+            pass
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        for read_fd, sink in pending:
+            selector.register(read_fd, selectors.EVENT_READ, sink)
+
+
+# Shared by all players, so there is only one thread reading ffmpeg stderr.
+_stderr_reader = FFmpegStderrReader()
+
+
+# Messages from ffmpeg stderr we know about, grouped by FFmpegDiagnostic name.
+# This is compiled once and matched on raw bytes, so each line is scanned only once.
+_FFMPEG_DIAGNOSTIC_RE = re.compile(
+    rb"(?P<FATAL>Invalid data found when processing input)"
+    rb"|(?P<NETWORK>Connection reset by peer|Connection timed out|"
+    rb"Connection refused|Server returned 5\d\d|Will reconnect at|"
+    rb"Failed to reconnect|End of file while reconnecting)"
+    rb"|(?P<CODEC>Header missing|Error while decoding stream|"
+    rb"decode_band_types: Input buffer exhausted before END element found|"
+    rb"Invalid frame|Packet corrupt|invalid band type)"
+    rb"|(?P<WARNING>Estimating duration from bitrate, this may be inaccurate|"
+    rb"Estimating duration from birate, this may be inaccurate|"
+    rb"Using AVStream\.codec to pass codec parameters to muxers is deprecated|"
+    rb"Application provided invalid, non monotonically increasing dts to muxer in stream|"
+    rb"Last message repeated|Failed to send close message)"
+)
+
+
+# Lines of `key=value` written by ffmpeg when -progress is used.
+_FFMPEG_PROGRESS_RE = re.compile(rb"^([a-z0-9_]+)=(\S*)\s*$")
+
+
+def classify_stderr(data: bytes) -> FFmpegStderrLine:
+    """
+    Inspect a line of `data` from a subprocess call's stderr output for
+    known messages, and report which category it falls into.
+
+    :returns:  The category and decoded message of the line.
+    """
+    match = _FFMPEG_DIAGNOSTIC_RE.search(data)
+    if match and match.lastgroup:
+        category = FFmpegDiagnostic[match.lastgroup]
+    else:
+        category = FFmpegDiagnostic.OTHER
+
+    message = data.decode("utf8", errors="replace").strip()
+    return FFmpegStderrLine(category, message)
 
 
 # if redistributing ffmpeg is an issue, it can be downloaded from here:
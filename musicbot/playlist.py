@@ -23,6 +23,7 @@ from .constructs import Serializable
 from .entry import LocalFilePlaylistEntry, StreamPlaylistEntry, URLPlaylistEntry
 from .exceptions import ExtractionError, InvalidDataError, WrongEntryTypeError
 from .lib.event_emitter import EventEmitter
+from .scheduler import DownloadPriority
 
 if TYPE_CHECKING:
     from .bot import MusicBot
@@ -56,6 +57,8 @@ class Playlist(EventEmitter, Serializable):
         self.bot: "MusicBot" = bot
         self.loop: asyncio.AbstractEventLoop = bot.loop
         self.entries: Deque[EntryTypes] = deque()
+        self._prefetched: Dict[int, URLPlaylistEntry] = {}
+        self._prefetch_retry: Optional[asyncio.TimerHandle] = None
 
     def __iter__(self) -> Iterator[EntryTypes]:
         return iter(self.entries)
@@ -66,10 +69,12 @@ class Playlist(EventEmitter, Serializable):
     def shuffle(self) -> None:
         """Shuffle the deque of entries, in place."""
         shuffle(self.entries)
+        self.refresh_prefetch()
 
     def clear(self) -> None:
         """Clears the deque of entries."""
         self.entries.clear()
+        self.refresh_prefetch()
 
     def get_entry_at_index(self, index: int) -> EntryTypes:
         """
@@ -86,6 +91,21 @@ class Playlist(EventEmitter, Serializable):
         self.entries.rotate(-index)
         entry = self.entries.popleft()
         self.entries.rotate(index)
+        self.refresh_prefetch()
+        return entry
+
+    def move_entry(self, from_index: int, to_index: int) -> EntryTypes:
+        """
+        Move the entry at `from_index` to `to_index` in the queue.
+        Unlike deleting and inserting it, this will not cancel its download.
+        """
+        self.entries.rotate(-from_index)
+        entry = self.entries.popleft()
+        self.entries.rotate(from_index)
+        self.entries.rotate(-to_index)
+        self.entries.appendleft(entry)
+        self.entries.rotate(to_index)
+        self.refresh_prefetch()
         return entry
 
     def insert_entry_at_index(self, index: int, entry: EntryTypes) -> None:
@@ -93,6 +113,7 @@ class Playlist(EventEmitter, Serializable):
         self.entries.rotate(-index)
         self.entries.appendleft(entry)
         self.entries.rotate(index)
+        self.refresh_prefetch()
 
     async def add_stream_from_info(
         self,
@@ -427,6 +448,8 @@ class Playlist(EventEmitter, Serializable):
         if self.bot.config.round_robin_queue and not entry.from_auto_playlist:
             self.reorder_for_round_robin()
 
+        self.refresh_prefetch()
+
         self.emit(
             "entry-added", playlist=self, entry=entry, defer_serialize=defer_serialize
         )
@@ -435,41 +458,118 @@ class Playlist(EventEmitter, Serializable):
         """
         A coroutine which will return the next song or None if no songs left to play.
 
-        Additionally, if predownload_next is set to True, it will attempt to download the next
-        song to be played - so that it's ready by the time we get to it.
+        Additionally, if predownload_next is set to True, it will attempt to download
+        the songs in the pre-download window - so they are ready by the time we get to them.
         """
         if not self.entries:
             return None
 
         entry = self.entries.popleft()
+        prefetched = self._prefetched.pop(id(entry), None)
+        if prefetched is not None:
+            self.bot.download_scheduler.prefetch_budget.release(prefetched)
         self.bot.create_task(
-            self._pre_download_entry_after_next(entry),
+            self._pre_download_after_delay(),
             name="MB_PreDownloadNextUp",
         )
 
-        return await entry.get_ready_future()
+        return await entry.get_ready_future(DownloadPriority.NOW_PLAYING)
 
-    async def _pre_download_entry_after_next(self, last_entry: EntryTypes) -> None:
+    async def _pre_download_after_delay(self) -> None:
         """
-        Enforces a delay before doing pre-download of the "next" song.
+        Enforces a delay before updating the pre-download window, so the
+        song about to play is not competing with downloads of later songs.
         Should only be called from get_next_entry() after pop.
         """
-        if not self.bot.config.pre_download_next_song:
+        if not self.bot.config.pre_download_next_song or not self.entries:
             return
 
-        if not self.entries:
-            return
+        await asyncio.sleep(DEFAULT_PRE_DOWNLOAD_DELAY)
+        self.refresh_prefetch()
 
-        # get the next entry to pre-download before we wait.
-        next_entry = self.peek()
+    def _cancel_unqueued_downloads(self) -> None:
+        """
+        Cancel downloads of entries which were removed from the queue,
+        unless they are about to be played.
+        """
+        queued = {id(e) for e in self.entries}
+        for req in self.bot.download_scheduler.get_requests(self):
+            if req.priority == DownloadPriority.NOW_PLAYING:
+                continue
+            if id(req.entry) not in queued:
+                req.entry.cancel_download()
 
-        await asyncio.sleep(DEFAULT_PRE_DOWNLOAD_DELAY)
+    def cancel_downloads(self) -> None:
+        """Cancel every queued or running download of entries in this playlist."""
+        for req in self.bot.download_scheduler.get_requests(self):
+            req.entry.cancel_download()
+
+    def _get_prefetch_window(self) -> List[URLPlaylistEntry]:
+        """
+        Get the queued entries which should be downloaded ahead of time.
+        The window covers up to PreDownloadEntries songs, and stops early
+        once the songs before it add up to PreDownloadSeconds of audio.
+        """
+        max_seconds = self.bot.config.pre_download_seconds
+        window: List[URLPlaylistEntry] = []
+        total = 0.0
+        for entry in islice(self.entries, self.bot.config.pre_download_entries):
+            if max_seconds and total >= max_seconds:
+                break
+            total += entry.duration or 0
+            if isinstance(entry, URLPlaylistEntry):
+                window.append(entry)
+        return window
+
+    def refresh_prefetch(self) -> None:
+        """
+        Start downloads for entries in the pre-download window, and cancel
+        queued downloads of entries which were moved out of it.  Downloads
+        of entries removed from the queue are cancelled even if running.
+        The next song is always downloaded, later songs must fit in the
+        global prefetch disk and bandwidth budget.
+        """
+        if self._prefetch_retry is not None:
+            self._prefetch_retry.cancel()
+            self._prefetch_retry = None
+
+        self._cancel_unqueued_downloads()
+
+        scheduler = self.bot.download_scheduler
+        budget = scheduler.prefetch_budget
+        window: List[URLPlaylistEntry] = []
+        if self.bot.config.pre_download_next_song:
+            window = self._get_prefetch_window()
+
+        in_window = {id(e) for e in window}
+        for key, entry in list(self._prefetched.items()):
+            if key not in in_window:
+                del self._prefetched[key]
+                scheduler.cancel(entry)
+                budget.release(entry)
+
+        for idx, entry in enumerate(window):
+            if id(entry) in self._prefetched:
+                continue
 
-        if next_entry and next_entry != last_entry:
+            priority = DownloadPriority.NEXT_UP
+            if idx > 0:
+                priority = DownloadPriority.PREFETCH
+                if not entry.is_downloaded:
+                    wait = budget.reserve(entry)
+                    if wait < 0:
+                        break
+                    if wait > 0:
+                        self._prefetch_retry = self.loop.call_later(
+                            wait, self.refresh_prefetch
+                        )
+                        break
+
+            self._prefetched[id(entry)] = entry
             log.everything(  # type: ignore[attr-defined]
-                "Pre-downloading next track:  %r", next_entry
+                "Pre-downloading track:  %r", entry
             )
-            next_entry.get_ready_future()
+            entry.get_ready_future(priority)
 
     def peek(self) -> Optional[EntryTypes]:
         """
@@ -492,21 +592,23 @@ class Playlist(EventEmitter, Serializable):
 
         :raises: musicbot.exceptions.InvalidDataError  if duration data cannot be calculated.
         """
-        if any(e.duration is None for e in islice(self.entries, position - 1)):
+        ends = [e.end_time for e in islice(self.entries, position - 1)]
+        if any(end is None for end in ends):
             raise InvalidDataError("no duration data")
 
+        # entries may have leading and trailing silence trimmed.
         estimated_time = sum(
-            e.duration_td.total_seconds() for e in islice(self.entries, position - 1)
+            (end or 0) - e.start_time
+            for e, end in zip(islice(self.entries, position - 1), ends)
         )
 
         # When the player plays a song, it eats the first playlist item, so we just have to add the time back
         if not player.is_stopped and player.current_entry:
-            if player.current_entry.duration is None:
+            end_time = player.current_entry.end_time
+            if end_time is None:
                 raise InvalidDataError("no duration data in current entry")
 
-            estimated_time += (
-                player.current_entry.duration_td.total_seconds() - player.progress
-            )
+            estimated_time += end_time - player.progress
 
         return datetime.timedelta(seconds=estimated_time)
 
@@ -0,0 +1,149 @@
+import asyncio
+import enum
+import heapq
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .constants import DEFAULT_HELPER_WAIT_SAMPLES, DEFAULT_MAX_HELPER_PROCESSES
+
+log = logging.getLogger(__name__)
+
+
+class ProcPriority(enum.IntEnum):
+    """Priority classes for helper processes, lower values run first."""
+
+    PLAYBACK = 0
+    BACKGROUND = 1
+
+
+class HelperProcessPool:
+    def __init__(self, max_procs: int = DEFAULT_MAX_HELPER_PROCESSES) -> None:
+        """
+        Run helper processes like ffprobe and ffmpeg analysis with a global
+        limit on how many run at once, so they cannot starve the ffmpeg
+        processes used for live playback.  Waiting calls start in order of
+        priority, and background work always leaves one slot free for
+        probes which playback is waiting on.
+        """
+        self.max_procs = max(1, max_procs)
+        self._active: Dict[ProcPriority, int] = {p: 0 for p in ProcPriority}
+        self._waiters: List[Tuple[int, int, "asyncio.Future[None]"]] = []
+        self._seq: int = 0
+        self._waits: Deque[float] = deque(maxlen=DEFAULT_HELPER_WAIT_SAMPLES)
+        self._timeouts: int = 0
+        self._completed: int = 0
+
+    def _can_start(self, priority: ProcPriority) -> bool:
+        """Check if a process of the given `priority` may start now."""
+        if sum(self._active.values()) >= self.max_procs:
+            return False
+        if priority == ProcPriority.BACKGROUND:
+            background_limit = max(1, self.max_procs - 1)
+            return self._active[ProcPriority.BACKGROUND] < background_limit
+        return True
+
+    async def _acquire(self, priority: ProcPriority) -> None:
+        """Wait for a process slot, taking it before returning."""
+        # only wait behind calls of the same or a higher priority.
+        ahead = self._waiters and self._waiters[0][0] <= priority
+        if not ahead and self._can_start(priority):
+            self._active[priority] += 1
+            self._waits.append(0.0)
+            return
+
+        queued_at = time.monotonic()
+        self._seq += 1
+        item = (int(priority), self._seq, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, item)
+        try:
+            await item[2]
+        except asyncio.CancelledError:
+            if item in self._waiters:
+                self._waiters.remove(item)
+                heapq.heapify(self._waiters)
+            elif not item[2].cancelled():
+                # the slot was handed over already, pass it to another waiter.
+                self._release(priority)
+            raise
+        self._waits.append(time.monotonic() - queued_at)
+
+    def _release(self, priority: ProcPriority) -> None:
+        """Free a process slot and wake up waiters which may start."""
+        self._active[priority] -= 1
+        # waiters are ordered by priority, so stop at the first which cannot start.
+        while self._waiters and self._can_start(ProcPriority(self._waiters[0][0])):
+            prio, _, fut = heapq.heappop(self._waiters)
+            # a cancelled waiter has not resumed yet, it does not take a slot.
+            if fut.done():
+                continue
+            self._active[ProcPriority(prio)] += 1
+            fut.set_result(None)
+
+    async def run(
+        self,
+        cmd: List[str],
+        *,
+        priority: ProcPriority,
+        timeout: float,
+        stdout: Optional[int] = asyncio.subprocess.PIPE,
+        stderr: Optional[int] = asyncio.subprocess.PIPE,
+    ) -> Tuple[Optional[int], bytes, bytes]:
+        """
+        Run the command `cmd` when a process slot is free, and wait for it
+        to exit.  The process is killed if it runs longer than `timeout`.
+
+        :returns:  A tuple of return code, stdout, and stderr.  Output is
+            empty bytes for any stream which is not piped.
+
+        :raises: asyncio.TimeoutError  if the process was killed after timeout.
+        :raises: OSError  if the process could not be started.
+        """
+        await self._acquire(priority)
+        try:
+            p = await asyncio.create_subprocess_exec(
+                # No shell is used, element 0 of `cmd` must be an executable path.
+                *cmd,
+                stdout=stdout,
+                stderr=stderr,
+            )
+            log.noise(  # type: ignore[attr-defined]
+                "Started helper process (%s) with command: %s", p, cmd
+            )
+            try:
+                out, err = await asyncio.wait_for(p.communicate(), timeout)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                log.warning(
+                    "Helper process timed out after %.1f seconds:  %s", timeout, cmd[0]
+                )
+                p.kill()
+                await p.wait()
+                raise
+            self._completed += 1
+            return p.returncode, out or b"", err or b""
+        finally:
+            self._release(priority)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the running and waiting process counts, recent times calls
+        waited for a slot, and totals of completed and timed out calls.
+        """
+        waits = list(self._waits)
+        queued = {p.name.lower(): 0 for p in ProcPriority}
+        for prio, _, _ in self._waiters:
+            queued[ProcPriority(prio).name.lower()] += 1
+        return {
+            "active": sum(self._active.values()),
+            "max_active": self.max_procs,
+            "queued": queued,
+            "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait": max(waits, default=0.0),
+            "completed": self._completed,
+            "timeouts": self._timeouts,
+        }
+
+
+helper_procs = HelperProcessPool()
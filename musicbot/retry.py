@@ -0,0 +1,217 @@
+import asyncio
+import enum
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Set, TypeVar
+
+import aiohttp
+from yt_dlp.networking.exceptions import (  # type: ignore[import-untyped]
+    HTTPError,
+    TransportError,
+)
+from yt_dlp.utils import (  # type: ignore[import-untyped]
+    ContentTooShortError,
+    DownloadCancelled,
+    DownloadError,
+)
+
+from .constants import (
+    DEFAULT_RETRY_ATTEMPTS,
+    DEFAULT_RETRY_BASE_DELAY,
+    DEFAULT_RETRY_DEADLINE,
+    DEFAULT_RETRY_MAX_DELAY,
+    DEFAULT_RETRY_RATE_LIMIT_DELAY,
+)
+from .exceptions import DownloadCancelledError
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Words in error messages which suggest a temporary network problem.
+_TRANSIENT_HINTS = (
+    "timed out",
+    "timeout",
+    "connection reset",
+    "connection refused",
+    "connection aborted",
+    "temporary failure",
+    "remote end closed",
+    "incomplete read",
+    "http error 5",
+)
+
+
+class RetryClass(enum.Enum):
+    """How an error should be handled by a RetryPolicy."""
+
+    TRANSIENT = "transient"
+    RATE_LIMITED = "rate_limited"
+    PERMANENT = "permanent"
+
+
+def _classify_status(status: int) -> RetryClass:
+    """Classify an HTTP response status code."""
+    if status == 429:
+        return RetryClass.RATE_LIMITED
+    if status >= 500 or status == 408:
+        return RetryClass.TRANSIENT
+    return RetryClass.PERMANENT
+
+
+def _get_retry_after(e: BaseException) -> Optional[float]:
+    """Get the seconds from a Retry-After header attached to `e`, if any."""
+    headers: Any = None
+    if isinstance(e, aiohttp.ClientResponseError):
+        headers = e.headers
+    elif isinstance(e, HTTPError):
+        headers = e.response.headers
+
+    if not headers:
+        return None
+    try:
+        return float(headers.get("Retry-After", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(e: BaseException) -> RetryClass:
+    """
+    Decide if the error `e` is worth retrying.  Wrapping exceptions are
+    followed to their cause, so errors from yt-dlp which are re-raised as
+    ExtractionError are classified by their original error.
+    """
+    seen: Set[int] = set()
+    ex: Optional[BaseException] = e
+    while ex is not None and id(ex) not in seen:
+        seen.add(id(ex))
+
+        if isinstance(ex, (DownloadCancelled, DownloadCancelledError)):
+            return RetryClass.PERMANENT
+        if isinstance(ex, HTTPError):
+            return _classify_status(ex.status)
+        if isinstance(ex, aiohttp.ClientResponseError):
+            return _classify_status(ex.status)
+        if isinstance(
+            ex,
+            (
+                ContentTooShortError,
+                TransportError,
+                aiohttp.ClientConnectionError,
+                asyncio.TimeoutError,
+                ConnectionError,
+            ),
+        ):
+            return RetryClass.TRANSIENT
+
+        # yt-dlp keeps the original error of a DownloadError in exc_info.
+        if isinstance(ex, DownloadError) and ex.exc_info and ex.exc_info[1]:
+            if ex.exc_info[1] is not ex:
+                ex = ex.exc_info[1]
+                continue
+
+        msg = str(ex).lower()
+        if "http error 429" in msg or "too many requests" in msg:
+            return RetryClass.RATE_LIMITED
+        if any(hint in msg for hint in _TRANSIENT_HINTS):
+            return RetryClass.TRANSIENT
+
+        ex = ex.__cause__
+
+    return RetryClass.PERMANENT
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        name: str,
+        attempts: int = DEFAULT_RETRY_ATTEMPTS,
+        base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+        max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+        deadline: float = DEFAULT_RETRY_DEADLINE,
+        classify: Callable[[BaseException], RetryClass] = classify_error,
+    ) -> None:
+        """
+        Retry failed calls using exponential backoff with random jitter, so
+        callers which fail together do not retry together.
+        Errors are classified and permanent errors are never retried.
+        Rate limits pause every caller sharing this policy, until the
+        delay asked for by the remote has passed.
+
+        :param: name:  Used to identify the policy in logs.
+        :param: attempts:  Maximum number of calls made per request.
+        :param: base_delay:  Seconds of the first backoff, doubled each retry.
+        :param: max_delay:  Upper limit for a single backoff.
+        :param: deadline:  Seconds after which a request is not retried again.
+        :param: classify:  Function used to classify errors.
+        """
+        self.name = name
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.classify = classify
+        self._cooldown_until: float = 0.0
+
+    def get_delay(self, attempt: int, kind: RetryClass) -> float:
+        """Get the seconds to wait before retrying after `attempt` failed."""
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if kind == RetryClass.RATE_LIMITED:
+            cap = max(cap, DEFAULT_RETRY_RATE_LIMIT_DELAY)
+        return random.uniform(cap / 2, cap)
+
+    async def _wait_for_cooldown(self) -> None:
+        """Wait for a rate limit cooldown shared by this policy, if any."""
+        wait = self._cooldown_until - time.monotonic()
+        if wait > 0:
+            log.debug("Retry policy %s is cooling down for %.1fs", self.name, wait)
+            await asyncio.sleep(wait)
+
+    async def run(self, func: Callable[[], Awaitable[T]], what: str = "") -> T:
+        """
+        Await `func()` and return its result, calling it again after
+        transient failures until attempts or the deadline run out.
+        The last error is raised if the call does not succeed.
+
+        :param: func:  A callable which returns a new awaitable each call.
+        :param: what:  Describes the request in log messages.
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._wait_for_cooldown()
+            try:
+                return await func()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                kind = self.classify(e)
+                if kind == RetryClass.PERMANENT or attempt >= self.attempts:
+                    raise
+
+                delay = self.get_delay(attempt, kind)
+                if kind == RetryClass.RATE_LIMITED:
+                    retry_after = _get_retry_after(e)
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    self._cooldown_until = max(
+                        self._cooldown_until, time.monotonic() + delay
+                    )
+
+                if time.monotonic() - started + delay > self.deadline:
+                    log.debug(
+                        "Retry policy %s deadline reached for:  %s", self.name, what
+                    )
+                    raise
+
+                log.warning(
+                    "Request failed (%s), retrying in %.1f seconds, attempt %s of %s."
+                    "\nRequest:  %s\nReason:  %s",
+                    kind.value,
+                    delay,
+                    attempt + 1,
+                    self.attempts,
+                    what,
+                    e,
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,307 @@
+import asyncio
+import enum
+import logging
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional
+from urllib.parse import urlparse
+
+from .constants import (
+    DEFAULT_DOWNLOAD_WAIT_SAMPLES,
+    DEFAULT_ESTIMATED_BITRATE,
+    DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+    DEFAULT_MAX_DOWNLOADS_PER_HOST,
+)
+
+if TYPE_CHECKING:
+    from .bot import MusicBot
+    from .entry import URLPlaylistEntry
+    from .playlist import Playlist
+
+log = logging.getLogger(__name__)
+
+
+class DownloadPriority(enum.IntEnum):
+    """Priority classes for entry downloads, lower values run first."""
+
+    NOW_PLAYING = 0
+    NEXT_UP = 1
+    PREFETCH = 2
+    CACHE_WARM = 3
+
+
+def estimate_download_size(entry: "URLPlaylistEntry") -> int:
+    """
+    Guess how many bytes downloading `entry` will use, from the size
+    reported by extraction or from its duration and bitrate.
+    """
+    data = entry.info.data
+    size = data.get("filesize") or data.get("filesize_approx")
+    if size:
+        return int(size)
+    kbps = data.get("abr") or data.get("tbr") or DEFAULT_ESTIMATED_BITRATE
+    return int((entry.duration or 0) * kbps * 125)
+
+
+class PrefetchBudget:
+    def __init__(self, max_bytes: int, bandwidth: int) -> None:
+        """
+        Track disk and bandwidth use of songs downloaded ahead of time,
+        shared by every guild.  Disk use is held from when a prefetch is
+        reserved until it is released, and bandwidth is a token bucket
+        refilled at `bandwidth` bytes per second.  Zero disables a limit.
+        """
+        self.max_bytes = max_bytes
+        self.bandwidth = bandwidth
+        self._held: Dict[int, int] = {}
+        self._tokens: float = float(bandwidth)
+        self._refilled_at: float = time.monotonic()
+
+    @property
+    def held_bytes(self) -> int:
+        """Bytes reserved by prefetched entries which have not been released."""
+        return sum(self._held.values())
+
+    def _refill(self) -> None:
+        """Add tokens for the time passed since the last refill."""
+        now = time.monotonic()
+        # allow a burst of up to one minute of the budget.
+        self._tokens = min(
+            self._tokens + (now - self._refilled_at) * self.bandwidth,
+            self.bandwidth * 60.0,
+        )
+        self._refilled_at = now
+
+    def reserve(self, entry: "URLPlaylistEntry") -> float:
+        """
+        Try to reserve budget for prefetching `entry`.
+        Returns 0 if the entry may be prefetched, or the number of seconds
+        to wait before bandwidth allows it.  If disk space does not allow
+        it, -1 is returned as waiting will not help.
+        """
+        if id(entry) in self._held:
+            return 0.0
+
+        size = estimate_download_size(entry)
+        if self.max_bytes and self.held_bytes + size > self.max_bytes:
+            return -1.0
+
+        if self.bandwidth:
+            self._refill()
+            # a single huge file may use the bucket once it is full.
+            need = min(float(size), self.bandwidth * 60.0)
+            if self._tokens < need:
+                return (need - self._tokens) / self.bandwidth
+            self._tokens -= size
+
+        self._held[id(entry)] = size
+        return 0.0
+
+    def release(self, entry: "URLPlaylistEntry") -> None:
+        """Release disk budget held for `entry`, if any."""
+        self._held.pop(id(entry), None)
+
+
+class DownloadRequest:
+    def __init__(
+        self,
+        entry: "URLPlaylistEntry",
+        priority: DownloadPriority,
+        seq: int,
+    ) -> None:
+        """
+        Hold a request to download an entry, waiting for the scheduler.
+        """
+        self.entry = entry
+        self.priority = priority
+        self.seq = seq
+        # each guild has its own playlist, so it is used to share downloads fairly.
+        self.owner: int = id(entry.playlist)
+        self.host: str = urlparse(entry.url).hostname or ""
+        self.queued_at: float = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.done: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+
+    def __repr__(self) -> str:
+        return (
+            f"<DownloadRequest({self.priority.name}, "
+            f"host='{self.host}', entry={self.entry!r})>"
+        )
+
+
+class DownloadScheduler:
+    def __init__(
+        self,
+        bot: "MusicBot",
+        max_active: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+        max_per_host: int = DEFAULT_MAX_DOWNLOADS_PER_HOST,
+    ) -> None:
+        """
+        Decide when entry downloads start.  Requests run in order of
+        priority class, then go to the guild with the fewest downloads
+        running, then oldest first.  Concurrency is capped globally and
+        per host, and background classes leave one slot free for entries
+        that are about to play.
+        """
+        self.bot = bot
+        self.max_active = max(1, max_active)
+        self.max_per_host = max(1, max_per_host)
+        self._seq: int = 0
+        self._pending: List[DownloadRequest] = []
+        self._active: List[DownloadRequest] = []
+        self._by_entry: Dict[int, DownloadRequest] = {}
+        self._waits: Deque[float] = deque(maxlen=DEFAULT_DOWNLOAD_WAIT_SAMPLES)
+        self.prefetch_budget = PrefetchBudget(
+            bot.config.pre_download_max_bytes,
+            bot.config.pre_download_bandwidth,
+        )
+
+    async def run(self, entry: "URLPlaylistEntry", priority: DownloadPriority) -> None:
+        """
+        Download the `entry` when the scheduler allows it, and wait until
+        the download is done.  If the entry is already waiting, its
+        priority is raised to `priority` if that is higher.
+        """
+        req = self._by_entry.get(id(entry))
+        if req is not None:
+            self.raise_priority(entry, priority)
+            await asyncio.shield(req.done)
+            return
+
+        # cached files do not use bandwidth, so there is no reason to wait.
+        if entry.expected_filename and entry.filecache.get_if_cached(
+            entry.expected_filename, media_key=entry.media_key
+        ):
+            await entry._download()  # pylint: disable=protected-access
+            return
+
+        self._seq += 1
+        req = DownloadRequest(entry, priority, self._seq)
+        self._pending.append(req)
+        self._by_entry[id(entry)] = req
+        log.everything(  # type: ignore[attr-defined]
+            "Queued download request:  %r", req
+        )
+        self._dispatch()
+        await asyncio.shield(req.done)
+
+    def raise_priority(
+        self, entry: "URLPlaylistEntry", priority: DownloadPriority
+    ) -> None:
+        """
+        Raise the priority of a request for `entry` to `priority`, if one
+        exists and it is lower.  Running requests keep the higher priority
+        so they are treated as needed by playback.
+        """
+        req = self._by_entry.get(id(entry))
+        if req is None or priority >= req.priority:
+            return
+
+        log.debug("Raising download priority to %s for:  %r", priority.name, entry)
+        req.priority = priority
+        if req.started_at is None:
+            self._dispatch()
+
+    def get_requests(self, playlist: "Playlist") -> List[DownloadRequest]:
+        """Get waiting and running requests for entries in the given `playlist`."""
+        return [r for r in self._by_entry.values() if r.owner == id(playlist)]
+
+    def cancel(self, entry: "URLPlaylistEntry", force: bool = False) -> bool:
+        """
+        Remove a waiting request for `entry` from the queue.
+        Returns True if a request was removed.  Downloads already running
+        are not removed, and requests for playing now are only removed
+        if `force` is set.
+        """
+        req = self._by_entry.get(id(entry))
+        if req is None or req.started_at is not None:
+            return False
+        if req.priority == DownloadPriority.NOW_PLAYING and not force:
+            return False
+
+        log.debug("Cancelled queued download request:  %r", req)
+        self._pending.remove(req)
+        del self._by_entry[id(req.entry)]
+        req.done.set_result(None)
+        # the download will not run, so anything waiting on the entry must stop.
+        req.entry._for_each_future(  # pylint: disable=protected-access
+            lambda future: future.cancel()
+        )
+        return True
+
+    def _count_active(self, attr: str, value: Any) -> int:
+        """Count active requests having `attr` equal to `value`."""
+        return sum(1 for r in self._active if getattr(r, attr) == value)
+
+    def _pick_next(self) -> Optional[DownloadRequest]:
+        """Get the pending request that should start next, if any can start."""
+        if len(self._active) >= self.max_active:
+            return None
+
+        background_limit = max(1, self.max_active - 1)
+        background_active = sum(
+            1 for r in self._active if r.priority >= DownloadPriority.PREFETCH
+        )
+
+        best: Optional[DownloadRequest] = None
+        best_key = None
+        for req in self._pending:
+            if self._count_active("host", req.host) >= self.max_per_host:
+                continue
+            if (
+                req.priority >= DownloadPriority.PREFETCH
+                and background_active >= background_limit
+            ):
+                continue
+            key = (req.priority, self._count_active("owner", req.owner), req.seq)
+            if best_key is None or key < best_key:
+                best, best_key = req, key
+        return best
+
+    def _dispatch(self) -> None:
+        """Start as many pending requests as the limits allow."""
+        while True:
+            req = self._pick_next()
+            if req is None:
+                return
+
+            self._pending.remove(req)
+            self._active.append(req)
+            req.started_at = time.monotonic()
+            self._waits.append(req.started_at - req.queued_at)
+            self.bot.create_task(self._execute(req), name="MB_ScheduledDownload")
+
+    async def _execute(self, req: DownloadRequest) -> None:
+        """Run the download for `req` and start the next request after it."""
+        try:
+            await req.entry._download()  # pylint: disable=protected-access
+            if not req.done.done():
+                req.done.set_result(None)
+            # progressive downloads keep using bandwidth after playback starts.
+            await req.entry.wait_for_progressive()
+        finally:
+            self._active.remove(req)
+            self._by_entry.pop(id(req.entry), None)
+            if not req.done.done():
+                req.done.set_result(None)
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the current queue depth for each priority class, the number of
+        running downloads, and recent times requests waited to start.
+        """
+        now = time.monotonic()
+        queued = {p.name.lower(): 0 for p in DownloadPriority}
+        for req in self._pending:
+            queued[req.priority.name.lower()] += 1
+        waits = list(self._waits)
+        return {
+            "active": len(self._active),
+            "max_active": self.max_active,
+            "queued": queued,
+            "oldest_wait": max((now - r.queued_at for r in self._pending), default=0.0),
+            "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait": max(waits, default=0.0),
+            "prefetch_bytes": self.prefetch_budget.held_bytes,
+        }
@@ -11,6 +11,7 @@ from urllib.parse import urlparse
 import aiohttp
 
 from .exceptions import SpotifyError
+from .retry import RetryPolicy
 
 log = logging.getLogger(__name__)
 
@@ -366,6 +367,7 @@ class Spotify:
         self.guest_mode: bool = client_id is None or client_secret is None
 
         self.aiosession = aiosession
+        self.retry_policy = RetryPolicy("spotify")
         self.loop = loop if loop else asyncio.get_event_loop()
 
         self._token: Optional[Dict[str, Any]] = None
@@ -567,12 +569,21 @@ class Spotify:
     async def _make_get(
         self, url: str, headers: Optional[Dict[str, str]] = None
     ) -> Dict[str, Any]:
-        """Makes a GET request and returns the results"""
-        try:
+        """
+        Makes a GET request and returns the results.
+        Network errors, server errors, and rate limits are retried.
+        """
+
+        async def _get() -> Dict[str, Any]:
             async with self.aiosession.get(url, headers=headers) as r:
                 if r.status != 200:
-                    raise SpotifyError(
-                        f"Response status is not OK: [{r.status}] {r.reason}"
+                    # raised as a response error, so the retry policy can see the status.
+                    raise aiohttp.ClientResponseError(
+                        r.request_info,
+                        r.history,
+                        status=r.status,
+                        message=f"Response status is not OK: [{r.status}] {r.reason}",
+                        headers=r.headers,
                     )
                 # log.everything("Spotify API GET:  %s\nData:  %s", url, await r.text() )
                 data = await r.json()  # type: Dict[str, Any]
@@ -580,9 +591,13 @@ class Spotify:
                     raise SpotifyError("Response JSON did not decode to a dict!")
 
                 return data
+
+        try:
+            return await self.retry_policy.run(_get, what=url)
         except (
             aiohttp.ClientError,
             aiohttp.ContentTypeError,
+            asyncio.TimeoutError,
             JSONDecodeError,
             SpotifyError,
         ) as e:
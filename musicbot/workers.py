@@ -0,0 +1,369 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from discord import AudioSource, FFmpegPCMAudio, PCMVolumeTransformer, opus
+
+from .constants import DEFAULT_AUDIO_WORKER_CREDITS
+from .exceptions import FFmpegError
+from .mixer import PCMMixer, pcm_mixer_available
+
+if TYPE_CHECKING:
+    from .player import FFmpegStderrSink
+
+log = logging.getLogger(__name__)
+
+# Message types sent from worker processes back to MusicBot.
+MSG_PACKET = "P"  # An encoded Opus packet.
+MSG_ERROR = "E"  # A fatal message found in ffmpeg stderr.
+MSG_END = "X"  # The stream has ended, no more packets will be sent.
+
+
+class _WorkerStderr:
+    def __init__(self, stream: "_WorkerStream") -> None:
+        """
+        Collect ffmpeg stderr output inside a worker process, and report
+        fatal messages back to MusicBot.
+        """
+        self.stream = stream
+        self._partial: bytes = b""
+
+    def write(self, data: bytes) -> int:
+        # imported here to avoid a circular import, player uses this module.
+        from .player import FFmpegDiagnostic, classify_stderr
+
+        if not data:
+            return 0
+
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        for line in lines:
+            result = classify_stderr(line)
+            if result.category == FFmpegDiagnostic.FATAL:
+                self.stream.send(MSG_ERROR, result.message)
+        return len(data)
+
+
+class _WorkerStream:
+    def __init__(
+        self,
+        sid: int,
+        conn: Connection,
+        send_lock: threading.Lock,
+        filename: str,
+        boptions: str,
+        aoptions: str,
+        volume: float,
+    ) -> None:
+        """
+        Decode, apply volume to, and encode a single stream inside a worker
+        process. Packets are only produced while the stream has credit,
+        which MusicBot grants as it plays packets.
+        """
+        self.sid = sid
+        self._conn = conn
+        self._send_lock = send_lock
+        self._credits = threading.Semaphore(0)
+        self._closed = False
+
+        pcm = FFmpegPCMAudio(
+            filename,
+            before_options=boptions,
+            options=aoptions,
+            stderr=_WorkerStderr(self),  # type: ignore[arg-type]
+        )
+        self.source: AudioSource
+        if pcm_mixer_available():
+            self.source = PCMMixer(pcm, volume)
+        else:
+            self.source = PCMVolumeTransformer(pcm, volume)
+        self.encoder = opus.Encoder()
+
+        self._thread = threading.Thread(
+            target=self._run, name=f"MB_AudioWorkerStream-{sid}", daemon=True
+        )
+        self._thread.start()
+
+    def send(self, kind: str, payload: Any = None) -> None:
+        """Send a message about this stream to MusicBot."""
+        with self._send_lock:
+            self._conn.send((kind, self.sid, payload))
+
+    def add_credit(self, count: int) -> None:
+        """Allow `count` more packets to be produced."""
+        for _ in range(count):
+            self._credits.release()
+
+    def set_volume(self, volume: float) -> None:
+        """Change volume of the stream."""
+        if isinstance(self.source, (PCMMixer, PCMVolumeTransformer)):
+            self.source.volume = volume
+
+    def close(self) -> None:
+        """Stop producing packets and clean up the stream."""
+        self._closed = True
+        self._credits.release()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                self._credits.acquire()
+                if self._closed:
+                    break
+
+                data = self.source.read()
+                if not data:
+                    break
+
+                packet = self.encoder.encode(data, opus.Encoder.SAMPLES_PER_FRAME)
+                self.send(MSG_PACKET, packet)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.send(MSG_ERROR, f"Audio worker failed: {e}")
+        finally:
+            self.source.cleanup()
+            if not self._closed:
+                self.send(MSG_END)
+
+
+def _worker_main(conn: Connection) -> None:
+    """
+    Entry point of an audio worker process. Handles control messages from
+    MusicBot until told to stop or the connection is closed.
+    """
+    send_lock = threading.Lock()
+    streams: Dict[int, _WorkerStream] = {}
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        cmd, sid, *args = msg
+        if cmd == "open":
+            try:
+                streams[sid] = _WorkerStream(sid, conn, send_lock, *args)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                with send_lock:
+                    conn.send((MSG_ERROR, sid, f"Audio worker failed to open: {e}"))
+                    conn.send((MSG_END, sid, None))
+        elif cmd == "stop":
+            break
+        elif sid in streams:
+            if cmd == "credit":
+                streams[sid].add_credit(args[0])
+            elif cmd == "volume":
+                streams[sid].set_volume(args[0])
+            elif cmd == "close":
+                streams.pop(sid).close()
+
+    for stream in streams.values():
+        stream.close()
+
+
+class WorkerOpusSource(AudioSource):
+    def __init__(
+        self,
+        worker: "AudioWorker",
+        sid: int,
+        volume: float,
+        stderr_sink: "FFmpegStderrSink",
+    ) -> None:
+        """
+        An AudioSource for packets encoded by an audio worker process.
+        The VoiceClient only has to send these packets, and packets are
+        requested from the worker as they are played.
+        """
+        self.worker = worker
+        self.sid = sid
+        self.stderr_sink = stderr_sink
+        self.messages: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self._volume = volume
+        self._consumed: int = 0
+        self._closed: bool = False
+        self._ended: bool = False
+
+    @property
+    def volume(self) -> float:
+        """Volume the worker applies to this stream."""
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float) -> None:
+        self._volume = value
+        self.worker.send(("volume", self.sid, value))
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        while not self._closed and not self._ended:
+            try:
+                kind, payload = self.messages.get(timeout=0.5)
+            except queue.Empty:
+                if not self.worker.is_alive():
+                    self._end(FFmpegError("Audio worker process has stopped."))
+                continue
+
+            if kind == MSG_PACKET:
+                # ask for more packets in small batches, to limit messages.
+                self._consumed += 1
+                if self._consumed >= DEFAULT_AUDIO_WORKER_CREDITS // 4:
+                    self.worker.send(("credit", self.sid, self._consumed))
+                    self._consumed = 0
+                return payload  # type: ignore[no-any-return]
+
+            if kind == MSG_ERROR:
+                self.stderr_sink.close(FFmpegError(payload))
+            elif kind == MSG_END:
+                self._end(None)
+        return b""
+
+    def _end(self, ex: Optional[FFmpegError]) -> None:
+        """Mark the stream as ended and resolve the stderr sink."""
+        self._ended = True
+        self.stderr_sink.close(ex)
+        self.worker.release(self.sid)
+
+    def cleanup(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if not self._ended:
+            self.worker.send(("close", self.sid))
+            self.worker.release(self.sid)
+
+
+class AudioWorker:
+    def __init__(self, ctx: Any, index: int) -> None:
+        """
+        Start an audio worker process, and a thread to receive its messages.
+        """
+        self.index = index
+        self._conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn,),
+            name=f"MB_AudioWorker-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+        self._lock = threading.Lock()
+        self._streams: Dict[int, WorkerOpusSource] = {}
+        self._reader = threading.Thread(
+            target=self._run, name=f"MB_AudioWorkerReader-{index}", daemon=True
+        )
+        self._reader.start()
+
+    @property
+    def load(self) -> int:
+        """Number of streams running in this worker."""
+        return len(self._streams)
+
+    def is_alive(self) -> bool:
+        """Returns True if the worker process is running."""
+        return self.process.is_alive()
+
+    def send(self, msg: Tuple[Any, ...]) -> None:
+        """Send a control message to the worker process."""
+        try:
+            with self._lock:
+                self._conn.send(msg)
+        except (OSError, ValueError):
+            log.debug("Could not send message to audio worker %s", self.index)
+
+    def open_stream(
+        self,
+        sid: int,
+        filename: str,
+        boptions: str,
+        aoptions: str,
+        volume: float,
+        stderr_sink: "FFmpegStderrSink",
+    ) -> WorkerOpusSource:
+        """Start a stream in the worker and get its source."""
+        source = WorkerOpusSource(self, sid, volume, stderr_sink)
+        self._streams[sid] = source
+        self.send(("open", sid, filename, boptions, aoptions, volume))
+        self.send(("credit", sid, DEFAULT_AUDIO_WORKER_CREDITS))
+        return source
+
+    def release(self, sid: int) -> None:
+        """Forget about a stream which has ended or was closed."""
+        self._streams.pop(sid, None)
+
+    def stop(self) -> None:
+        """Ask the worker process to exit."""
+        self.send(("stop", 0))
+
+    def _run(self) -> None:
+        """Pass messages from the worker process to the stream they are for."""
+        while True:
+            try:
+                kind, sid, payload = self._conn.recv()
+            except (EOFError, OSError):
+                break
+
+            source = self._streams.get(sid)
+            if source is not None:
+                source.messages.put((kind, payload))
+
+        log.debug("Audio worker %s has closed its connection.", self.index)
+        for source in list(self._streams.values()):
+            source.messages.put((MSG_ERROR, "Audio worker process has stopped."))
+            source.messages.put((MSG_END, None))
+
+
+class AudioWorkerPool:
+    def __init__(self) -> None:
+        """
+        Manage worker processes which decode, apply volume to, and encode
+        audio, so encoding for many players is not limited to one core.
+        Workers are started when they are first needed.
+        """
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._workers: List[AudioWorker] = []
+        self._next_sid: int = 0
+
+    def open_stream(
+        self,
+        processes: int,
+        filename: str,
+        boptions: str,
+        aoptions: str,
+        volume: float,
+        stderr_sink: "FFmpegStderrSink",
+    ) -> WorkerOpusSource:
+        """
+        Open a stream in the least busy of `processes` workers, starting or
+        replacing worker processes as needed.
+        """
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < processes:
+                idx = len(self._workers)
+                log.debug("Starting audio worker process %s", idx)
+                self._workers.append(AudioWorker(self._ctx, idx))
+
+            worker = min(self._workers[:processes], key=lambda w: w.load)
+            self._next_sid += 1
+            sid = self._next_sid
+
+        return worker.open_stream(
+            sid, filename, boptions, aoptions, volume, stderr_sink
+        )
+
+    def shutdown(self) -> None:
+        """Ask all worker processes to exit."""
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            self._workers.clear()
+
+
+# Shared by all players, so workers are shared too.
+audio_workers = AudioWorkerPool()